@@ -1,13 +1,54 @@
 from django.contrib import admin
 
 # Register your models here.
-from django.contrib import admin
-from .models import Subject, Question, Option, Explanation
+import os
+import tempfile
+
+from django import forms
+from django.contrib import admin, messages
+from django.http import FileResponse, StreamingHttpResponse
+from django.shortcuts import redirect, render
+from django.urls import path
+
+from . import analytics, search, tasks
+from .admin_pagination import CursorPaginationMixin, EstimatedCountPaginator
+from .jobs import IMPORT_BANK, RECONCILE_STATS
+from .models import (
+    Subject, Question, Option, Explanation, UserProgress, Submission, QuestionStats, OptionStats, UserSubjectSummary,
+    QuizAttempt, Job,
+)
+from .questionbank import CSV, JSONL, BankError, QuestionBank, bank_lines, write_bank
+
+
+class QuestionBankImportForm(forms.Form):
+    bank = forms.FileField(help_text="A .jsonl or .csv question bank, or a .zip with questions.jsonl/questions.csv and its images.")
+    images = forms.FileField(required=False, help_text="Optional zip of images for a plain .jsonl/.csv bank.")
+    dry_run = forms.BooleanField(required=False, help_text="Only validate, don't import.")
+    skip_duplicates = forms.BooleanField(
+        required=False, help_text="Skip questions that look like ones already in the bank."
+    )
+
+
+def _stats(obj):
+    try:
+        return obj.stats
+    except (QuestionStats.DoesNotExist, OptionStats.DoesNotExist):
+        return None
+
 
 class OptionInline(admin.TabularInline):
     model = Option
     extra = 4
-    fields = ('text_content', 'image_content', 'is_correct')
+    fields = ('text_content', 'image_content', 'is_correct', 'selections')
+    readonly_fields = ('selections',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('stats')
+
+    @admin.display(description="Times picked")
+    def selections(self, obj):
+        stats = _stats(obj) if obj.pk else None
+        return stats.selections if stats else 0
     
     def formfield_for_choice_field(self, db_field, request, **kwargs):
         if db_field.name == "is_correct":
@@ -22,23 +63,222 @@ class ExplanationInline(admin.StackedInline):
 
 @admin.register(Subject)
 class SubjectAdmin(admin.ModelAdmin):
-    list_display = ('name', 'description','logo_image')
+    list_display = ('name', 'description','logo_image', 'selection_mode', 'question_limit', 'time_limit')
     search_fields = ('name',)
 
 @admin.register(Question)
 class QuestionAdmin(admin.ModelAdmin):
-    list_display = ('id', 'subject', 'question_type', 'preview')
+    list_display = ('id', 'subject', 'order', 'question_type', 'preview',
+                    'answers', 'success_rate', 'first_try_rate', 'hint_rate')
+    list_editable = ('order',)
     list_filter = ('subject', 'question_type')
+    # Stats come from the QuestionStats rollup, never from UserProgress
+    list_select_related = ('subject', 'stats')
+    search_fields = ('=id', 'text_content')
+    autocomplete_fields = ('subject',)
+    ordering = ('subject', 'order', 'id')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     inlines = [OptionInline, ExplanationInline]
-    fields = ('subject', 'question_type', 'text_content', 'image_content', 'hint')
+    fields = ('subject', 'order', 'question_type', 'text_content', 'image_content', 'hint')
+    actions = ['export_jsonl', 'export_csv', 'export_zip', 'export_stats_csv', 'recompute_stats']
+
+    def get_search_results(self, request, queryset, search_term):
+        # Words go to the full-text index (text, hint, options, explanation);
+        # a bare id, or a database without a search backend, uses search_fields.
+        term = search_term.strip()
+        ids = None if not term or term.isdigit() else search.matching_ids(term)
+        if ids is None:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=ids), False
     
     def preview(self, obj):
         if obj.question_type == 'text':
             return obj.text_content[:50] + '...' if obj.text_content else 'No content'
         return "Image Question"
+
+    @admin.display(description="Answers", ordering='stats__submissions')
+    def answers(self, obj):
+        stats = _stats(obj)
+        return stats.submissions if stats else 0
+
+    @admin.display(description="Success %", ordering='stats__correct')
+    def success_rate(self, obj):
+        stats = _stats(obj)
+        return stats.success_rate if stats else None
+
+    @admin.display(description="First try %", ordering='stats__first_try_correct')
+    def first_try_rate(self, obj):
+        stats = _stats(obj)
+        return stats.first_try_rate if stats else None
+
+    @admin.display(description="Hint %", ordering='stats__hints_used')
+    def hint_rate(self, obj):
+        stats = _stats(obj)
+        return stats.hint_rate if stats else None
     
     class Media:
         css = {
             'all': ('quiz/css/admin.css',)
         }
         js = ('quiz/js/admin.js',)
+
+    # ----------------- QUESTION BANK IMPORT / EXPORT -----------------
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='quiz_app_question_import'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        if not self.has_add_permission(request):
+            return redirect('admin:quiz_app_question_changelist')
+        form = QuestionBankImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            job, created = self._queue_import(form)
+            if job is not None:
+                verb = 'validation' if form.cleaned_data['dry_run'] else 'import'
+                if created:
+                    self.message_user(request, f"Queued the {verb} as job #{job.pk}; its report shows here when done.")
+                else:
+                    self.message_user(request, f"This {verb} was queued before as job #{job.pk}.", messages.WARNING)
+                return redirect('admin:quiz_app_job_change', job.pk)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import question bank',
+            'form': form,
+        }
+        return render(request, 'admin/quiz_app/question/import.html', context)
+
+    def _queue_import(self, form):
+        """Hand the uploads to an import job. Returns ``(job, created)``; job is None
+        (and the form has an error) if the bank can't be read."""
+        bank_path, bank_hash = tasks.stash(form.cleaned_data['bank'])
+        images = form.cleaned_data['images']
+        images_path, images_hash = tasks.stash(images) if images else (None, '')
+        stashed = [path for path in (bank_path, images_path) if path]
+        try:
+            # Opening checks the format and the zip layout without reading any records
+            with QuestionBank(bank_path, images=images_path):
+                pass
+        except BankError as exc:
+            form.add_error('bank', str(exc))
+            job, created = None, False
+        else:
+            options = {'dry_run': form.cleaned_data['dry_run'], 'skip_duplicates': form.cleaned_data['skip_duplicates']}
+            # The same files with the same options (a double submit) are imported once
+            key = f"import:{bank_hash}:{images_hash}:{int(options['dry_run'])}{int(options['skip_duplicates'])}"
+            job = tasks.enqueue(IMPORT_BANK, {'path': bank_path, 'images': images_path, **options}, key=key)
+            created = job.payload['path'] == bank_path
+            if created:
+                stashed = []  # the job removes them
+        for path in stashed:
+            os.remove(path)
+        return job, created
+
+    def _stream(self, queryset, fmt):
+        response = StreamingHttpResponse(
+            bank_lines(queryset, fmt),
+            content_type='text/csv' if fmt == CSV else 'application/x-ndjson',
+        )
+        response['Content-Disposition'] = f'attachment; filename="questions.{fmt}"'
+        return response
+
+    @admin.action(description="Export selected questions (JSONL)")
+    def export_jsonl(self, request, queryset):
+        return self._stream(queryset, JSONL)
+
+    @admin.action(description="Export selected questions (CSV)")
+    def export_csv(self, request, queryset):
+        return self._stream(queryset, CSV)
+
+    @admin.action(description="Export stats of selected questions (CSV)")
+    def export_stats_csv(self, request, queryset):
+        response = StreamingHttpResponse(analytics.csv_lines(queryset), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="question_stats.csv"'
+        return response
+
+    @admin.action(description="Recompute stats of selected questions (in the background)")
+    def recompute_stats(self, request, queryset):
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+        # One job per chunk keeps payloads small and lets workers share a big selection
+        jobs = [
+            tasks.enqueue(RECONCILE_STATS, {'question_ids': ids[start:start + 1000]})
+            for start in range(0, len(ids), 1000)
+        ]
+        self.message_user(request, f"Queued {len(jobs)} jobs to recompute the stats of {len(ids)} questions.")
+
+    @admin.action(description="Export selected questions with images (zip)")
+    def export_zip(self, request, queryset):
+        # A zip needs seeking to finish, so it is spooled to a temp file rather than held in memory
+        fh = tempfile.TemporaryFile()
+        write_bank(fh, queryset, fmt=JSONL, with_images=True)
+        fh.seek(0)
+        return FileResponse(fh, as_attachment=True, filename='questions.zip', content_type='application/zip')
+
+
+# ----------------- PROGRESS & SUBMISSIONS (read-only) -----------------
+class ReadOnlyAdmin(CursorPaginationMixin, admin.ModelAdmin):
+    """Browse-only admin for large history tables: keyset pages, no edits."""
+    list_per_page = 100
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(UserProgress)
+class UserProgressAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'user', 'subject', 'question_id', 'attempt_id', 'attempts', 'answered_correctly', 'hint_used', 'updated_at')
+    list_filter = ('subject', 'answered_correctly', 'hint_used')
+    list_select_related = ('user', 'subject')
+    # Exact matches only, so the lookups stay on indexes
+    search_fields = ('=user__username', '=question__id')
+    date_hierarchy = 'updated_at'
+
+
+@admin.register(Submission)
+class SubmissionAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'user', 'question_id', 'selected_option_id', 'submitted_at')
+    list_select_related = ('user',)
+    search_fields = ('=user__username', '=question__id')
+    date_hierarchy = 'submitted_at'
+
+
+@admin.register(UserSubjectSummary)
+class UserSubjectSummaryAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'user', 'subject', 'answered', 'correct', 'finished', 'hints_used', 'last_activity')
+    list_filter = ('subject',)
+    list_select_related = ('user', 'subject')
+    search_fields = ('=user__username',)
+
+
+@admin.register(QuizAttempt)
+class QuizAttemptAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'user', 'subject', 'number', 'selection_mode', 'started_at', 'deadline', 'submitted_at', 'archived_at', 'answered', 'correct', 'score_percentage')
+    list_filter = ('subject',)
+    list_select_related = ('user', 'subject')
+    search_fields = ('=user__username',)
+
+
+# ----------------- BACKGROUND JOBS -----------------
+@admin.register(Job)
+class JobAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'name', 'status', 'priority', 'attempts', 'max_attempts', 'run_at', 'finished_at', 'locked_by')
+    list_filter = ('status', 'name')
+    search_fields = ('=idempotency_key',)
+    actions = ['retry_jobs']
+
+    def has_delete_permission(self, request, obj=None):
+        # Deleting a finished job frees its idempotency key
+        return request.user.has_perm('quiz_app.delete_job')
+
+    @admin.action(description="Run selected jobs again")
+    def retry_jobs(self, request, queryset):
+        count = tasks.retry(queryset)
+        self.message_user(request, f"Queued {count} jobs to run again.")
@@ -0,0 +1,121 @@
+# admin_pagination.py
+"""Changelist pagination for very large tables.
+
+* ``estimated_count`` returns the planner's row estimate for an unfiltered
+  table (PostgreSQL ``pg_class.reltuples``, MySQL ``information_schema``,
+  SQL Server ``sys.partitions``, SQLite ``sqlite_stat1`` after ANALYZE).
+  Filtered querysets are counted exactly, but only up to ``COUNT_LIMIT``
+  rows. ``EstimatedCountPaginator`` uses it for its ``count``.
+* ``CursorPaginationMixin`` makes a ModelAdmin page by keyset
+  (``?cursor=<pk>`` shows the rows with a smaller pk) instead of OFFSET, so
+  page 10,000 costs the same as page 1.
+"""
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+
+CURSOR_VAR = "cursor"
+
+# Exact counts below this; table estimates above it
+ESTIMATE_THRESHOLD = 100_000
+# Filtered counts stop here and are shown as "at least"
+COUNT_LIMIT = 100_000
+
+_ESTIMATE_SQL = {
+    "postgresql": "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+    "mysql": (
+        "SELECT table_rows FROM information_schema.tables "
+        "WHERE table_schema = DATABASE() AND table_name = %s"
+    ),
+    "microsoft": "SELECT SUM(rows) FROM sys.partitions WHERE object_id = OBJECT_ID(%s) AND index_id IN (0, 1)",
+}
+
+
+def table_estimate(model, using="default"):
+    """The database's own row estimate for ``model``'s table, or None if it has none."""
+    connection = connections[using]
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == "sqlite":
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+                if cursor.fetchone() is None:
+                    return None
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+                row = cursor.fetchone()
+                return int(row[0].split()[0]) if row else None
+            sql = _ESTIMATE_SQL.get(connection.vendor)
+            if sql is None:
+                return None
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    # PostgreSQL reports -1 for tables that were never analyzed
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+def estimated_count(queryset):
+    if not queryset.query.where:
+        estimate = table_estimate(queryset.model, queryset.db)
+        if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+            return estimate
+    return queryset[:COUNT_LIMIT].count()
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list)
+
+
+class CursorChangeList(ChangeList):
+    def get_results(self, request):
+        cursor = getattr(request, "admin_cursor", None)
+        queryset = self.queryset
+        if cursor:
+            queryset = queryset.filter(pk__lt=cursor)
+        rows = list(queryset[: self.list_per_page + 1])
+
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.result_count_is_capped = self.result_count >= COUNT_LIMIT and bool(self.queryset.query.where)
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.result_list = rows[: self.list_per_page]
+        self.can_show_all = False
+        self.multi_page = True
+        self.cursor = cursor
+        self.next_cursor = self.result_list[-1].pk if len(rows) > self.list_per_page else None
+
+    @property
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor}) if self.next_cursor else None
+
+    @property
+    def first_page_url(self):
+        return self.get_query_string(remove=[CURSOR_VAR]) if self.cursor else None
+
+
+class CursorPaginationMixin:
+    """Keyset pagination on ``-pk`` for a ModelAdmin. Column sorting is off,
+    because the cursor only works with that one ordering."""
+
+    change_list_template = "admin/quiz_app/cursor_change_list.html"
+    ordering = ("-pk",)
+    sortable_by = ()
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    def get_changelist(self, request, **kwargs):
+        return CursorChangeList
+
+    def changelist_view(self, request, extra_context=None):
+        # ChangeList treats unknown parameters as filters, so take the cursor out first
+        if CURSOR_VAR in request.GET:
+            request.GET = request.GET.copy()
+            value = request.GET.pop(CURSOR_VAR)[-1]
+            request.admin_cursor = int(value) if value.isdigit() else None
+        return super().changelist_view(request, extra_context)
@@ -0,0 +1,290 @@
+# analytics.py
+"""Per-question and per-option answer statistics.
+
+``QuestionStats`` and ``OptionStats`` are rollups, so the admin, the CSV
+export and any dashboard read them instead of scanning ``UserProgress`` and
+``Submission``. They are kept current in two ways:
+
+* Incrementally. ``recording.apply_answer`` attaches an ``AnswerDelta`` to
+  every ``Submission`` it creates, and the submission writer passes each
+  batch it writes to :func:`record`. A batch costs two UPDATEs, one for
+  its questions and one for its options, each ``CASE`` over the row ids.
+* By reconciliation. :func:`reconcile` recomputes everything from the
+  source tables, one chunk of questions at a time, with grouped aggregates
+  and an upsert per chunk. Run it periodically (the ``reconcile_question_stats``
+  command) to correct drift, e.g. from concurrent answers to the same
+  question or rows deleted by hand. Submissions moved to the columnar
+  archive (``history.py``) are counted from there.
+"""
+import csv
+from collections import Counter, defaultdict, namedtuple
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Case, Count, F, PositiveIntegerField, Q, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import history
+from .instrumentation import setup
+from .models import ArchivedProgress, Question, Option, QuestionStats, OptionStats, UserProgress, Submission
+
+QUESTION_COUNTERS = ("submissions", "learners", "correct", "first_try_correct", "hints_used")
+
+AnswerDelta = namedtuple("AnswerDelta", ["first_attempt", "first_try_correct", "correct", "new_hint"])
+
+
+def answer_delta(progress, is_correct, hint_used):
+    """The stats change of one answer, from ``progress`` as it was *before* the answer.
+
+    ``correct`` and ``first_try_correct`` are signed, and count what
+    :func:`reconcile` counts: rows that are correct now, and rows correct
+    after a single attempt. An answer that takes either away subtracts it.
+    """
+    first_attempt = progress.attempts == 0
+    return AnswerDelta(
+        first_attempt=first_attempt,
+        first_try_correct=int(first_attempt and is_correct)
+        - int(progress.attempts == 1 and progress.answered_correctly),
+        correct=int(is_correct) - int(progress.answered_correctly),
+        new_hint=hint_used and not progress.hint_used,
+    )
+
+
+# ----------------- INCREMENTAL -----------------
+def _plan(submissions):
+    questions = defaultdict(Counter)
+    options = Counter()
+    option_questions = {}
+    for submission in submissions:
+        delta = getattr(submission, "stats_delta", None)
+        if delta is None:
+            continue
+        counters = questions[submission.question_id]
+        counters["submissions"] += 1
+        counters["learners"] += delta.first_attempt
+        counters["correct"] += delta.correct
+        counters["first_try_correct"] += delta.first_try_correct
+        counters["hints_used"] += delta.new_hint
+        if submission.selected_option_id:
+            options[submission.selected_option_id] += 1
+            option_questions[submission.selected_option_id] = submission.question_id
+    return questions, options, option_questions
+
+
+def _increment(name, value):
+    # Clamped, so a decrement on stats that were never reconciled can't go negative
+    return Greatest(F(name) + value, 0) if value < 0 else F(name) + value
+
+
+def _question_increments(questions):
+    # One CASE per counter, so the whole batch is a single UPDATE
+    update = {}
+    for name in QUESTION_COUNTERS:
+        whens = [
+            When(pk=question_id, then=_increment(name, counters[name]))
+            for question_id, counters in questions.items() if counters[name]
+        ]
+        if whens:
+            update[name] = Case(*whens, default=F(name), output_field=PositiveIntegerField())
+    return update
+
+
+def _option_increments(options):
+    return {"selections": Case(
+        *(When(pk=option_id, then=F("selections") + count) for option_id, count in options.items()),
+        default=F("selections"), output_field=PositiveIntegerField(),
+    )}
+
+
+def _missing(model, ids):
+    return set(ids) - set(model.objects.filter(pk__in=ids).values_list("pk", flat=True))
+
+
+def _create_missing(questions, options, option_questions, updated, selected):
+    """Create the rows the UPDATEs of :func:`record` didn't find, with their increments."""
+    missing_questions = _missing(QuestionStats, questions) if updated < len(questions) else set()
+    if missing_questions:
+        QuestionStats.objects.bulk_create(
+            [QuestionStats(question_id=qid) for qid in missing_questions], ignore_conflicts=True,
+        )
+        QuestionStats.objects.filter(pk__in=missing_questions).update(
+            **_question_increments({qid: questions[qid] for qid in missing_questions})
+        )
+    missing_options = _missing(OptionStats, options) if selected < len(options) else set()
+    if missing_options:
+        OptionStats.objects.bulk_create(
+            [OptionStats(option_id=oid, question_id=option_questions[oid]) for oid in missing_options],
+            ignore_conflicts=True,
+        )
+        OptionStats.objects.filter(pk__in=missing_options).update(
+            **_option_increments({oid: options[oid] for oid in missing_options})
+        )
+
+
+def record(submissions):
+    """Add the deltas of freshly written ``submissions`` to the rollups: one
+    UPDATE for the questions and one for the options. A question's or
+    option's first answer creates its row (``instrumentation.setup``).
+
+    Without a transaction of its own: a partial update is corrected by the
+    next reconciliation, and the async ORM couldn't hold one anyway.
+    """
+    questions, options, option_questions = _plan(submissions)
+    if not questions:
+        return
+    now = timezone.now()
+    updated = QuestionStats.objects.filter(pk__in=questions).update(updated_at=now, **_question_increments(questions))
+    selected = OptionStats.objects.filter(pk__in=options).update(**_option_increments(options)) if options else 0
+    if updated < len(questions) or selected < len(options):
+        with setup():
+            _create_missing(questions, options, option_questions, updated, selected)
+
+
+async def arecord(submissions):
+    questions, options, option_questions = _plan(submissions)
+    if not questions:
+        return
+    now = timezone.now()
+    updated = await QuestionStats.objects.filter(pk__in=questions).aupdate(
+        updated_at=now, **_question_increments(questions)
+    )
+    selected = await OptionStats.objects.filter(pk__in=options).aupdate(**_option_increments(options)) if options else 0
+    if updated < len(questions) or selected < len(options):
+        with setup():
+            await sync_to_async(_create_missing)(questions, options, option_questions, updated, selected)
+
+
+# ----------------- RECONCILIATION -----------------
+def _progress_counts(model, question_ids):
+    return model.objects.filter(question_id__in=question_ids).values("question_id").annotate(
+        learners=Count("id", filter=Q(attempts__gt=0)),
+        correct=Count("id", filter=Q(answered_correctly=True)),
+        first_try_correct=Count("id", filter=Q(answered_correctly=True, attempts=1)),
+        hints_used=Count("id", filter=Q(hint_used=True)),
+    ).order_by()
+
+
+def _question_rows(question_ids):
+    # Archived attempts count too, as they did when they were answered
+    progress = [*_progress_counts(UserProgress, question_ids), *_progress_counts(ArchivedProgress, question_ids)]
+    submissions = Submission.objects.filter(question_id__in=question_ids).values("question_id").annotate(
+        submissions=Count("id"),
+    ).order_by()
+    selections = Submission.objects.filter(
+        question_id__in=question_ids, selected_option__isnull=False,
+    ).values("selected_option_id").annotate(selections=Count("id")).order_by()
+    # Older submissions live in the archive
+    archived_submissions, archived_selections = history.answer_counts(question_ids)
+    submissions = [
+        *submissions,
+        *({"question_id": question_id, "submissions": count} for question_id, count in archived_submissions.items()),
+    ]
+    selections = [
+        *selections,
+        *({"selected_option_id": option_id, "selections": count} for option_id, count in archived_selections.items()),
+    ]
+    return progress, submissions, selections
+
+
+def _chunk_stats(question_ids, progress, submissions, selections, options):
+    now = timezone.now()
+    stats = {qid: QuestionStats(question_id=qid, updated_at=now) for qid in question_ids}
+    for row in progress:
+        for name in ("learners", "correct", "first_try_correct", "hints_used"):
+            question_stats = stats[row["question_id"]]
+            setattr(question_stats, name, getattr(question_stats, name) + row[name])
+    for row in submissions:
+        stats[row["question_id"]].submissions += row["submissions"]
+    counts = Counter()
+    for row in selections:
+        counts[row["selected_option_id"]] += row["selections"]
+    option_stats = [
+        OptionStats(option_id=option_id, question_id=question_id, selections=counts.get(option_id, 0))
+        for option_id, question_id in options
+    ]
+    return list(stats.values()), option_stats
+
+
+def _save_chunk(question_stats, option_stats):
+    with transaction.atomic():
+        QuestionStats.objects.bulk_create(
+            question_stats, update_conflicts=True, unique_fields=["question"],
+            update_fields=[*QUESTION_COUNTERS, "updated_at"],
+        )
+        OptionStats.objects.bulk_create(
+            option_stats, update_conflicts=True, unique_fields=["option"],
+            update_fields=["question", "selections"],
+        )
+
+
+def reconcile(questions=None, chunk_size=1000, progress=None):
+    """Recompute the stats of ``questions`` (default: all) from the source
+    tables. Six queries and one upsert per ``chunk_size`` questions."""
+    questions = Question.objects.all() if questions is None else questions
+    ids = questions.order_by("pk").values_list("pk", flat=True)
+    done = 0
+    last_id = 0
+    while True:
+        # Keyset chunks, so the id list never has to be held in memory
+        question_ids = list(ids.filter(pk__gt=last_id)[:chunk_size])
+        if not question_ids:
+            break
+        options = Option.objects.filter(question_id__in=question_ids).values_list("id", "question_id")
+        _save_chunk(*_chunk_stats(question_ids, *_question_rows(question_ids), options))
+        last_id = question_ids[-1]
+        done += len(question_ids)
+        if progress:
+            progress(done)
+    return done
+
+
+# ----------------- EXPORT -----------------
+CSV_HEADER = [
+    "question_id", "subject", "question", "submissions", "learners", "success_rate", "first_try_rate",
+    "hint_rate", "option_id", "option", "is_correct", "selections", "selection_share",
+]
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _selections(option):
+    try:
+        return option.stats.selections
+    except OptionStats.DoesNotExist:
+        return 0
+
+
+def csv_lines(questions, chunk_size=500):
+    """Yield the stats CSV, one row per option, read only from the rollup tables."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+    rows = questions.select_related("subject", "stats").order_by("subject_id", "order", "id")
+    for chunk in _chunks(rows.iterator(chunk_size=chunk_size), chunk_size):
+        options = defaultdict(list)
+        for option in Option.objects.filter(question__in=[q.pk for q in chunk]).select_related("stats").order_by("id"):
+            options[option.question_id].append((option, _selections(option)))
+
+        for question in chunk:
+            try:
+                stats = question.stats
+            except QuestionStats.DoesNotExist:
+                stats = QuestionStats(question=question)
+            total = sum(selections for _, selections in options[question.pk])
+            for option, selections in options[question.pk]:
+                yield writer.writerow([
+                    question.pk, question.subject.name, (question.text_content or "")[:200],
+                    stats.submissions, stats.learners, stats.success_rate, stats.first_try_rate, stats.hint_rate,
+                    option.pk, option.text_content or "", option.is_correct, selections,
+                    round(selections * 100 / total, 1) if total else None,
+                ])
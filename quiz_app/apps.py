@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class QuizAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'quiz_app'
+
+    def ready(self):
+        from . import db, jobs, signals  # noqa: F401
@@ -0,0 +1,270 @@
+# async_views.py
+"""Native async versions of the quiz views, used when QUIZ_ASYNC_VIEWS is on.
+
+They mirror views.py but read and write through Django's async ORM API,
+so under ASGI a request never leaves the event loop for the common cases
+(cached manifest and navigation index, one progress lookup).
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect
+from django.views.decorators.http import require_POST
+
+from . import attempts, exams, leaderboards, search, selection, session, summaries
+from .catalogue import aget_catalogue
+from .db import replica_reads
+from .instrumentation import query_budget
+from .manifest import aget_manifest_or_404
+from .models import UserProgress
+from .recording import arecord_answer
+from .scoring import acompute_results
+from .views import (
+    _check_selected, _correct_answer_response, _exam_attempt_or_404, _finished_state, _finishes_question,
+    _hint_used, _new_progress, _no_answer_state, _page_number, _question_context, _question_or_404, _search_page,
+    _selected_option, _wrong_answer_state,
+)
+
+
+async def _auser(request):
+    # Resolve the user once and pin it on request.user as well, so templates
+    # (auth context processor) don't trigger a sync lookup later.
+    user = await request.auser()
+    request.user = user
+    return user
+
+
+# ----------------- SUBJECT LIST -----------------
+@query_budget(3)
+async def subject_list(request):
+    subjects = await aget_catalogue(await _auser(request))
+    return render(request, "subject_list.html", {"subjects": subjects})
+
+
+# ----------------- START QUIZ -----------------
+async def _aattempt_id(user, subject_id):
+    return await attempts.aactive_attempt_id(user, subject_id) if user.is_authenticated else None
+
+
+@query_budget(2)
+async def subject_questions(request, subject_id):
+    user = await _auser(request)
+    manifest = await aget_manifest_or_404(subject_id)
+    first_question_id = (await selection.aget_order(subject_id, await _aattempt_id(user, subject_id))).first_id
+    if first_question_id:
+        return redirect("question_detail", subject_id=subject_id, question_id=first_question_id)
+    return render(request, "no_questions.html", {"subject": manifest["subject"]})
+
+
+# ----------------- QUESTION DETAIL -----------------
+# An answer records in 10 queries; an adaptive attempt picks its next question in 4 more
+@query_budget(14)
+async def question_detail(request, subject_id, question_id):
+    user = await _auser(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path(), "login")
+
+    manifest = await aget_manifest_or_404(subject_id)
+    question = _question_or_404(manifest, question_id)
+    attempt_id = await attempts.aactive_attempt_id(user, subject_id)
+    index = await selection.aget_order(subject_id, attempt_id)
+    _check_selected(index, question_id)
+    exam = await exams.astatus(attempt_id)
+    if exam["expired"]:
+        return _correct_answer_response(request, subject_id, None)
+
+    # Track progress
+    progress = await UserProgress.objects.filter(
+        user=user, subject_id=subject_id, question_id=question_id,
+    ).afirst() or _new_progress(user, subject_id, question_id, attempt_id)
+
+    state = {}
+    if request.method == "POST":
+        selected_option = _selected_option(request, question["options"])
+        if selected_option is None:
+            state = _no_answer_state()
+        elif await arecord_answer(
+            progress, selected_option["id"], selected_option["is_correct"], _hint_used(request)
+        ) is None:
+            state = _finished_state(progress, question["options"], question["explanation"])
+        else:
+            if _finishes_question(index, progress, selected_option):
+                # Locks the attempt row, which needs a transaction
+                index = await sync_to_async(selection.advance)(
+                    subject_id, attempt_id, question_id, selected_option["is_correct"]
+                )
+            if selected_option["is_correct"]:
+                return _correct_answer_response(request, subject_id, index.next_id(question_id))
+            state = _wrong_answer_state(
+                progress.attempts, selected_option, question["options"], question["explanation"]
+            )
+
+    context = _question_context(
+        manifest, index, question, progress, state, attempt_id, exams.page_context(attempt_id, exam)
+    )
+    return render(request, "quiz.html", context)
+
+
+# ----------------- RESULTS -----------------
+@query_budget(3)
+async def results(request, subject_id):
+    user = await _auser(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path(), "login")
+
+    subject = (await aget_manifest_or_404(subject_id))["subject"]
+    attempt_id = await attempts.aactive_attempt_id(user, subject_id)
+    exam = await exams.astatus(attempt_id)
+    order = await selection.aget_order(subject_id, attempt_id)
+    summary = await acompute_results(user, subject_id, order.question_ids)
+
+    return render(request, "results.html", {
+        "subject": subject,
+        "exam": exam if exam["timed"] else None,
+        "results": summary["results"],
+        "summary": summary,
+        "total_questions": summary["total_questions"],
+        "correct_answers": summary["correct"],
+        "score_percentage": summary["score_percentage"],
+    })
+
+
+@require_POST
+async def retake(request, subject_id):
+    user = await _auser(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path(), "login")
+    await aget_manifest_or_404(subject_id)
+    # Archiving moves rows in one transaction, which the async ORM can't hold
+    await sync_to_async(attempts.start_new)(user, subject_id)
+    return redirect("subject_questions", subject_id)
+
+
+@query_budget(3)
+async def results_api(request, subject_id):
+    user = await _auser(request)
+    if not user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+    subject = (await aget_manifest_or_404(subject_id))["subject"]
+    attempt_id = await attempts.aactive_attempt_id(user, subject_id)
+    exam = await exams.astatus(attempt_id)
+    order = await selection.aget_order(subject_id, attempt_id)
+    summary = await acompute_results(user, subject_id, order.question_ids)
+    return JsonResponse({"subject": {"id": subject["id"], "name": subject["name"]}, "exam": exam, **summary})
+
+
+# ----------------- DASHBOARD -----------------
+@query_budget(3)
+async def dashboard(request):
+    user = await _auser(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path(), "login")
+    progress = summaries.dashboard(await aget_catalogue(), await summaries.afor_user(user))
+    return render(request, "dashboard.html", {"dashboard": progress})
+
+
+@query_budget(3)
+async def dashboard_api(request):
+    user = await _auser(request)
+    if not user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+    return JsonResponse(summaries.dashboard(await aget_catalogue(), await summaries.afor_user(user)))
+
+
+# ----------------- LEADERBOARDS -----------------
+async def _leaderboard_page(request, subject_id=None):
+    user = await _auser(request)
+    subject = (await aget_manifest_or_404(subject_id))["subject"] if subject_id else None
+    board = leaderboards.subject_board(subject_id) if subject_id else leaderboards.GLOBAL
+    # A board may (re)load from the database, which is sync ORM work
+    return subject, await sync_to_async(leaderboards.page)(board, _page_number(request), user)
+
+
+@query_budget(3)
+async def leaderboard(request, subject_id=None):
+    subject, board = await _leaderboard_page(request, subject_id)
+    return render(request, "leaderboard.html", {"subject": subject, "leaderboard": board})
+
+
+@query_budget(3)
+async def leaderboard_api(request, subject_id=None):
+    _, board = await _leaderboard_page(request, subject_id)
+    return JsonResponse(board)
+
+
+# ----------------- SEARCH -----------------
+@query_budget(3)
+async def search_questions(request):
+    await _auser(request)
+    # The index is read through a raw cursor, which is sync only
+    page = await sync_to_async(_search_page)(request)
+    return render(request, "search.html", {"search": page, "subjects": await aget_catalogue()})
+
+
+@query_budget(1)
+@replica_reads
+async def search_api(request):
+    return JsonResponse(await sync_to_async(_search_page)(request))
+
+
+# ----------------- EXAM HEARTBEAT -----------------
+@query_budget(0)
+async def exam_status(request, token):
+    return JsonResponse(await exams.astatus(_exam_attempt_or_404(token)))
+
+
+async def exam_events(request, token):
+    """Server-sent events: the exam state now, then every heartbeat interval
+    and right after the deadline, until the exam is over. One open
+    connection per exam taker instead of a request every few seconds."""
+    attempt_id = _exam_attempt_or_404(token)
+    config = exams.get_config()
+
+    async def events():
+        while True:
+            state = await exams.astatus(attempt_id)
+            yield f"data: {json.dumps(state)}\n\n"
+            if state["expired"] or not state["timed"]:
+                return
+            await asyncio.sleep(min(config["HEARTBEAT_INTERVAL"], state["remaining"] + config["GRACE_SECONDS"] + 1))
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop proxies from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+# ----------------- QUIZ SESSION API -----------------
+@query_budget(3)
+async def session_questions(request, subject_id):
+    user = await _auser(request)
+    if not user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+    manifest = await aget_manifest_or_404(subject_id)
+    index = await selection.aget_order(subject_id, await attempts.aactive_attempt_id(user, subject_id))
+    try:
+        question_ids = session.window(index, request.GET.get("start"), request.GET.get("count"))
+    except session.InvalidRequest as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    progress = await session.aprogress_for(user, question_ids)
+    return JsonResponse(session.question_batch(manifest, index, question_ids, progress))
+
+
+@query_budget(13)
+@require_POST
+async def session_answers(request, subject_id):
+    user = await _auser(request)
+    if not user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+    manifest = await aget_manifest_or_404(subject_id)
+    try:
+        answers = session.parse_answers(request.body)
+    except session.InvalidRequest as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    # Grading holds a transaction, which the async ORM can't do; run it in a thread
+    results = await sync_to_async(session.grade_answers)(user, subject_id, manifest, answers)
+    return JsonResponse({"results": results})
@@ -0,0 +1,179 @@
+# attempts.py
+"""Quiz attempts: one ``QuizAttempt`` per run through a subject.
+
+``UserProgress`` only ever holds the active attempt's rows, so every read
+that filters it by user (question page, results, summaries, leaderboards)
+is scoped to the active attempt without joining ``QuizAttempt``. The
+active attempt's id is cached per user and subject. A new attempt gets
+its question order from ``selection.plan`` and, for a timed subject, its
+deadline (see ``exams.py``).
+
+:func:`start_new` (the "Retry Quiz" button) archives the active attempt:
+its progress rows move to ``ArchivedProgress``, their totals are kept on
+the attempt row for the history, and the learner's subject summary and
+leaderboard scores start over.
+"""
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import leaderboards, selection, summaries
+from .instrumentation import setup
+from .models import ArchivedProgress, Question, QuizAttempt, Subject, UserProgress
+
+CACHE_TIMEOUT = 60 * 60 * 24
+ARCHIVE_BATCH = 1000
+
+_PROGRESS_FIELDS = (
+    "user_id", "question_id", "subject_id", "selected_option_id", "attempts", "answered_correctly", "hint_used",
+    "created_at", "updated_at",
+)
+
+
+def _cache_key(user_id, subject_id):
+    return f"quiz:attempt:{user_id}:{subject_id}"
+
+
+def _next_number(user, subject_id):
+    latest = QuizAttempt.objects.filter(user=user, subject_id=subject_id).order_by("-number").first()
+    return latest.number + 1 if latest else 1
+
+
+def _create(user, subject_id, number, now):
+    subject = Subject.objects.only("selection_mode", "question_limit", "shuffle_options", "time_limit").get(
+        pk=subject_id
+    )
+    # A timed exam's clock starts with the attempt
+    deadline = now + timedelta(minutes=subject.time_limit) if subject.time_limit else None
+    return QuizAttempt.objects.create(
+        user=user, subject_id=subject_id, number=number, started_at=now, deadline=deadline,
+        **selection.plan(subject),
+    )
+
+
+def _active_attempt(user, subject_id):
+    attempt = QuizAttempt.objects.filter(user=user, subject_id=subject_id, archived_at__isnull=True).first()
+    if attempt is not None:
+        return attempt
+    try:
+        with transaction.atomic():
+            return _create(user, subject_id, _next_number(user, subject_id), timezone.now())
+    except IntegrityError:
+        # Another request started it first
+        return QuizAttempt.objects.get(user=user, subject_id=subject_id, archived_at__isnull=True)
+
+
+def active_attempt_id(user, subject_id):
+    """The id of ``user``'s active attempt at ``subject_id``, started on first use."""
+    key = _cache_key(user.pk, subject_id)
+    attempt_id = cache.get(key)
+    if attempt_id is None:
+        with setup():
+            attempt_id = _active_attempt(user, subject_id).pk
+        cache.set(key, attempt_id, timeout=CACHE_TIMEOUT)
+    return attempt_id
+
+
+async def aactive_attempt_id(user, subject_id):
+    key = _cache_key(user.pk, subject_id)
+    attempt_id = cache.get(key)
+    if attempt_id is None:
+        with setup():
+            attempt_id = (await sync_to_async(_active_attempt)(user, subject_id)).pk
+        cache.set(key, attempt_id, timeout=CACHE_TIMEOUT)
+    return attempt_id
+
+
+def forget(user_id, subject_id):
+    """Drop the cached active attempt id, once the transaction commits."""
+    key = _cache_key(user_id, subject_id)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def _totals(progress):
+    return progress.aggregate(
+        answered=Count("id", filter=Q(attempts__gt=0)),
+        correct=Count("id", filter=Q(answered_correctly=True)),
+        attempts=Coalesce(Sum("attempts"), 0),
+        hints_used=Count("id", filter=Q(hint_used=True)),
+    )
+
+
+def _store_totals(attempt, progress):
+    totals = _totals(progress)
+    for name, value in totals.items():
+        setattr(attempt, name, value)
+    if attempt.selection_mode == Subject.ORDERED:
+        attempt.question_count = Question.objects.filter(subject_id=attempt.subject_id).count()
+    else:
+        attempt.question_count = selection.planned_count(attempt.question_order, attempt.selection_state)
+    return totals
+
+
+def archive(attempt, now):
+    """Move ``attempt``'s progress rows out of ``UserProgress`` and keep their
+    totals on the attempt. Call it inside a transaction."""
+    progress = UserProgress.objects.filter(attempt=attempt)
+    totals = _store_totals(attempt, progress)
+    rows = progress.order_by("pk").values("pk", *_PROGRESS_FIELDS)
+    last_pk = 0
+    while batch := list(rows.filter(pk__gt=last_pk)[:ARCHIVE_BATCH]):
+        ArchivedProgress.objects.bulk_create([
+            ArchivedProgress(attempt=attempt, **{name: row[name] for name in _PROGRESS_FIELDS}) for row in batch
+        ])
+        last_pk = batch[-1]["pk"]
+    progress.delete()
+
+    attempt.archived_at = now
+    attempt.save()
+    leaderboards.remove(attempt.user_id, attempt.subject_id, totals["correct"], totals["attempts"], totals["hints_used"])
+    return attempt
+
+
+def start_new(user, subject_id):
+    """Archive ``user``'s active attempt at ``subject_id`` (if any) and start the next one."""
+    now = timezone.now()
+    with transaction.atomic():
+        current = (
+            QuizAttempt.objects.select_for_update()
+            .filter(user=user, subject_id=subject_id, archived_at__isnull=True)
+            .first()
+        )
+        if current is not None:
+            archive(current, now)
+            number = current.number + 1
+        else:
+            number = _next_number(user, subject_id)
+        attempt = _create(user, subject_id, number, now)
+        summaries.reset(user.pk, subject_id, now)
+        key = _cache_key(user.pk, subject_id)
+        transaction.on_commit(lambda: cache.set(key, attempt.pk, timeout=CACHE_TIMEOUT))
+    return attempt
+
+
+def submit(attempt_id, now):
+    """Close the timed attempt ``attempt_id`` and keep its totals on the
+    attempt row; its progress rows stay where they are until a retake.
+    Returns False if it was already submitted or archived."""
+    with transaction.atomic():
+        attempt = (
+            QuizAttempt.objects.select_for_update()
+            .filter(pk=attempt_id, submitted_at__isnull=True, archived_at__isnull=True)
+            .first()
+        )
+        if attempt is None:
+            return False
+        _store_totals(attempt, UserProgress.objects.filter(attempt=attempt))
+        attempt.submitted_at = now
+        attempt.save()
+    return True
+
+
+def history(user, subject_id):
+    """``user``'s attempts at ``subject_id``, latest first."""
+    return list(QuizAttempt.objects.filter(user=user, subject_id=subject_id).order_by("-number"))
@@ -0,0 +1,465 @@
+# benchmarking.py
+"""Helpers for benchmarking and load-testing the quiz.
+
+Used by the ``generate_benchmark_data``, ``benchmark_quiz`` and
+``benchmark_servers`` management commands.
+
+* ``generate_data`` fills the database with synthetic subjects, questions
+  and users with a realistic answer history, and refreshes the summaries,
+  stats, leaderboards and search index the way real answers would.
+* The scenarios (browsing, answering, viewing results) are sequences of
+  requests. ``run_client_scenario`` drives them in-process through the
+  Django test client and counts the queries of every request;
+  ``run_http_load`` sends them over real HTTP from threads that each keep
+  one persistent connection open, and ``run_http_processes`` spreads those
+  threads over several processes.
+* Every run is summarised into requests/second and latency percentiles, and
+  ``compare`` checks a report against a stored baseline.
+"""
+import http.client
+import random
+import string
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection as db_connection, transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from . import analytics, catalogue, leaderboards, search, selection, summaries
+from .instrumentation import percentile
+from .models import Explanation, Option, Question, QuizAttempt, Subject, Submission, UserProgress
+from .scoring import MAX_ATTEMPTS
+
+# ----------------- SUMMARIES -----------------
+def summarise(latencies, elapsed, errors=0):
+    """Summarise request latencies (seconds) into throughput and percentiles (ms)."""
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "requests": count,
+        "errors": errors,
+        "elapsed": round(elapsed, 3),
+        "rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / count * 1000, 2) if count else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+# ----------------- HTTP LOAD -----------------
+def session_cookie_for(user):
+    """Create a logged-in session for ``user`` and return its cookie header."""
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return f"{settings.SESSION_COOKIE_NAME}={session.session_key}"
+
+
+def wait_for_server(base_url, timeout=30):
+    parts = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=1)
+            connection.request("GET", "/")
+            connection.getresponse().read()
+            connection.close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def _csrf_headers():
+    # Django accepts the unmasked secret as the token, so one value serves as both
+    secret = get_random_string(32, string.ascii_letters + string.digits)
+    return f"{settings.CSRF_COOKIE_NAME}={secret}", {"X-CSRFToken": secret}
+
+
+def _as_request(request):
+    # A bare path is a GET
+    return ("GET", request, None) if isinstance(request, str) else request
+
+
+def _load(base_url, requests, concurrency, duration, cookies, offset=0):
+    parts = urlsplit(base_url)
+    requests = [_as_request(request) for request in requests]
+    csrf_cookie, csrf_headers = _csrf_headers()
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker(number):
+        cookie = "; ".join(filter(None, [cookies[number % len(cookies)] if cookies else None, csrf_cookie]))
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+        local, failed, n = [], 0, number
+        while time.monotonic() < stop_at:
+            method, path, data = requests[n % len(requests)]
+            n += 1
+            headers = {"Cookie": cookie}
+            body = None
+            if method == "POST":
+                body = urlencode(data or {})
+                headers.update(csrf_headers)
+                headers["Content-Type"] = "application/x-www-form-urlencoded"
+            started = time.perf_counter()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    failed += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+                continue
+            local.append(time.perf_counter() - started)
+        connection.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(offset + i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.monotonic() - started
+
+
+def run_http_load(base_url, requests, concurrency=10, duration=10.0, cookie=None):
+    """Send ``requests`` (paths, or ``(method, path, data)``) round-robin from
+    ``concurrency`` threads for ``duration`` seconds. ``cookie`` is one
+    Cookie header, or a list of them handed out to the threads in turn."""
+    cookies = [cookie] if isinstance(cookie, str) else cookie
+    latencies, errors, elapsed = _load(base_url, requests, concurrency, duration, cookies)
+    return summarise(latencies, elapsed, errors)
+
+
+def run_http_processes(base_url, requests, processes=2, concurrency=10, duration=10.0, cookies=None):
+    """``run_http_load`` from ``processes`` processes at once, so the load
+    generator itself isn't limited to one core."""
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [
+            executor.submit(_load, base_url, requests, concurrency, duration, cookies, number * concurrency)
+            for number in range(processes)
+        ]
+        results = [future.result() for future in futures]
+    latencies = [latency for result in results for latency in result[0]]
+    return summarise(latencies, max(result[2] for result in results), sum(result[1] for result in results))
+
+
+# ----------------- SYNTHETIC DATA -----------------
+SUBJECT_PREFIX = "Benchmark subject"
+USERNAME_PREFIX = "bench-user-"
+OPTIONS_PER_QUESTION = 4
+WORDS = (
+    "atom cell energy force graph history language matrix number orbit planet protein reaction river "
+    "sequence signal theorem velocity volcano wave"
+).split()
+
+
+def _sentence(rng, length):
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+
+def _create_content(rng, subjects, questions, batch_size):
+    offset = Subject.objects.filter(name__startswith=SUBJECT_PREFIX).count()
+    subject_rows = Subject.objects.bulk_create([
+        Subject(name=f"{SUBJECT_PREFIX} {offset + number}", description="Synthetic subject for benchmarks.")
+        for number in range(1, subjects + 1)
+    ])
+    question_rows = Question.objects.bulk_create([
+        Question(
+            subject=subject, order=number, hint=f"Think about {rng.choice(WORDS)}.",
+            text_content=f"{_sentence(rng, 8).capitalize()}? ({subject.name}, question {number})",
+        )
+        for subject in subject_rows
+        for number in range(1, questions + 1)
+    ], batch_size=batch_size)
+    options = []
+    for question in question_rows:
+        correct = rng.randrange(OPTIONS_PER_QUESTION)
+        options.extend(
+            Option(question=question, text_content=_sentence(rng, 3), is_correct=number == correct)
+            for number in range(OPTIONS_PER_QUESTION)
+        )
+    Option.objects.bulk_create(options, batch_size=batch_size)
+    Explanation.objects.bulk_create(
+        [Explanation(question=question, text_content=_sentence(rng, 12)) for question in question_rows],
+        batch_size=batch_size,
+    )
+    choices = {}
+    for option in options:
+        right, wrong = choices.setdefault(option.question_id, (None, []))
+        if option.is_correct:
+            choices[option.question_id] = (option.pk, wrong)
+        else:
+            wrong.append(option.pk)
+    return subject_rows, question_rows, choices
+
+
+def _create_users(users, batch_size):
+    offset = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+    rows = []
+    for number in range(offset + 1, offset + users + 1):
+        user = User(username=f"{USERNAME_PREFIX}{number}")
+        user.set_unusable_password()
+        rows.append(user)
+    return User.objects.bulk_create(rows, batch_size=batch_size)
+
+
+def _answer_history(rng, user, subject, questions, choices, answered, now):
+    """One user's attempt at ``subject``: progress rows and their submissions."""
+    ability = rng.uniform(0.3, 0.95)
+    attempt = QuizAttempt(user=user, subject=subject, started_at=now, **selection.plan(subject, rng.randrange(2**31)))
+    progress, submissions = [], []
+    for question in questions:
+        if rng.random() >= answered:
+            continue
+        right, wrong = choices[question.pk]
+        hint_used = rng.random() < 0.2
+        tries = 0
+        correct = False
+        while tries < MAX_ATTEMPTS and not correct:
+            tries += 1
+            correct = rng.random() < ability + (0.1 if hint_used else 0)
+            selected = right if correct else rng.choice(wrong)
+            submissions.append(Submission(
+                user=user, question=question, selected_option_id=selected,
+                submitted_at=now - timedelta(seconds=rng.randrange(30 * 24 * 3600)),
+            ))
+        progress.append(UserProgress(
+            user=user, question=question, subject=subject, attempt=attempt, selected_option_id=selected,
+            attempts=tries, answered_correctly=correct, hint_used=hint_used,
+        ))
+    return attempt, progress, submissions
+
+
+def generate_data(subjects=5, questions=50, users=100, answered=0.6, coverage=0.8, seed=0, batch_size=1000,
+                  progress=None):
+    """Create ``subjects`` x ``questions`` (four options, a hint and an
+    explanation each) and ``users`` who each started ``coverage`` of the
+    subjects and answered ``answered`` of their questions. Returns the
+    number of rows created per model."""
+    rng = random.Random(seed)
+    now = timezone.now()
+    with transaction.atomic():
+        subject_rows, question_rows, choices = _create_content(rng, subjects, questions, batch_size)
+        if progress:
+            progress(f"{len(subject_rows)} subjects, {len(question_rows)} questions")
+        user_rows = _create_users(users, batch_size)
+        by_subject = {}
+        for question in question_rows:
+            by_subject.setdefault(question.subject_id, []).append(question)
+
+        counts = {"subjects": len(subject_rows), "questions": len(question_rows), "users": len(user_rows),
+                  "attempts": 0, "progress": 0, "submissions": 0}
+        for start in range(0, len(user_rows), 100):
+            attempt_rows, progress_rows, submission_rows = [], [], []
+            for user in user_rows[start:start + 100]:
+                for subject in subject_rows:
+                    if rng.random() >= coverage:
+                        continue
+                    attempt, rows, submitted = _answer_history(
+                        rng, user, subject, by_subject[subject.pk], choices, answered, now
+                    )
+                    attempt_rows.append(attempt)
+                    progress_rows.extend(rows)
+                    submission_rows.extend(submitted)
+            # Attempts first: the progress rows pick up their ids from them
+            QuizAttempt.objects.bulk_create(attempt_rows, batch_size=batch_size)
+            UserProgress.objects.bulk_create(progress_rows, batch_size=batch_size)
+            Submission.objects.bulk_create(submission_rows, batch_size=batch_size)
+            counts["attempts"] += len(attempt_rows)
+            counts["progress"] += len(progress_rows)
+            counts["submissions"] += len(submission_rows)
+            if progress:
+                progress(f"{min(start + 100, len(user_rows))} users with {counts['progress']} progress rows")
+        catalogue.invalidate()
+
+    # bulk_create skips the signals, so refresh what answers normally keep up to date
+    summaries.rebuild(User.objects.filter(pk__in=[user.pk for user in user_rows]))
+    analytics.reconcile(Question.objects.filter(subject__in=subject_rows))
+    leaderboards.reconcile()
+    search.rebuild([subject.pk for subject in subject_rows])
+    if progress:
+        progress("summaries, stats, leaderboards and search index refreshed")
+    return counts
+
+
+def delete_data():
+    """Remove everything ``generate_data`` created. Returns the number of subjects and users removed."""
+    with transaction.atomic():
+        subjects = Subject.objects.filter(name__startswith=SUBJECT_PREFIX)
+        subject_ids = list(subjects.values_list("pk", flat=True))
+        backend = search.get_backend()
+        if backend is not None:
+            for subject_id in subject_ids:
+                backend.clear(subject_id)
+        subjects.delete()
+        users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        user_count = users.count()
+        users.delete()
+        catalogue.invalidate()
+    leaderboards.reconcile()
+    return len(subject_ids), user_count
+
+
+# ----------------- SCENARIOS -----------------
+class Workload:
+    """The benchmark subjects' questions and options, for building requests."""
+
+    def __init__(self, subject_ids=None):
+        subjects = Subject.objects.filter(name__startswith=SUBJECT_PREFIX)
+        if subject_ids:
+            subjects = subjects.filter(pk__in=subject_ids)
+        self.options = {}
+        self.questions = {}
+        rows = Option.objects.filter(question__subject__in=subjects).order_by("question__order", "pk").values_list(
+            "question__subject_id", "question_id", "pk"
+        )
+        for subject_id, question_id, option_id in rows:
+            if question_id not in self.options:
+                self.questions.setdefault(subject_id, []).append(question_id)
+            self.options.setdefault(question_id, []).append(option_id)
+        self.subject_ids = sorted(self.questions)
+
+    def question(self, rng):
+        subject_id = rng.choice(self.subject_ids)
+        return subject_id, rng.choice(self.questions[subject_id])
+
+
+def browse(workload, rng):
+    """The subject list, a subject's start page and one of its questions."""
+    subject_id, question_id = workload.question(rng)
+    return [
+        ("GET", reverse("subject_list"), None),
+        ("GET", reverse("subject_questions", args=[subject_id]), None),
+        ("GET", reverse("question_detail", args=[subject_id, question_id]), None),
+    ]
+
+
+def answer(workload, rng):
+    """A question page, then an answer to it (any option, sometimes with the hint)."""
+    subject_id, question_id = workload.question(rng)
+    path = reverse("question_detail", args=[subject_id, question_id])
+    data = {"answer": rng.choice(workload.options[question_id]), "hint_used": "1" if rng.random() < 0.2 else "0"}
+    return [("GET", path, None), ("POST", path, data)]
+
+
+def results(workload, rng):
+    """A subject's results page and its JSON."""
+    subject_id = rng.choice(workload.subject_ids)
+    return [
+        ("GET", reverse("results", args=[subject_id]), None),
+        ("GET", reverse("results_api", args=[subject_id]), None),
+    ]
+
+
+SCENARIOS = {"browse": browse, "answer": answer, "results": results}
+
+
+def scenario_requests(name, workload, count, seed=0):
+    """``count`` runs of scenario ``name`` as one flat list of requests."""
+    rng = random.Random(seed)
+    return [request for _ in range(count) for request in SCENARIOS[name](workload, rng)]
+
+
+def benchmark_users(count):
+    users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by("pk")[:count])
+    if not users:
+        raise ValueError("No benchmark users; run generate_benchmark_data first")
+    return users
+
+
+def _client_host():
+    hosts = [host.lstrip(".") for host in settings.ALLOWED_HOSTS if host != "*"]
+    return hosts[0] if hosts else "localhost"
+
+
+def run_client_scenario(name, workload, users, iterations, seed=0, warmup=10):
+    """Run scenario ``name`` ``iterations`` times through the test client,
+    rotating over ``users``, after ``warmup`` unmeasured runs that fill the
+    caches. Adds the queries per request to the summary."""
+    clients = []
+    for user in users:
+        client = Client(HTTP_HOST=_client_host())
+        client.force_login(user)
+        clients.append(client)
+
+    latencies, query_counts = [], []
+    errors = 0
+    queries = [0]
+
+    def count_query(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    warmup_rng = random.Random(seed + 1)
+    for number in range(warmup):
+        for method, path, data in SCENARIOS[name](workload, warmup_rng):
+            client = clients[number % len(clients)]
+            client.post(path, data) if method == "POST" else client.get(path)
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    with db_connection.execute_wrapper(count_query):
+        for number in range(iterations):
+            client = clients[number % len(clients)]
+            for method, path, data in SCENARIOS[name](workload, rng):
+                queries[0] = 0
+                request_started = time.perf_counter()
+                response = client.post(path, data) if method == "POST" else client.get(path)
+                if response.status_code >= 400:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - request_started)
+                query_counts.append(queries[0])
+    summary = summarise(latencies, time.perf_counter() - started, errors)
+    summary["queries_per_request"] = round(sum(query_counts) / len(query_counts), 2) if query_counts else 0.0
+    summary["max_queries"] = max(query_counts, default=0)
+    return summary
+
+
+# ----------------- BASELINES -----------------
+def compare(baseline, report, tolerance=10.0):
+    """The regressions of ``report`` against ``baseline`` (both ``benchmark_quiz``
+    reports): throughput down or p95 latency up by more than ``tolerance``
+    percent, or more queries per request at all."""
+    regressions = []
+
+    def check(scenario, metric, before, after, worse):
+        if before is None or after is None or not worse(before, after):
+            return
+        change = round((after - before) * 100 / before, 1) if before else None
+        regressions.append({"scenario": scenario, "metric": metric, "baseline": before, "current": after,
+                            "change_pct": change})
+
+    factor = tolerance / 100
+    for scenario, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if previous is None:
+            continue
+        check(scenario, "rps", previous.get("rps"), current.get("rps"), lambda a, b: b < a * (1 - factor))
+        check(scenario, "p95_ms", previous.get("p95_ms"), current.get("p95_ms"), lambda a, b: b > a * (1 + factor))
+        check(scenario, "queries_per_request", previous.get("queries_per_request"),
+              current.get("queries_per_request"), lambda a, b: b > a + 0.01)
+    return regressions
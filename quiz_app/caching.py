@@ -0,0 +1,56 @@
+# caching.py
+"""Versioned cache keys shared by the quiz read paths.
+
+Every cached structure lives under a key that embeds a version number.
+Invalidation never deletes anything: it bumps the version, so all
+processes stop reading the old entry at the same moment and the stale
+payload simply expires.
+
+The async read paths call these sync helpers directly. Cache access is
+allowed in async code, and Django's built-in ``cache.aget`` & co. are only
+``sync_to_async`` wrappers that would add a thread hop to every lookup.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def version_key(namespace, ident=None):
+    if ident is None:
+        return f"quiz:{namespace}:version"
+    return f"quiz:{namespace}:{ident}:version"
+
+
+def _seed():
+    # Millisecond clock as the starting value, so a flushed cache can never
+    # hand out a version number that an older payload was stored under.
+    return int(time.time() * 1000)
+
+
+def get_version(namespace, ident=None):
+    key = version_key(namespace, ident)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _seed(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace, ident=None):
+    key = version_key(namespace, ident)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _seed()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def bump_on_commit(namespace, ident=None):
+    """Bump once the surrounding transaction commits.
+
+    Bumping earlier would let another request rebuild from the old rows and
+    cache them under the new version.
+    """
+    transaction.on_commit(lambda: bump_version(namespace, ident))
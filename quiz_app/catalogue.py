@@ -0,0 +1,129 @@
+# catalogue.py
+"""Subject catalogue for the homepage.
+
+The catalogue (subjects with their question counts and logo derivatives) is
+one aggregated query plus one derivative lookup, cached under a versioned
+key that signals bump whenever subjects or questions change. A logged-in user's completion figures add a single
+indexed lookup of their subject summaries (``summaries.py``), however many subjects exist.
+That lookup fills no cache, so it reads from the replica when one is configured;
+the catalogue itself is built from the primary.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from . import caching
+from .db import read_from_replica
+from .images import aderivatives_for, derivatives_for, image_info
+from .instrumentation import setup
+from .storage import quiz_media_storage
+from .models import Subject, UserSubjectSummary
+
+NAMESPACE = "catalogue"
+
+
+def _timeout():
+    return getattr(settings, "QUIZ_MANIFEST_TIMEOUT", 60 * 60 * 24)
+
+
+def _catalogue_rows():
+    return Subject.objects.annotate(question_count=Count("question")).order_by("id").values(
+        "id", "name", "description", "logo_image", "question_count"
+    )
+
+
+def _entries(rows, derivatives):
+    logo_field = Subject._meta.get_field("logo_image")
+    return [
+        {
+            "id": row["id"],
+            "name": row["name"],
+            "description": row["description"],
+            "logo": image_info(logo_field, row["logo_image"], derivatives),
+            "question_count": row["question_count"],
+        }
+        for row in rows
+    ]
+
+
+def build_catalogue():
+    rows = list(_catalogue_rows())
+    derivatives = derivatives_for([row["logo_image"] for row in rows], quiz_media_storage())
+    return _entries(rows, derivatives)
+
+
+async def abuild_catalogue():
+    rows = [row async for row in _catalogue_rows()]
+    derivatives = await aderivatives_for([row["logo_image"] for row in rows], quiz_media_storage())
+    return _entries(rows, derivatives)
+
+
+def _finished_rows(user):
+    return UserSubjectSummary.objects.filter(user=user, finished__gt=0).values("subject_id", "finished")
+
+
+def completed_counts(user):
+    """Return ``{subject_id: finished questions}`` for ``user``.
+
+    A question is finished once it was answered correctly or all attempts
+    were used, matching the statuses on the results page.
+    """
+    with read_from_replica():
+        return {row["subject_id"]: row["finished"] for row in _finished_rows(user)}
+
+
+async def acompleted_counts(user):
+    with read_from_replica():
+        return {row["subject_id"]: row["finished"] async for row in _finished_rows(user)}
+
+
+def _personalise(subjects, finished):
+    personalised = []
+    for subject in subjects:
+        done = finished.get(subject["id"], 0)
+        total = subject["question_count"]
+        personalised.append(dict(
+            subject,
+            completed=done,
+            completion=int(done * 100 / total) if total else 0,
+        ))
+    return personalised
+
+
+def _key(version):
+    return f"quiz:{NAMESPACE}:{version}"
+
+
+def _versioned(subjects, version):
+    # The version also keys the rendered subject cards
+    return [dict(subject, version=version) for subject in subjects]
+
+
+def get_catalogue(user=None):
+    version = caching.get_version(NAMESPACE)
+    subjects = cache.get(_key(version))
+    if subjects is None:
+        with setup():
+            subjects = _versioned(build_catalogue(), version)
+        cache.set(_key(version), subjects, timeout=_timeout())
+
+    if user is None or not user.is_authenticated:
+        return subjects
+    return _personalise(subjects, completed_counts(user))
+
+
+async def aget_catalogue(user=None):
+    version = caching.get_version(NAMESPACE)
+    subjects = cache.get(_key(version))
+    if subjects is None:
+        with setup():
+            subjects = _versioned(await abuild_catalogue(), version)
+        cache.set(_key(version), subjects, timeout=_timeout())
+
+    if user is None or not user.is_authenticated:
+        return subjects
+    return _personalise(subjects, await acompleted_counts(user))
+
+
+def invalidate():
+    caching.bump_on_commit(NAMESPACE)
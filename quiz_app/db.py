@@ -0,0 +1,81 @@
+# db.py
+"""Database connection tuning and read-replica routing."""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+REPLICA = "replica"
+
+_read_from_replica = ContextVar("quiz_read_from_replica", default=False)
+
+
+# ----------------- SQLITE TUNING -----------------
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    """Apply ``QUIZ_SQLITE_PRAGMAS`` to every new SQLite connection.
+
+    Deployments set ``QUIZ_SQLITE_JOURNAL_MODE=WAL``: readers proceed while
+    a writer holds the lock, and synchronous=NORMAL is safe. WAL is written
+    into the database file, so it is not on by default. The busy timeout is
+    the connection's ``timeout`` option (``quiz_project/database.py``).
+    """
+    pragmas = getattr(settings, "QUIZ_SQLITE_PRAGMAS", {})
+    if connection.vendor != "sqlite" or not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+
+
+# ----------------- REPLICA ROUTING -----------------
+class ReplicaRouter:
+    """Send reads to the replica alias inside ``read_from_replica()``.
+
+    Everything else, including all writes, uses ``default``.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get() and REPLICA in settings.DATABASES:
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+
+@contextmanager
+def read_from_replica():
+    token = _read_from_replica.set(True)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+def replica_reads(view):
+    """Run a read-only view's queries against the replica when one is configured.
+
+    Only for views that fill no shared cache: a lagging replica would have
+    the old rows cached under the version a commit on the primary just bumped.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            with read_from_replica():
+                return await view(request, *args, **kwargs)
+        return markcoroutinefunction(async_wrapper)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with read_from_replica():
+            return view(request, *args, **kwargs)
+    return wrapper
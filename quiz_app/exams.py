@@ -0,0 +1,179 @@
+# exams.py
+"""Timed exams.
+
+A subject with a ``time_limit`` makes every attempt a timed exam: the
+attempt gets a ``deadline`` when it starts, and the server alone decides
+when time is up. Answers that arrive more than ``GRACE_SECONDS`` after the
+deadline are refused, and the attempt is submitted (``attempts.submit``):
+its totals are fixed and the results page shows it as finished.
+
+Submission happens on the first request that sees the deadline passed (a
+question page, an answer, the results page, or a heartbeat), and
+``submit_expired_exams`` sweeps up the attempts nobody came back to.
+
+Every check reads the attempt's ``(deadline, submitted)`` from the cache,
+so checking the clock costs no query. The client heartbeat is just as
+cheap: the exam page carries a signed token for its attempt, and the
+heartbeat endpoint (JSON, or a server-sent events stream under ASGI)
+answers from that token and the cache alone, without a session, user
+lookup or database write. The page counts down locally and the heartbeat
+only corrects it.
+"""
+import math
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import attempts
+from .instrumentation import setup
+from .models import QuizAttempt
+
+DEFAULTS = {
+    # Seconds between heartbeats; the countdown itself runs in the browser
+    "HEARTBEAT_INTERVAL": 30,
+    # Answers sent just before the deadline may arrive a little after it
+    "GRACE_SECONDS": 5,
+}
+CACHE_TIMEOUT = 60 * 60 * 24
+_TOKEN_SALT = "quiz_app.exams"
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "QUIZ_EXAM", {})}
+
+
+def _cache_key(attempt_id):
+    return f"quiz:exam:{attempt_id}"
+
+
+# ----------------- STATE -----------------
+def _timing_row(row):
+    # Archived attempts are closed as well
+    if row is None:
+        return None, False
+    deadline, submitted_at, archived_at = row
+    return deadline, submitted_at is not None or archived_at is not None
+
+
+def _timing(attempt_id):
+    key = _cache_key(attempt_id)
+    timing = cache.get(key)
+    if timing is None:
+        with setup():
+            timing = _timing_row(
+                QuizAttempt.objects.filter(pk=attempt_id).values_list("deadline", "submitted_at", "archived_at").first()
+            )
+        cache.set(key, timing, timeout=CACHE_TIMEOUT)
+    return timing
+
+
+async def _atiming(attempt_id):
+    key = _cache_key(attempt_id)
+    timing = cache.get(key)
+    if timing is None:
+        with setup():
+            timing = _timing_row(
+                await QuizAttempt.objects.filter(pk=attempt_id).values_list(
+                    "deadline", "submitted_at", "archived_at"
+                ).afirst()
+            )
+        cache.set(key, timing, timeout=CACHE_TIMEOUT)
+    return timing
+
+
+def _state(timing, now):
+    deadline, submitted = timing
+    if deadline is None:
+        return {"timed": False, "deadline": None, "now": now.isoformat(), "remaining": None,
+                "expired": False, "submitted": False}
+    grace = timedelta(seconds=get_config()["GRACE_SECONDS"])
+    return {
+        "timed": True,
+        "deadline": deadline.isoformat(),
+        "now": now.isoformat(),
+        "remaining": max(math.ceil((deadline - now).total_seconds()), 0),
+        "expired": submitted or now >= deadline + grace,
+        "submitted": submitted,
+    }
+
+
+def close(attempt_id, now=None):
+    """Submit the timed attempt ``attempt_id`` (see ``attempts.submit``)."""
+    attempts.submit(attempt_id, now or timezone.now())
+    key = _cache_key(attempt_id)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def status(attempt_id, now=None):
+    """The exam state of ``attempt_id``; submits it once its time is up."""
+    now = now or timezone.now()
+    state = _state(_timing(attempt_id), now)
+    if state["expired"] and not state["submitted"]:
+        close(attempt_id, now)
+        state["submitted"] = True
+    return state
+
+
+async def astatus(attempt_id, now=None):
+    now = now or timezone.now()
+    state = _state(await _atiming(attempt_id), now)
+    if state["expired"] and not state["submitted"]:
+        # Locks the attempt row, which needs a transaction
+        await sync_to_async(close)(attempt_id, now)
+        state["submitted"] = True
+    return state
+
+
+def submit_expired(now=None, progress=None):
+    """Submit every timed attempt whose deadline (plus grace) has passed. Returns how many."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=get_config()["GRACE_SECONDS"])
+    expired = QuizAttempt.objects.filter(
+        submitted_at__isnull=True, deadline__isnull=False, deadline__lt=cutoff, archived_at__isnull=True,
+    ).order_by("deadline").values_list("pk", flat=True)
+    count = 0
+    for attempt_id in expired.iterator():
+        close(attempt_id, now)
+        count += 1
+        if progress and count % 100 == 0:
+            progress(count)
+    return count
+
+
+# ----------------- HEARTBEAT -----------------
+def heartbeat_token(attempt_id, lifetime):
+    """A token naming ``attempt_id`` that expires after ``lifetime`` seconds."""
+    return signing.dumps([attempt_id, lifetime], salt=_TOKEN_SALT)
+
+
+def attempt_for_token(token):
+    """The attempt id signed into ``token``, or None if it was tampered with or has expired."""
+    try:
+        attempt_id, lifetime = signing.loads(token, salt=_TOKEN_SALT)
+        # The lifetime is signed along with the id, so it can bound the token's age
+        signing.loads(token, salt=_TOKEN_SALT, max_age=lifetime)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    return attempt_id
+
+
+def page_context(attempt_id, state):
+    """What the exam page's countdown needs, or None for an untimed attempt."""
+    if not state["timed"]:
+        return None
+    config = get_config()
+    # Good until the last heartbeat that can still see the exam running
+    lifetime = state["remaining"] + config["GRACE_SECONDS"] + config["HEARTBEAT_INTERVAL"]
+    return {
+        **state,
+        "token": heartbeat_token(attempt_id, lifetime),
+        "interval": config["HEARTBEAT_INTERVAL"],
+        "grace": config["GRACE_SECONDS"],
+        # The event stream holds a connection open, so it is only offered under ASGI
+        "events": settings.QUIZ_ASYNC_VIEWS,
+    }
@@ -0,0 +1,323 @@
+# history.py
+"""Columnar archive of old answer history.
+
+``Submission`` gains a row per answer, and once an answer is old it is only
+ever read in aggregate (the stats rollups). ``archive()`` moves submissions
+from months that ended more than ``RETENTION_DAYS`` ago out of the table,
+into one partition per subject and calendar month (UTC) under ``ROOT``::
+
+    ROOT/<subject id>/<YYYY-MM>/id.npy user.npy question.npy option.npy second.npy meta.json
+
+Each column is a NumPy array of the narrowest unsigned type that holds its
+values. ``option`` 0 means no option was selected. ``second`` counts whole
+seconds from the start of the month, so sub-second precision is dropped.
+A row takes 10 to 20 bytes instead of a table row plus its index entries.
+Columns are opened memory-mapped, so a scan only reads the partitions and
+columns it needs, and filters are vectorised. With ``COMPRESS`` a
+partition is a single compressed ``columns.npz`` instead: smaller on disk,
+but read into memory whole.
+
+A partition is written to a temporary directory and renamed into place
+before its rows are deleted. Archiving the same month again merges by
+submission id, so an interrupted run can simply be repeated.
+
+``scan()`` and ``count_by()`` query the archive, and ``analytics.reconcile``
+adds the archived counts to the live ones. Deleting a user or a question
+does not rewrite the archive; partitions of a deleted subject can be
+removed with its directory.
+
+Needs numpy.
+"""
+import json
+import os
+import re
+import shutil
+import uuid
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .models import Question, Submission
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULTS = {
+    # Directory of the archive; None turns archiving off
+    "ROOT": None,
+    # Submissions stay in the table for at least this many days
+    "RETENTION_DAYS": 365,
+    # One compressed .npz per partition instead of memory-mappable .npy files
+    "COMPRESS": False,
+    # Rows fetched per query while archiving, and deleted per statement
+    "BATCH_SIZE": 5000,
+}
+COLUMNS = ("id", "user", "question", "option", "second")
+META = "meta.json"
+COMPRESSED = "columns.npz"
+_MONTH = re.compile(r"^\d{4}-\d{2}$")
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "QUIZ_HISTORY", {})}
+
+
+def _require_numpy():
+    if np is None:
+        raise ImproperlyConfigured("The answer archive needs numpy (pip install numpy).")
+
+
+def _root():
+    root = get_config()["ROOT"]
+    return str(root) if root else None
+
+
+# ----------------- MONTHS -----------------
+def month_start(moment):
+    """The start (UTC) of the month holding ``moment``."""
+    moment = moment.astimezone(dt_timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+
+
+def next_month(start):
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def archive_cutoff(now=None):
+    """Months before this one are archived: the month ``RETENTION_DAYS`` ago."""
+    return month_start((now or timezone.now()) - timedelta(days=get_config()["RETENTION_DAYS"]))
+
+
+# ----------------- PARTITIONS -----------------
+class Partition:
+    """The archived submissions of one subject in one month."""
+
+    def __init__(self, path, subject_id, month):
+        self.path = path
+        self.subject_id = subject_id
+        self.month = month
+
+    def __repr__(self):
+        return f"<Partition subject={self.subject_id} month={self.month:%Y-%m}>"
+
+    @cached_property
+    def meta(self):
+        with open(os.path.join(self.path, META), encoding="utf-8") as fh:
+            return json.load(fh)
+
+    @property
+    def rows(self):
+        return self.meta["rows"]
+
+    @cached_property
+    def _compressed(self):
+        path = os.path.join(self.path, COMPRESSED)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as npz:
+            return {name: npz[name] for name in COLUMNS}
+
+    def column(self, name):
+        """One column, memory-mapped (or decompressed, for a compressed partition)."""
+        if name == "submitted_at":
+            return np.datetime64(self.month.replace(tzinfo=None), "s") + self.column("second").astype("timedelta64[s]")
+        if self._compressed is not None:
+            return self._compressed[name]
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+
+
+def partitions(subject_ids=None, since=None, until=None):
+    """The partitions of ``subject_ids`` (default: all) with months overlapping [since, until)."""
+    root = _root()
+    if not root or not os.path.isdir(root):
+        return []
+    wanted = None if subject_ids is None else {int(subject_id) for subject_id in subject_ids}
+    found = []
+    for subject in sorted(os.listdir(root)):
+        if not subject.isdigit() or (wanted is not None and int(subject) not in wanted):
+            continue
+        for name in sorted(os.listdir(os.path.join(root, subject))):
+            path = os.path.join(root, subject, name)
+            if not _MONTH.match(name) or not os.path.exists(os.path.join(path, META)):
+                continue
+            month = datetime.strptime(name, "%Y-%m").replace(tzinfo=dt_timezone.utc)
+            if (since is not None and next_month(month) <= since) or (until is not None and month >= until):
+                continue
+            found.append(Partition(path, int(subject), month))
+    return found
+
+
+# ----------------- QUERIES -----------------
+def _seconds(partition, moment):
+    return int((moment - partition.month).total_seconds())
+
+
+def _mask(partition, users, questions, options, since, until):
+    mask = None
+    for name, values in (("user", users), ("question", questions), ("option", options)):
+        if values is not None:
+            matches = np.isin(partition.column(name), np.fromiter(values, dtype=np.int64))
+            mask = matches if mask is None else mask & matches
+    if since is not None and since > partition.month:
+        later = partition.column("second") >= _seconds(partition, since)
+        mask = later if mask is None else mask & later
+    if until is not None and until < next_month(partition.month):
+        earlier = partition.column("second") < _seconds(partition, until)
+        mask = earlier if mask is None else mask & earlier
+    return mask
+
+
+def scan(columns=COLUMNS, subject_ids=None, since=None, until=None, users=None, questions=None, options=None):
+    """Yield ``(partition, {column: array})`` for the archived submissions that match.
+
+    ``users``, ``questions`` and ``options`` are collections of ids and
+    ``since``/``until`` bound ``submitted_at``. Besides the stored columns,
+    ``"submitted_at"`` gives ``datetime64[s]`` values (UTC).
+    """
+    _require_numpy()
+    for partition in partitions(subject_ids, since, until):
+        mask = _mask(partition, users, questions, options, since, until)
+        if mask is not None and not mask.any():
+            continue
+        yield partition, {
+            name: partition.column(name) if mask is None else partition.column(name)[mask] for name in columns
+        }
+
+
+def count_by(column, **filters):
+    """``{value: archived submissions}`` for one of the id columns, with ``scan``'s filters."""
+    counts = Counter()
+    for _, data in scan([column], **filters):
+        values, totals = np.unique(data[column], return_counts=True)
+        counts.update(dict(zip(values.tolist(), totals.tolist())))
+    return counts
+
+
+def answer_counts(question_ids):
+    """Archived ``(submissions per question, selections per option)`` of ``question_ids``."""
+    question_ids = list(question_ids)
+    if not question_ids or not partitions():
+        return Counter(), Counter()
+    # Only the subjects of these questions have partitions worth opening
+    subject_ids = set(Question.objects.filter(pk__in=question_ids).values_list("subject_id", flat=True))
+    submissions = Counter()
+    selections = Counter()
+    for _, data in scan(["question", "option"], subject_ids=subject_ids, questions=question_ids):
+        values, totals = np.unique(data["question"], return_counts=True)
+        submissions.update(dict(zip(values.tolist(), totals.tolist())))
+        values, totals = np.unique(data["option"], return_counts=True)
+        selections.update(dict(zip(values.tolist(), totals.tolist())))
+    selections.pop(0, None)
+    return submissions, selections
+
+
+# ----------------- ARCHIVING -----------------
+def _narrow(values):
+    """``values`` as the smallest unsigned dtype that holds them."""
+    top = int(values.max()) if len(values) else 0
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if top <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values.astype(np.uint64)
+
+
+def _read(rows, month, batch_size):
+    columns = {name: array("q") for name in COLUMNS}
+    for pk, user_id, question_id, option_id, submitted_at in rows.order_by("pk").values_list(
+        "pk", "user_id", "question_id", "selected_option_id", "submitted_at"
+    ).iterator(chunk_size=batch_size):
+        columns["id"].append(pk)
+        columns["user"].append(user_id)
+        columns["question"].append(question_id)
+        columns["option"].append(option_id or 0)
+        columns["second"].append(int((submitted_at - month).total_seconds()))
+    return {name: np.frombuffer(values, dtype=np.int64) for name, values in columns.items()}
+
+
+def _merge(partition, columns):
+    """``columns`` plus what ``partition`` holds already, once per submission id."""
+    merged = {name: np.concatenate([partition.column(name).astype(np.int64), columns[name]]) for name in COLUMNS}
+    _, first = np.unique(merged["id"], return_index=True)
+    return {name: values[first] for name, values in merged.items()}
+
+
+def _write(path, columns, meta, compress):
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    staging = os.path.join(parent, f".{uuid.uuid4().hex}.tmp")
+    os.makedirs(staging)
+    if compress:
+        np.savez_compressed(os.path.join(staging, COMPRESSED), **columns)
+    else:
+        for name, values in columns.items():
+            np.save(os.path.join(staging, f"{name}.npy"), values)
+    with open(os.path.join(staging, META), "w", encoding="utf-8") as fh:
+        json.dump(meta, fh)
+    if os.path.exists(path):
+        replaced = os.path.join(parent, f".{uuid.uuid4().hex}.old")
+        os.replace(path, replaced)
+        os.replace(staging, path)
+        shutil.rmtree(replaced)
+    else:
+        os.replace(staging, path)
+
+
+def _archive_partition(root, subject_id, month, rows, config):
+    columns = _read(rows, month, config["BATCH_SIZE"])
+    ids = columns["id"].tolist()
+    if not ids:
+        return 0
+    path = os.path.join(root, str(subject_id), f"{month:%Y-%m}")
+    if os.path.exists(os.path.join(path, META)):
+        columns = _merge(Partition(path, subject_id, month), columns)
+    _write(path, {name: _narrow(values) for name, values in columns.items()}, {
+        "subject": subject_id,
+        "month": f"{month:%Y-%m}",
+        "rows": len(columns["id"]),
+        "archived_at": timezone.now().isoformat(),
+    }, config["COMPRESS"])
+    # Only now that the partition is in place
+    batch_size = config["BATCH_SIZE"]
+    for start in range(0, len(ids), batch_size):
+        Submission.objects.filter(pk__in=ids[start:start + batch_size]).delete()
+    return len(ids)
+
+
+def archive(before=None, progress=None):
+    """Move the submissions of months that ended before ``before`` (default:
+    ``archive_cutoff()``) into the archive. Returns how many were moved.
+
+    ``progress(subject_id, month, count)`` is called after each partition.
+    """
+    _require_numpy()
+    root = _root()
+    if root is None:
+        raise ImproperlyConfigured("Set QUIZ_HISTORY['ROOT'] to archive submissions.")
+    config = get_config()
+    end = month_start(before) if before else archive_cutoff()
+    moved = 0
+    start = None
+    while True:
+        older = Submission.objects.filter(submitted_at__lt=end)
+        if start is not None:
+            older = older.filter(submitted_at__gte=start)
+        first = older.order_by("submitted_at").values_list("submitted_at", flat=True).first()
+        if first is None:
+            break
+        month = month_start(first)
+        start = next_month(month)
+        rows = Submission.objects.filter(submitted_at__gte=month, submitted_at__lt=start)
+        subject_ids = rows.order_by().values_list("question__subject_id", flat=True).distinct()
+        for subject_id in sorted(subject_ids):
+            count = _archive_partition(root, subject_id, month, rows.filter(question__subject_id=subject_id), config)
+            moved += count
+            if progress:
+                progress(subject_id, month, count)
+    return moved
@@ -0,0 +1,136 @@
+# images.py
+"""Image derivative pipeline.
+
+When an image is uploaded (subject logo, question, option or explanation
+image) a background job (see ``tasks.py``) renders it at a few widths in
+WebP, plus AVIF when Pillow supports it. File names carry a content hash, so they
+can be cached forever, and every derivative is recorded as an
+``ImageDerivative`` row keyed by the original's storage name.
+
+``image_info`` turns a stored name plus its derivatives into what the
+templates need (fallback URL and one ``srcset`` per format); see the
+``{% picture %}`` tag in ``templatetags/quiz_images.py``.
+"""
+import hashlib
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, features
+
+from . import tasks
+from .models import ImageDerivative
+
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp"}
+
+# Registered in jobs.py
+DERIVATIVES_TASK = "images.derivatives"
+
+
+def derivative_widths():
+    return getattr(settings, "QUIZ_IMAGE_WIDTHS", (320, 640, 1024))
+
+
+def derivative_formats():
+    # Preferred format first; browsers pick the first <source> they support
+    formats = ["avif"] if features.check("avif") else []
+    return formats + ["webp"]
+
+
+def _hash(data):
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def _render(image, width, fmt):
+    resized = image.copy()
+    if width < image.width:
+        resized.thumbnail((width, image.height * width // image.width), Image.LANCZOS)
+    if resized.mode not in ("RGB", "RGBA"):
+        has_alpha = resized.mode in ("LA", "PA") or "transparency" in resized.info
+        resized = resized.convert("RGBA" if has_alpha else "RGB")
+    buffer = BytesIO()
+    resized.save(buffer, format=fmt.upper(), quality=80)
+    return buffer.getvalue()
+
+
+def generate_derivatives(name, storage):
+    """Render all derivatives of ``name`` that don't exist yet. Returns how many were made."""
+    if ImageDerivative.objects.filter(source=name).exists():
+        return 0
+
+    with storage.open(name, "rb") as fh:
+        data = fh.read()
+    image = Image.open(BytesIO(data))
+    image.load()
+
+    stem = os.path.splitext(os.path.basename(name))[0]
+    source_hash = _hash(data)
+    # Never upscale: widths above the original collapse into the original width
+    widths = sorted({min(width, image.width) for width in derivative_widths()})
+
+    rows = []
+    for fmt in derivative_formats():
+        for width in widths:
+            # The storage may rename the file (content-hash storage does), so keep what it returns
+            target = storage.save(
+                f"derivatives/{stem}.{source_hash}.{width}w.{fmt}", ContentFile(_render(image, width, fmt))
+            )
+            rows.append(ImageDerivative(source=name, width=width, format=fmt, name=target))
+    ImageDerivative.objects.bulk_create(rows, ignore_conflicts=True)
+    return len(rows)
+
+
+def schedule(name, subject_id=None):
+    """Queue the derivatives of ``name``; the job refreshes the cached pages
+    of ``subject_id`` once they exist. Queued at most once per image and
+    subject, unless the earlier job failed."""
+    if not name:
+        return
+    tasks.enqueue(
+        DERIVATIVES_TASK, {"name": name, "subject_id": subject_id}, key=f"derivatives:{subject_id}:{name}"
+    )
+
+
+# ----------------- TEMPLATE DATA -----------------
+def _derivative_rows(names):
+    # Chunked so large subjects stay under the database's parameter limit
+    names = sorted({name for name in names if name})
+    for start in range(0, len(names), 500):
+        yield ImageDerivative.objects.filter(source__in=names[start:start + 500]).order_by("width").values_list(
+            "source", "format", "width", "name"
+        )
+
+
+def _collect(found, rows, storage):
+    for source, fmt, width, name in rows:
+        found.setdefault(source, []).append((fmt, width, storage.url(name)))
+
+
+def derivatives_for(names, storage):
+    """Return ``{source name: [(format, width, url), ...]}`` (one query per 500 names)."""
+    found = {}
+    for queryset in _derivative_rows(names):
+        _collect(found, queryset, storage)
+    return found
+
+
+async def aderivatives_for(names, storage):
+    found = {}
+    for queryset in _derivative_rows(names):
+        _collect(found, [row async for row in queryset], storage)
+    return found
+
+
+def image_info(field, name, derivatives):
+    """Everything a template needs to render ``name`` responsively, or None."""
+    if not name:
+        return None
+    sources = []
+    by_format = {}
+    for fmt, width, url in derivatives.get(name, ()):
+        by_format.setdefault(fmt, []).append(f"{url} {width}w")
+    for fmt in derivative_formats():
+        if fmt in by_format:
+            sources.append({"type": MIME_TYPES[fmt], "srcset": ", ".join(by_format[fmt])})
+    return {"url": field.storage.url(name), "sources": sources}
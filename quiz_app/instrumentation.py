@@ -0,0 +1,347 @@
+# instrumentation.py
+"""Per-view performance instrumentation.
+
+``InstrumentationMiddleware`` records, for a sample of requests, the wall
+time of the view, how many queries it ran and how long they took, how long
+its templates took to render, and its cache hits and misses. Samples go
+into a bounded ring buffer per view, and ``stats()`` turns them into
+percentiles; staff can read them at ``/admin/instrumentation/``.
+
+With ``SAMPLE_RATE`` at 0 (the default) the middleware removes itself at
+startup (``MiddlewareNotUsed``) and none of the hooks below are installed,
+so an unsampled deployment pays nothing. Once enabled, the query, template
+and cache hooks are installed process-wide and look up the current sample
+in a context variable, which follows the request into the threads that
+async views run their queries in.
+
+Views declare how many queries they may run with ``@query_budget(n)``:
+the ceiling of their steady state, once caches are warm and the rows they
+write exist. One-off work (filling a cache, starting an attempt, creating
+a learner's first summary or a question's first stats row) runs inside
+``with setup():``; its queries count in the stats but not against the
+budget. Sampled requests over budget are logged and counted in the stats,
+and ``quiz_app.testing.QueryBudgetMixin`` fails a test that goes over.
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import JsonResponse
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Share of requests measured, 0.0 to 1.0; 0 turns the middleware off
+    "SAMPLE_RATE": 0.0,
+    # Samples kept per view; older ones drop out of the percentiles
+    "BUFFER_SIZE": 1000,
+}
+
+_current = ContextVar("quiz_instrumentation_sample", default=None)
+_setup = ContextVar("quiz_instrumentation_setup", default=False)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "QUIZ_INSTRUMENTATION", {})}
+
+
+# ----------------- QUERY BUDGETS -----------------
+def query_budget(queries):
+    """Declare the most queries ``view`` should run per request."""
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
+
+
+def budget_for(view):
+    return getattr(view, "query_budget", None)
+
+
+@contextmanager
+def setup():
+    """Mark the queries inside as one-off work that doesn't count against the view's budget."""
+    token = _setup.set(True)
+    try:
+        yield
+    finally:
+        _setup.reset(token)
+
+
+def in_setup():
+    return _setup.get()
+
+
+# ----------------- SAMPLES -----------------
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Sample:
+    __slots__ = (
+        "wall", "queries", "setup_queries", "query_time", "template_time", "template_depth", "cache_hits",
+        "cache_misses",
+    )
+
+    def __init__(self):
+        self.wall = 0.0
+        self.queries = 0
+        self.setup_queries = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class Recorder:
+    """Ring buffers of samples per view name."""
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._views = {}
+        self._over_budget = {}
+
+    def add(self, view_name, sample, budget=None):
+        budgeted = sample.queries - sample.setup_queries
+        over = budget is not None and budgeted > budget
+        with self._lock:
+            samples = self._views.get(view_name)
+            if samples is None:
+                samples = self._views[view_name] = deque(maxlen=self.size)
+            samples.append(sample)
+            if over:
+                self._over_budget[view_name] = self._over_budget.get(view_name, 0) + 1
+        if over:
+            logger.warning(
+                "%s ran %d queries (budget %d, plus %d setup)", view_name, budgeted, budget, sample.setup_queries
+            )
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+            self._over_budget.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {name: list(samples) for name, samples in self._views.items()}, dict(self._over_budget)
+
+
+_recorder = Recorder(DEFAULTS["BUFFER_SIZE"])
+
+
+def _ms(values):
+    values = sorted(values)
+    return {
+        "p50": round(percentile(values, 50) * 1000, 2),
+        "p95": round(percentile(values, 95) * 1000, 2),
+        "p99": round(percentile(values, 99) * 1000, 2),
+        "max": round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+def stats():
+    views, over_budget = _recorder.snapshot()
+    result = {}
+    for name, samples in sorted(views.items()):
+        queries = sorted(sample.queries for sample in samples)
+        hits = sum(sample.cache_hits for sample in samples)
+        lookups = hits + sum(sample.cache_misses for sample in samples)
+        result[name] = {
+            "samples": len(samples),
+            "wall_ms": _ms([sample.wall for sample in samples]),
+            "query_ms": _ms([sample.query_time for sample in samples]),
+            "template_ms": _ms([sample.template_time for sample in samples]),
+            "queries": {
+                "mean": round(sum(queries) / len(queries), 2),
+                "p95": percentile(queries, 95),
+                "max": queries[-1],
+                "setup": sum(sample.setup_queries for sample in samples),
+            },
+            "cache": {
+                "hits": hits,
+                "misses": lookups - hits,
+                "hit_rate": round(hits * 100 / lookups, 1) if lookups else None,
+            },
+            "over_budget": over_budget.get(name, 0),
+        }
+    return result
+
+
+def reset():
+    _recorder.clear()
+
+
+# ----------------- HOOKS -----------------
+def _record_query(execute, sql, params, many, context):
+    sample = _current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.query_time += time.perf_counter() - start
+        sample.queries += 1
+        if _setup.get():
+            sample.setup_queries += 1
+
+
+def _wrap_connection(connection):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    _wrap_connection(connection)
+
+
+def _timed_render(render):
+    @wraps(render)
+    def wrapper(self, context):
+        sample = _current.get()
+        if sample is None:
+            return render(self, context)
+        # Includes render inside their parent; only the outermost template counts
+        sample.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            sample.template_depth -= 1
+            if not sample.template_depth:
+                sample.template_time += time.perf_counter() - start
+    return wrapper
+
+
+def _counted_get(get):
+    @wraps(get)
+    def wrapper(self, key, default=None, version=None):
+        value = get(self, key, default, version)
+        sample = _current.get()
+        if sample is not None:
+            if value is default:
+                sample.cache_misses += 1
+            else:
+                sample.cache_hits += 1
+        return value
+    return wrapper
+
+
+def _counted_get_many(get_many):
+    @wraps(get_many)
+    def wrapper(self, keys, version=None):
+        keys = list(keys)
+        values = get_many(self, keys, version)
+        sample = _current.get()
+        if sample is not None:
+            sample.cache_hits += len(values)
+            sample.cache_misses += len(keys) - len(values)
+        return values
+    return wrapper
+
+
+_install_lock = threading.Lock()
+_installed = False
+
+
+def install():
+    """Hook queries, template rendering and the default cache (once per process)."""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        connection_created.connect(_on_connection_created, dispatch_uid="quiz_instrumentation")
+        for connection in connections.all(initialized_only=True):
+            _wrap_connection(connection)
+        Template.render = _timed_render(Template.render)
+        backend = type(caches["default"])
+        backend.get = _counted_get(backend.get)
+        # The base get_many goes through get, which already counts
+        if backend.get_many is not BaseCache.get_many:
+            backend.get_many = _counted_get_many(backend.get_many)
+        _installed = True
+
+
+# ----------------- MIDDLEWARE -----------------
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+        self.sample_rate = config["SAMPLE_RATE"]
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        global _recorder
+        if _recorder.size != config["BUFFER_SIZE"]:
+            _recorder = Recorder(config["BUFFER_SIZE"])
+        install()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def _finish(self, request, sample, start, token):
+        sample.wall = time.perf_counter() - start
+        _current.reset(token)
+        match = request.resolver_match
+        if match is not None:
+            _recorder.add(match.view_name, sample, budget_for(match.func))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+        sample = Sample()
+        token = _current.set(sample)
+        start = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            self._finish(request, sample, start, token)
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+        sample = Sample()
+        token = _current.set(sample)
+        start = time.perf_counter()
+        try:
+            return await self.get_response(request)
+        finally:
+            self._finish(request, sample, start, token)
+
+
+# ----------------- STATS ENDPOINT -----------------
+def stats_view(request):
+    """The per-view stats as JSON; POST clears them. Mounted behind the admin login."""
+    if request.method == "POST":
+        reset()
+    config = get_config()
+    return JsonResponse({
+        "enabled": _installed,
+        "sample_rate": config["SAMPLE_RATE"],
+        "buffer_size": config["BUFFER_SIZE"],
+        "views": stats(),
+    })
@@ -0,0 +1,77 @@
+# jobs.py
+"""The background tasks of the quiz app (see ``tasks.py`` for the queue).
+
+Imported at startup by ``QuizAppConfig.ready``, so the web processes can
+enqueue these by name and the ``run_tasks`` worker can run them.
+"""
+import os
+from contextlib import suppress
+
+from django.contrib.auth.models import User
+from PIL import UnidentifiedImageError
+
+from . import analytics, catalogue, exams, history, images, manifest, summaries, tasks
+from .models import Question
+from .questionbank import BankError, QuestionBank, import_bank
+from .storage import quiz_media_storage
+
+IMPORT_BANK = "questionbank.import"
+RECONCILE_STATS = "analytics.reconcile"
+REBUILD_SUMMARIES = "summaries.rebuild"
+SUBMIT_EXPIRED_EXAMS = "exams.submit_expired"
+ARCHIVE_SUBMISSIONS = "history.archive"
+
+
+@tasks.task(images.DERIVATIVES_TASK, priority=tasks.HIGH)
+def image_derivatives(name, subject_id=None):
+    try:
+        made = images.generate_derivatives(name, quiz_media_storage())
+    except (FileNotFoundError, UnidentifiedImageError) as exc:
+        # Replaced or unreadable uploads won't get better by retrying
+        raise tasks.PermanentFailure(str(exc)) from exc
+    if subject_id is not None:
+        # Also when another job made them: that job only refreshed its own subject
+        manifest.invalidate(subject_id)
+        catalogue.invalidate()
+    return made
+
+
+@tasks.task(IMPORT_BANK, priority=tasks.LOW, max_attempts=1)
+def import_question_bank(path, images=None, dry_run=False, skip_duplicates=False):
+    """Import a bank stashed by ``tasks.stash``; the files are removed afterwards.
+
+    Never retried: a failed import may have written some batches already.
+    """
+    try:
+        with QuestionBank(path, images=images) as bank:
+            report = import_bank(bank, dry_run=dry_run, skip_duplicates=skip_duplicates)
+    except BankError as exc:
+        raise tasks.PermanentFailure(str(exc)) from exc
+    finally:
+        for stashed in (path, images):
+            if stashed:
+                with suppress(FileNotFoundError):
+                    os.remove(stashed)
+    return report.as_dict()
+
+
+@tasks.task(RECONCILE_STATS, priority=tasks.LOW)
+def reconcile_stats(question_ids=None):
+    questions = None if question_ids is None else Question.objects.filter(pk__in=question_ids)
+    return analytics.reconcile(questions)
+
+
+@tasks.task(REBUILD_SUMMARIES, priority=tasks.LOW)
+def rebuild_summaries(user_ids=None):
+    users = None if user_ids is None else User.objects.filter(pk__in=user_ids)
+    return summaries.rebuild(users)
+
+
+@tasks.task(SUBMIT_EXPIRED_EXAMS)
+def submit_expired_exams():
+    return exams.submit_expired()
+
+
+@tasks.task(ARCHIVE_SUBMISSIONS, priority=tasks.LOW)
+def archive_submissions():
+    return history.archive()
@@ -0,0 +1,428 @@
+# leaderboards.py
+"""Per-subject and global leaderboards.
+
+Learners are ranked by questions answered correctly, then by fewest
+attempts, then by fewest hints (ties by user id), all taken from
+``UserProgress``. A board is kept as a sorted structure and updated
+incrementally after every committed answer (``recording`` passes the
+answers' ``summaries.SummaryDelta``), so top-N, "my rank" and any page of
+ranks are O(log n) lookups instead of a window function over every
+progress row.
+
+Two backends, picked by ``QUIZ_LEADERBOARD['BACKEND']``:
+
+* ``local`` (default): a sorted list per board in this process, split into
+  buckets of at most ``2 * _Buckets.LOAD`` entries so an update shifts one
+  bucket rather than the whole board.
+  Each process only sees its own answers, so a board is reloaded from the
+  database once it is older than ``RECONCILE_INTERVAL`` seconds.
+* ``redis``: one sorted set per board shared by all processes (needs the
+  ``redis`` package and ``QUIZ_LEADERBOARD['URL']``). Reconcile it with the
+  ``reconcile_leaderboards`` command, e.g. from cron.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from .instrumentation import setup
+from .models import Subject, UserProgress
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+GLOBAL = "global"
+PAGE_SIZE = 25
+
+DEFAULTS = {
+    "BACKEND": "local",
+    "RECONCILE_INTERVAL": 300,
+    "URL": None,
+    "KEY_PREFIX": "quiz:leaderboard",
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "QUIZ_LEADERBOARD", {})}
+
+
+def subject_board(subject_id):
+    return f"subject:{subject_id}"
+
+
+# ----------------- SCORES FROM THE DATABASE -----------------
+def _score_rows(board):
+    rows = UserProgress.objects.filter(user__isnull=False, attempts__gt=0)
+    if board != GLOBAL:
+        rows = rows.filter(subject_id=int(board.split(":", 1)[1]))
+    return rows.values("user_id").annotate(
+        correct=Count("id", filter=Q(answered_correctly=True)),
+        attempts=Sum("attempts"),
+        hints=Count("id", filter=Q(hint_used=True)),
+    ).order_by().values_list("user_id", "correct", "attempts", "hints")
+
+
+def load_scores(board):
+    """``{user_id: (correct, attempts, hints)}`` for ``board``, from ``UserProgress``."""
+    return {user_id: (correct, attempts, hints) for user_id, correct, attempts, hints in _score_rows(board)}
+
+
+def all_boards():
+    return [GLOBAL] + [subject_board(pk) for pk in Subject.objects.order_by("pk").values_list("pk", flat=True)]
+
+
+# ----------------- LOCAL BACKEND -----------------
+class _Buckets:
+    """A sorted list kept as consecutive sorted buckets.
+
+    ``_maxes`` (each bucket's last key) finds a key's bucket by bisection, and
+    a Fenwick tree over the bucket sizes turns a bucket into a position, so
+    adding, removing and ranking cost O(log n) plus one bucket's shift. The
+    tree is rebuilt only when a bucket is split or emptied.
+    """
+
+    LOAD = 500
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._buckets = [keys[start:start + self.LOAD] for start in range(0, len(keys), self.LOAD)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(keys)
+        self._tree = None
+
+    def __len__(self):
+        return self._len
+
+    def _sizes(self):
+        if self._tree is None:
+            tree = [0] + [len(bucket) for bucket in self._buckets]
+            for i in range(1, len(tree)):
+                parent = i + (i & -i)
+                if parent < len(tree):
+                    tree[parent] += tree[i]
+            self._tree = tree
+        return self._tree
+
+    def _resize(self, index, change):
+        tree = self._tree
+        if tree is not None:
+            i = index + 1
+            while i < len(tree):
+                tree[i] += change
+                i += i & -i
+
+    def _before(self, index):
+        """Keys in the buckets before ``index``."""
+        tree = self._sizes()
+        total = 0
+        while index:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+    def _locate(self, position):
+        """``(bucket index, offset)`` of the key at ``position``."""
+        tree = self._sizes()
+        index = 0
+        step = 1 << (len(tree).bit_length() - 1)
+        while step:
+            if index + step < len(tree) and tree[index + step] <= position:
+                index += step
+                position -= tree[index]
+            step >>= 1
+        return index, position
+
+    def add(self, key):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            self._tree = None
+            return
+        index = min(bisect_left(self._maxes, key), len(self._maxes) - 1)
+        bucket = self._buckets[index]
+        insort(bucket, key)
+        self._maxes[index] = bucket[-1]
+        self._len += 1
+        if len(bucket) > 2 * self.LOAD:
+            self._buckets[index:index + 1] = [bucket[:self.LOAD], bucket[self.LOAD:]]
+            self._maxes[index:index + 1] = [bucket[self.LOAD - 1], bucket[-1]]
+            self._tree = None
+        else:
+            self._resize(index, 1)
+
+    def remove(self, key):
+        index = bisect_left(self._maxes, key)
+        bucket = self._buckets[index]
+        del bucket[bisect_left(bucket, key)]
+        self._len -= 1
+        if bucket:
+            self._maxes[index] = bucket[-1]
+            self._resize(index, -1)
+        else:
+            del self._buckets[index], self._maxes[index]
+            self._tree = None
+
+    def position(self, key):
+        """How many keys sort before ``key``."""
+        index = bisect_left(self._maxes, key)
+        if index == len(self._maxes):
+            return self._len
+        return self._before(index) + bisect_left(self._buckets[index], key)
+
+    def slice(self, start, count):
+        if start >= self._len or count <= 0:
+            return []
+        index, offset = self._locate(start)
+        keys = []
+        while len(keys) < count and index < len(self._buckets):
+            keys.extend(self._buckets[index][offset:offset + count - len(keys)])
+            index, offset = index + 1, 0
+        return keys
+
+
+class _SortedBoard:
+    def __init__(self, scores):
+        self.scores = scores
+        self.order = _Buckets(self._key(user_id, score) for user_id, score in scores.items())
+        self.loaded_at = time.monotonic()
+
+    @staticmethod
+    def _key(user_id, score):
+        correct, attempts, hints = score
+        return (-correct, attempts, hints, user_id)
+
+    def add(self, user_id, correct, attempts, hints):
+        old = self.scores.get(user_id)
+        if old is not None:
+            self.order.remove(self._key(user_id, old))
+            correct, attempts, hints = old[0] + correct, old[1] + attempts, old[2] + hints
+        score = (max(correct, 0), max(attempts, 0), max(hints, 0))
+        self.scores[user_id] = score
+        self.order.add(self._key(user_id, score))
+
+    def rank(self, user_id):
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return self.order.position(self._key(user_id, score)) + 1, score
+
+    def page(self, start, count):
+        return [(-key[0], key[1], key[2], key[3]) for key in self.order.slice(start, count)]
+
+
+class LocalBackend:
+    def __init__(self, reconcile_interval):
+        self.reconcile_interval = reconcile_interval
+        self._boards = {}
+        self._lock = threading.Lock()
+
+    def _board(self, board):
+        current = self._boards.get(board)
+        if current is None or time.monotonic() - current.loaded_at > self.reconcile_interval:
+            # Loaded outside the lock; answers committed meanwhile are in the query
+            with setup():
+                current = _SortedBoard(load_scores(board))
+            with self._lock:
+                self._boards[board] = current
+        return current
+
+    def add(self, board, user_id, correct, attempts, hints):
+        # Boards that aren't loaded yet pick the answer up from the database
+        current = self._boards.get(board)
+        if current is not None:
+            with self._lock:
+                current.add(user_id, correct, attempts, hints)
+
+    def rank(self, board, user_id):
+        current = self._board(board)
+        with self._lock:
+            return current.rank(user_id)
+
+    def page(self, board, start, count):
+        current = self._board(board)
+        with self._lock:
+            return current.page(start, count), len(current.order)
+
+    def reconcile(self, board):
+        current = _SortedBoard(load_scores(board))
+        with self._lock:
+            self._boards[board] = current
+        return len(current.order)
+
+
+# ----------------- REDIS BACKEND -----------------
+# One sorted set per board. The three ranking fields are packed into one
+# float score, exact below 2**53: correct < 9,000, attempts and hints < 10**6.
+_SHIFT = 10 ** 6
+
+
+def _pack(correct, attempts, hints):
+    # Negated, so ascending order (and ascending member order on ties) is rank order
+    return -(correct * _SHIFT * _SHIFT - attempts * _SHIFT - hints)
+
+
+def _unpack(score):
+    packed = -int(score)
+    correct = -(-packed // (_SHIFT * _SHIFT))
+    rest = correct * _SHIFT * _SHIFT - packed
+    return correct, rest // _SHIFT, rest % _SHIFT
+
+
+def _member(user_id):
+    # Zero-padded, so ties sort by user id like the local backend
+    return f"{user_id:012d}"
+
+
+class RedisBackend:
+    def __init__(self, url, key_prefix):
+        if redis is None:
+            raise ImproperlyConfigured("The redis leaderboard backend needs the 'redis' package.")
+        if not url:
+            raise ImproperlyConfigured("QUIZ_LEADERBOARD['URL'] is required for the redis leaderboard backend.")
+        self.client = redis.Redis.from_url(url)
+        self.key_prefix = key_prefix
+
+    def _key(self, board):
+        return f"{self.key_prefix}:{board}"
+
+    def add(self, board, user_id, correct, attempts, hints):
+        self.client.zincrby(self._key(board), _pack(correct, attempts, hints), _member(user_id))
+
+    def rank(self, board, user_id):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zrank(self._key(board), _member(user_id))
+        pipe.zscore(self._key(board), _member(user_id))
+        rank, score = pipe.execute()
+        return None if rank is None else (rank + 1, _unpack(score))
+
+    def page(self, board, start, count):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zrange(self._key(board), start, start + count - 1, withscores=True)
+        pipe.zcard(self._key(board))
+        rows, total = pipe.execute()
+        return [(*_unpack(score), int(member)) for member, score in rows], total
+
+    def reconcile(self, board):
+        scores = load_scores(board)
+        key = self._key(board)
+        staging = f"{key}:rebuild"
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(staging)
+        if scores:
+            pipe.zadd(staging, {_member(user_id): _pack(*score) for user_id, score in scores.items()})
+            # Swapped in atomically, so readers never see a half-built board
+            pipe.rename(staging, key)
+        else:
+            pipe.delete(key)
+        pipe.execute()
+        return len(scores)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = get_config()
+                if config["BACKEND"] == "redis":
+                    _backend = RedisBackend(config["URL"], config["KEY_PREFIX"])
+                else:
+                    _backend = LocalBackend(config["RECONCILE_INTERVAL"])
+    return _backend
+
+
+def reset_backend():
+    """Drop the current backend so the next call re-reads settings."""
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+# ----------------- UPDATES -----------------
+def _apply(deltas):
+    backend = get_backend()
+    for delta in deltas:
+        if delta.user_id is None:
+            continue
+        for board in (GLOBAL, subject_board(delta.subject_id)):
+            backend.add(board, delta.user_id, delta.correct, 1, delta.hints_used)
+
+
+def record(deltas):
+    """Add answers (their ``summaries.SummaryDelta``) to the boards once the
+    surrounding transaction commits."""
+    deltas = list(deltas)
+    if deltas:
+        transaction.on_commit(lambda: _apply(deltas))
+
+
+def remove(user_id, subject_id, correct, attempts, hints):
+    """Take an archived attempt's totals off the boards once the transaction commits."""
+    if user_id is None:
+        return
+
+    def _remove():
+        backend = get_backend()
+        for board in (GLOBAL, subject_board(subject_id)):
+            backend.add(board, user_id, -correct, -attempts, -hints)
+
+    transaction.on_commit(_remove)
+
+
+def reconcile(boards=None, progress=None):
+    """Rebuild ``boards`` (default: all) from the database. Returns the number of ranked entries."""
+    backend = get_backend()
+    entries = 0
+    for board in boards or all_boards():
+        entries += backend.reconcile(board)
+        if progress:
+            progress(board)
+    return entries
+
+
+# ----------------- READS -----------------
+def _entry(rank, user_id, correct, attempts, hints, usernames):
+    return {
+        "rank": rank,
+        "user_id": user_id,
+        "username": usernames.get(user_id, ""),
+        "correct": correct,
+        "attempts": attempts,
+        "hints": hints,
+    }
+
+
+def page(board, number=1, user=None, size=PAGE_SIZE):
+    """One page of ``board`` plus ``user``'s own rank. Usernames cost one query per page."""
+    number = max(number, 1)
+    start = (number - 1) * size
+    backend = get_backend()
+    rows, total = backend.page(board, start, size)
+    mine = backend.rank(board, user.pk) if user is not None and user.is_authenticated else None
+
+    user_ids = {row[3] for row in rows} | ({user.pk} if mine else set())
+    usernames = dict(User.objects.filter(pk__in=user_ids).values_list("pk", "username")) if user_ids else {}
+    return {
+        "board": board,
+        "page": number,
+        "page_size": size,
+        "total": total,
+        "pages": max((total + size - 1) // size, 1),
+        "entries": [
+            _entry(start + offset + 1, user_id, correct, attempts, hints, usernames)
+            for offset, (correct, attempts, hints, user_id) in enumerate(rows)
+        ],
+        "me": _entry(mine[0], user.pk, *mine[1], usernames) if mine else None,
+    }
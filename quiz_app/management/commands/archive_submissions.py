@@ -0,0 +1,33 @@
+from datetime import datetime, timezone
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app import history
+
+
+class Command(BaseCommand):
+    help = (
+        "Move submissions of months older than QUIZ_HISTORY['RETENTION_DAYS'] out of the table into the "
+        "columnar archive (one partition per subject and month). Safe to run again after an interruption."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--before", metavar="YYYY-MM", help="Archive the months before this one instead")
+
+    def handle(self, *args, **options):
+        before = None
+        if options["before"]:
+            try:
+                before = datetime.strptime(options["before"], "%Y-%m").replace(tzinfo=timezone.utc)
+            except ValueError:
+                raise CommandError("--before must look like 2024-01")
+
+        def progress(subject_id, month, count):
+            self.stdout.write(f"  {month:%Y-%m} subject {subject_id}: {count} submissions archived")
+
+        try:
+            count = history.archive(before=before, progress=progress)
+        except ImproperlyConfigured as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f"Archived {count} submissions"))
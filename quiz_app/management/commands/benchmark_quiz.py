@@ -0,0 +1,104 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from quiz_app.benchmarking import (
+    SCENARIOS, Workload, benchmark_users, compare, run_client_scenario, run_http_processes, scenario_requests,
+    session_cookie_for,
+)
+from quiz_app.models import QuizAttempt, UserProgress
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the quiz flow (browsing, answering, results) on the data from generate_benchmark_data, "
+        "in-process through the test client or over HTTP against a running server, and compare the "
+        "report with a baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated: " + ", ".join(SCENARIOS))
+        parser.add_argument("--users", type=int, default=10, help="Benchmark users to act as")
+        parser.add_argument("--iterations", type=int, default=200, help="Runs of each scenario (test client)")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--http", metavar="BASE_URL", help="Load a running server instead, e.g. http://127.0.0.1:8000")
+        parser.add_argument("--processes", type=int, default=2, help="Load generating processes (--http)")
+        parser.add_argument("--concurrency", type=int, default=10, help="Connections per process (--http)")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario (--http)")
+        parser.add_argument("--output", help="Write the report as JSON to this file")
+        parser.add_argument("--baseline", help="Report to compare against")
+        parser.add_argument("--tolerance", type=float, default=10.0,
+                            help="Percent slower or less throughput than the baseline that still passes")
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options["scenarios"].split(",") if name.strip()]
+        for name in names:
+            if name not in SCENARIOS:
+                raise CommandError(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        baseline = None
+        if options["baseline"]:
+            if not os.path.exists(options["baseline"]):
+                raise CommandError(f"No baseline at {options['baseline']}")
+            with open(options["baseline"]) as fh:
+                baseline = json.load(fh)
+
+        try:
+            users = benchmark_users(options["users"])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        workload = Workload()
+
+        report = {
+            "created": timezone.now().isoformat(),
+            "mode": "http" if options["http"] else "client",
+            "dataset": {
+                "subjects": len(workload.subject_ids),
+                "questions": len(workload.options),
+                "progress": UserProgress.objects.count(),
+                "attempts": QuizAttempt.objects.count(),
+            },
+            "scenarios": {},
+        }
+        if options["http"]:
+            report.update(processes=options["processes"], concurrency=options["concurrency"])
+            cookies = [session_cookie_for(user) for user in users]
+        else:
+            report.update(users=len(users), iterations=options["iterations"])
+
+        for name in names:
+            self.stdout.write(f"Running {name} ...")
+            if options["http"]:
+                requests = scenario_requests(name, workload, 500, seed=options["seed"])
+                result = run_http_processes(
+                    options["http"].rstrip("/"), requests, processes=options["processes"],
+                    concurrency=options["concurrency"], duration=options["duration"], cookies=cookies,
+                )
+            else:
+                result = run_client_scenario(name, workload, users, options["iterations"], seed=options["seed"])
+            report["scenarios"][name] = result
+            self.stdout.write(self._format(name, result))
+
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(report, fh, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+
+        if baseline is not None:
+            regressions = compare(baseline, report, options["tolerance"])
+            for regression in regressions:
+                self.stderr.write(
+                    "{scenario}: {metric} {baseline} -> {current}".format(**regression)
+                    + (f" ({regression['change_pct']:+}%)" if regression["change_pct"] is not None else "")
+                )
+            if regressions:
+                raise CommandError(f"{len(regressions)} regressions against {options['baseline']}")
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['baseline']}"))
+
+    def _format(self, name, result):
+        queries = f", {result['queries_per_request']} queries/request" if "queries_per_request" in result else ""
+        return (
+            f"  {name}: {result['rps']} req/s, p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+            f"p99 {result['p99_ms']} ms{queries} ({result['requests']} requests, {result['errors']} errors)"
+        )
@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from quiz_app.benchmarking import run_http_load, session_cookie_for, wait_for_server
+from quiz_app.models import Subject
+from quiz_app.navigation import get_index
+
+SERVERS = {
+    # Current deployment path: sync views behind a WSGI server
+    "wsgi": {
+        "executable": "gunicorn",
+        "command": ["gunicorn", "quiz_project.wsgi:application",
+                    "--workers", "{workers}", "--bind", "127.0.0.1:{port}"],
+        "env": {"QUIZ_ASYNC_VIEWS": "0"},
+    },
+    # Native async views behind uvicorn workers
+    "asgi": {
+        "executable": "uvicorn",
+        "command": ["uvicorn", "quiz_project.asgi:application",
+                    "--workers", "{workers}", "--host", "127.0.0.1", "--port", "{port}",
+                    "--log-level", "warning"],
+        "env": {"QUIZ_ASYNC_VIEWS": "1"},
+    },
+}
+
+
+class Command(BaseCommand):
+    help = "Compare requests/second and latency percentiles of the WSGI and ASGI (async views) deployments."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--servers", default="wsgi,asgi", help="Comma separated: wsgi, asgi")
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--duration", type=float, default=15.0, help="Seconds of load per server")
+        parser.add_argument("--port", type=int, default=8150)
+        parser.add_argument("--username", default="benchmark", help="User the quiz pages are requested as")
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        servers = [name.strip() for name in options["servers"].split(",") if name.strip()]
+        for name in servers:
+            if name not in SERVERS:
+                raise CommandError(f"Unknown server {name!r}; choose from {', '.join(SERVERS)}")
+            if not shutil.which(SERVERS[name]["executable"]):
+                raise CommandError(f"{SERVERS[name]['executable']} is not installed")
+
+        paths = self._paths()
+        user, _ = User.objects.get_or_create(username=options["username"])
+        cookie = session_cookie_for(user)
+
+        report = {"paths": paths, "concurrency": options["concurrency"], "workers": options["workers"], "servers": {}}
+        for offset, name in enumerate(servers):
+            port = options["port"] + offset
+            self.stdout.write(f"Benchmarking {name} on port {port} ...")
+            report["servers"][name] = self._run(name, port, paths, cookie, options)
+            self.stdout.write(self._format(name, report["servers"][name]))
+
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(report, fh, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+
+    def _paths(self):
+        paths = [reverse("subject_list")]
+        for subject_id in Subject.objects.order_by("id").values_list("id", flat=True):
+            first_question_id = get_index(subject_id).first_id
+            if first_question_id:
+                paths.append(reverse("question_detail", args=[subject_id, first_question_id]))
+                paths.append(reverse("results", args=[subject_id]))
+                break
+        return paths
+
+    def _run(self, name, port, paths, cookie, options):
+        spec = SERVERS[name]
+        command = [part.format(workers=options["workers"], port=port) for part in spec["command"]]
+        env = {**os.environ, **spec["env"]}
+        process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=sys.stderr)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            if not wait_for_server(base_url):
+                raise CommandError(f"{name} server did not start on port {port}")
+            # Warm caches and worker processes before measuring
+            run_http_load(base_url, paths, concurrency=options["concurrency"], duration=2, cookie=cookie)
+            return run_http_load(
+                base_url, paths, concurrency=options["concurrency"], duration=options["duration"], cookie=cookie
+            )
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    def _format(self, name, result):
+        return (
+            f"  {name}: {result['rps']} req/s, p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+            f"p99 {result['p99_ms']} ms ({result['requests']} requests, {result['errors']} errors)"
+        )
@@ -0,0 +1,75 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from quiz_app import catalogue, manifest
+from quiz_app.mediafiles import IMAGE_FIELDS, rebuild_references
+from quiz_app.models import ImageDerivative, Subject
+from quiz_app.storage import content_hash, hashed_name, quiz_media_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Move existing quiz images to content-hash names, point every row at the shared copy "
+        "and delete the duplicates. Safe to run repeatedly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Report what would change without touching anything")
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        storage = quiz_media_storage()
+
+        names = set()
+        for model, field_name in IMAGE_FIELDS:
+            names.update(model.objects.exclude(**{field_name: ""}).values_list(field_name, flat=True))
+
+        renames = {}
+        missing = 0
+        for name in sorted(names):
+            if not storage.exists(name):
+                missing += 1
+                self.stderr.write(f"Missing file: {name}")
+                continue
+            with storage.open(name, "rb") as fh:
+                canonical = hashed_name(name, content_hash(fh))
+            if canonical != name:
+                renames[name] = canonical
+
+        by_target = defaultdict(list)
+        for name, canonical in renames.items():
+            by_target[canonical].append(name)
+        self.stdout.write(
+            f"{len(names)} referenced files, {len(renames)} to rename into {len(by_target)} canonical files"
+            + (f", {missing} missing" if missing else "")
+        )
+        if dry_run:
+            for canonical, sources in sorted(by_target.items()):
+                self.stdout.write(f"  {canonical} <- {', '.join(sorted(sources))}")
+            return
+
+        for canonical, sources in by_target.items():
+            if not storage.exists(canonical):
+                with storage.open(sources[0], "rb") as fh:
+                    storage.save(canonical, fh)
+
+        rows = 0
+        for name, canonical in renames.items():
+            for model, field_name in IMAGE_FIELDS:
+                rows += model.objects.filter(**{field_name: name}).update(**{field_name: canonical})
+            # Derivatives of identical sources are identical; keep one set per canonical file
+            if ImageDerivative.objects.filter(source=canonical).exists():
+                ImageDerivative.objects.filter(source=name).delete()
+            else:
+                ImageDerivative.objects.filter(source=name).update(source=canonical)
+
+        rebuild_references()
+        for name in renames:
+            storage.delete(name)
+
+        # Bulk updates skip the signals, so drop the cached pages by hand
+        for subject_id in Subject.objects.values_list("pk", flat=True):
+            manifest.invalidate(subject_id)
+        catalogue.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Rewrote {rows} references and removed {len(renames)} duplicate files"))
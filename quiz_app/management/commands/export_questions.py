@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app.models import Question
+from quiz_app.questionbank import CSV, FORMATS, JSONL, write_bank
+
+
+class Command(BaseCommand):
+    help = "Export questions as a JSONL/CSV bank, or as a zip with their images (--images)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=FORMATS, help="Default: from the file extension, else jsonl")
+        parser.add_argument("--subject", action="append", default=[], help="Subject id or name (repeatable)")
+        parser.add_argument("--images", action="store_true", help="Write a zip including the images")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or (CSV if path.endswith(".csv") else JSONL)
+
+        questions = Question.objects.all()
+        if options["subject"]:
+            ids = [value for value in options["subject"] if value.isdigit()]
+            names = [value for value in options["subject"] if not value.isdigit()]
+            questions = questions.filter(subject_id__in=ids) | questions.filter(subject__name__in=names)
+            if not questions.exists():
+                raise CommandError("No questions for the given subjects")
+
+        def progress(count):
+            self.stdout.write(f"  {count} questions written")
+
+        with open(path, "wb") as fh:
+            count = write_bank(fh, questions, fmt=fmt, with_images=options["images"], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} questions to {path}"))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app.benchmarking import delete_data, generate_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with synthetic subjects, questions and users with an answer history, "
+        "for benchmark_quiz. Don't run it against a production database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subjects", type=int, default=5)
+        parser.add_argument("--questions", type=int, default=50, help="Questions per subject")
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--answered", type=float, default=0.6, help="Share of questions each user answered")
+        parser.add_argument("--coverage", type=float, default=0.8, help="Share of subjects each user started")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--clear", action="store_true", help="Remove earlier benchmark data first")
+
+    def handle(self, *args, **options):
+        for name in ("subjects", "questions", "users"):
+            if options[name] < 1:
+                raise CommandError(f"--{name} must be positive")
+        for name in ("answered", "coverage"):
+            if not 0 <= options[name] <= 1:
+                raise CommandError(f"--{name} must be between 0 and 1")
+
+        if options["clear"]:
+            subjects, users = delete_data()
+            self.stdout.write(f"Removed {subjects} benchmark subjects and {users} benchmark users")
+
+        def progress(message):
+            self.stdout.write(f"  {message}")
+
+        counts = generate_data(
+            subjects=options["subjects"], questions=options["questions"], users=options["users"],
+            answered=options["answered"], coverage=options["coverage"], seed=options["seed"], progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            "Created {subjects} subjects, {questions} questions, {users} users, "
+            "{progress} progress rows and {submissions} submissions".format(**counts)
+        ))
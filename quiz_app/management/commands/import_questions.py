@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app.questionbank import BankError, QuestionBank, import_bank
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a question bank (.jsonl, .csv, or a .zip holding questions.jsonl/questions.csv and its images). "
+        "Invalid records are skipped and reported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--images", help="Zip of the images referenced by a plain .jsonl/.csv bank")
+        parser.add_argument("--batch-size", type=int, default=500, help="Records validated and written per transaction")
+        parser.add_argument("--workers", type=int, default=4, help="Validation threads")
+        parser.add_argument("--dry-run", action="store_true", help="Only validate")
+        parser.add_argument(
+            "--skip-duplicates", action="store_true", help="Skip records that look like questions already in the bank"
+        )
+
+    def handle(self, *args, **options):
+        def progress(report):
+            self.stdout.write(f"  {report}")
+
+        try:
+            with QuestionBank(options["path"], images=options["images"]) as bank:
+                report = import_bank(
+                    bank, batch_size=options["batch_size"], workers=options["workers"],
+                    dry_run=options["dry_run"], skip_duplicates=options["skip_duplicates"], progress=progress,
+                )
+        except (BankError, OSError) as exc:
+            raise CommandError(str(exc))
+
+        for line, messages in report.errors:
+            self.stderr.write(f"Line {line}: {' '.join(messages)}")
+        if report.error_count > len(report.errors):
+            self.stderr.write(f"... and {report.error_count - len(report.errors)} more")
+        for line, message in report.duplicates:
+            self.stdout.write(self.style.WARNING(f"Line {line}: {message}"))
+        summary = f"{'Validated' if options['dry_run'] else 'Imported'} {report.imported} questions"
+        duplicates = f", {report.duplicate_count} possible duplicates" if report.duplicate_count else ""
+        self.stdout.write(self.style.SUCCESS(f"{summary} ({report.error_count} skipped{duplicates})"))
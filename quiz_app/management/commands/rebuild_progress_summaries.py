@@ -0,0 +1,33 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app import summaries
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the per-user subject summaries behind the dashboard from UserProgress, "
+        "e.g. to backfill them or after progress rows were changed by hand."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", action="append", default=[], help="User id or username (repeatable)")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Users per aggregate query and upsert")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+
+        users = User.objects.all()
+        if options["user"]:
+            ids = [value for value in options["user"] if value.isdigit()]
+            names = [value for value in options["user"] if not value.isdigit()]
+            users = users.filter(pk__in=ids) | users.filter(username__in=names)
+            if not users.exists():
+                raise CommandError("No matching users")
+
+        def progress(count):
+            self.stdout.write(f"  {count} users rebuilt")
+
+        count = summaries.rebuild(users, chunk_size=options["chunk_size"], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt progress summaries for {count} users"))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app import search
+from quiz_app.models import Subject
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the full-text question search index from the question tables, "
+        "e.g. after content was changed outside the admin."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subject", action="append", default=[], help="Subject id or name (repeatable)")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Questions indexed per batch")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+        if search.get_backend() is None:
+            raise CommandError("Question search isn't available on this database; see QUIZ_SEARCH.")
+
+        subject_ids = None
+        if options["subject"]:
+            ids = [value for value in options["subject"] if value.isdigit()]
+            names = [value for value in options["subject"] if not value.isdigit()]
+            subjects = Subject.objects.filter(pk__in=ids) | Subject.objects.filter(name__in=names)
+            subject_ids = list(subjects.values_list("pk", flat=True))
+            if not subject_ids:
+                raise CommandError("No matching subjects")
+
+        def progress(count):
+            self.stdout.write(f"  {count} questions indexed")
+
+        count = search.rebuild(subject_ids, chunk_size=options["chunk_size"], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the search index with {count} questions"))
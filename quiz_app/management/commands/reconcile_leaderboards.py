@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app import leaderboards
+from quiz_app.models import Subject
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the leaderboards from UserProgress. Needed for the shared redis backend; "
+        "the local backend reloads itself every RECONCILE_INTERVAL seconds in each process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subject", action="append", default=[], help="Subject id (repeatable); default all boards")
+
+    def handle(self, *args, **options):
+        boards = None
+        if options["subject"]:
+            ids = [int(value) for value in options["subject"] if value.isdigit()]
+            found = set(Subject.objects.filter(pk__in=ids).values_list("pk", flat=True))
+            if not ids or len(found) != len(set(ids)):
+                raise CommandError("Unknown subject id")
+            boards = [leaderboards.subject_board(pk) for pk in sorted(found)]
+
+        def progress(board):
+            self.stdout.write(f"  {board} rebuilt")
+
+        entries = leaderboards.reconcile(boards, progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt leaderboards with {entries} ranked entries"))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app import analytics
+from quiz_app.models import Question
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the question and option stats rollups from UserProgress and Submission, "
+        "and optionally write them out as CSV. Run it periodically to correct drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subject", action="append", default=[], help="Subject id or name (repeatable)")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Questions per aggregate query and upsert")
+        parser.add_argument("--csv", metavar="PATH", help="Also write the reconciled stats to this CSV file")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+
+        questions = Question.objects.all()
+        if options["subject"]:
+            ids = [value for value in options["subject"] if value.isdigit()]
+            names = [value for value in options["subject"] if not value.isdigit()]
+            questions = questions.filter(subject_id__in=ids) | questions.filter(subject__name__in=names)
+            if not questions.exists():
+                raise CommandError("No questions for the given subjects")
+
+        def progress(count):
+            self.stdout.write(f"  {count} questions reconciled")
+
+        count = analytics.reconcile(questions, chunk_size=options["chunk_size"], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Reconciled stats for {count} questions"))
+
+        if options["csv"]:
+            with open(options["csv"], "w", newline="", encoding="utf-8") as fh:
+                for line in analytics.csv_lines(questions):
+                    fh.write(line)
+            self.stdout.write(self.style.SUCCESS(f"Wrote stats to {options['csv']}"))
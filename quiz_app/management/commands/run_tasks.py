@@ -0,0 +1,32 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app import tasks
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs (image derivatives, imports, stats rollups) on a thread pool. "
+        "Keep one or more running next to the web server; SIGTERM or Ctrl-C lets running jobs finish first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, help="Threads (default: QUIZ_TASKS['WORKERS'])")
+        parser.add_argument("--poll-interval", type=float, help="Seconds between checks for due jobs when idle")
+        parser.add_argument("--burst", action="store_true", help="Exit once no jobs are due")
+
+    def handle(self, *args, **options):
+        if options["workers"] is not None and options["workers"] < 1:
+            raise CommandError("--workers must be positive")
+
+        worker = tasks.Worker(workers=options["workers"], poll_interval=options["poll_interval"])
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: worker.stop())
+
+        def progress(job, status):
+            self.stdout.write(f"  #{job.pk} {job.name}: {status}")
+
+        self.stdout.write(f"Worker {worker.name} running {worker.workers} threads")
+        count = worker.run(burst=options["burst"], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Ran {count} jobs"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from quiz_app import exams
+
+
+class Command(BaseCommand):
+    help = (
+        "Submit timed exams whose deadline has passed. Exams are also submitted as soon as their "
+        "taker comes back; run this from cron to close the rest."
+    )
+
+    def handle(self, *args, **options):
+        def progress(count):
+            self.stdout.write(f"  {count} exams submitted")
+
+        count = exams.submit_expired(progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Submitted {count} expired exams"))
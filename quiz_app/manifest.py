@@ -0,0 +1,163 @@
+# manifest.py
+"""Per-subject quiz manifest.
+
+A manifest is everything needed to render any question of a subject:
+the subject card and, per question, its options (with correctness), hint
+and explanation; question ordering lives in ``navigation.py``. It is built
+with a fixed number of queries the first time it is needed and then served
+from an in-process copy, falling back to the shared cache, until a content
+change bumps the subject's version (see ``signals.py``).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+
+from . import caching
+from .images import aderivatives_for, derivatives_for, image_info
+from .instrumentation import setup
+from .storage import quiz_media_storage
+from .models import Subject, Question, Option, Explanation
+
+NAMESPACE = "manifest"
+
+# subject_id -> (version, manifest)
+_local = {}
+
+
+def _timeout():
+    return getattr(settings, "QUIZ_MANIFEST_TIMEOUT", 60 * 60 * 24)
+
+
+def _querysets(subject_id):
+    return (
+        Question.objects.filter(subject_id=subject_id).values(
+            "id", "question_type", "text_content", "image_content", "hint"
+        ),
+        Option.objects.filter(question__subject_id=subject_id).order_by("id").values(
+            "id", "question_id", "text_content", "image_content", "is_correct"
+        ),
+        Explanation.objects.filter(question__subject_id=subject_id).values(
+            "question_id", "text_content", "image_content"
+        ),
+    )
+
+
+def _image_names(subject, question_rows, option_rows, explanation_rows):
+    names = [subject.logo_image.name]
+    for rows in (question_rows, option_rows, explanation_rows):
+        names.extend(row["image_content"] for row in rows)
+    return names
+
+
+def _assemble(subject, question_rows, option_rows, explanation_rows, derivatives):
+    question_image = Question._meta.get_field("image_content")
+    option_image = Option._meta.get_field("image_content")
+    explanation_image = Explanation._meta.get_field("image_content")
+
+    questions = {}
+    for row in question_rows:
+        questions[row["id"]] = {
+            "id": row["id"],
+            "question_type": row["question_type"],
+            "text_content": row["text_content"],
+            "image": image_info(question_image, row["image_content"], derivatives),
+            "hint": row["hint"],
+            "options": [],
+            "explanation": None,
+        }
+
+    for row in option_rows:
+        questions[row["question_id"]]["options"].append({
+            "id": row["id"],
+            "text_content": row["text_content"],
+            "image": image_info(option_image, row["image_content"], derivatives),
+            "is_correct": row["is_correct"],
+        })
+
+    for row in explanation_rows:
+        questions[row["question_id"]]["explanation"] = {
+            "text_content": row["text_content"],
+            "image": image_info(explanation_image, row["image_content"], derivatives),
+        }
+
+    return {
+        "subject": {
+            "id": subject.id,
+            "name": subject.name,
+            "description": subject.description,
+            "logo": image_info(Subject._meta.get_field("logo_image"), subject.logo_image.name, derivatives),
+        },
+        "questions": questions,
+    }
+
+
+def build_manifest(subject_id):
+    """Load a subject's quiz content from the database (five queries)."""
+    subject = Subject.objects.get(pk=subject_id)
+    rows = [list(queryset) for queryset in _querysets(subject_id)]
+    derivatives = derivatives_for(_image_names(subject, *rows), quiz_media_storage())
+    return _assemble(subject, *rows, derivatives)
+
+
+async def abuild_manifest(subject_id):
+    subject = await Subject.objects.aget(pk=subject_id)
+    rows = [[row async for row in queryset] for queryset in _querysets(subject_id)]
+    derivatives = await aderivatives_for(_image_names(subject, *rows), quiz_media_storage())
+    return _assemble(subject, *rows, derivatives)
+
+
+def _key(subject_id, version):
+    return f"quiz:{NAMESPACE}:{subject_id}:{version}"
+
+
+def get_manifest(subject_id):
+    """Return the manifest for ``subject_id``.
+
+    Raises ``Subject.DoesNotExist`` if there is no such subject.
+    """
+    version = caching.get_version(NAMESPACE, subject_id)
+    local = _local.get(subject_id)
+    if local is not None and local[0] == version:
+        return local[1]
+
+    manifest = cache.get(_key(subject_id, version))
+    if manifest is None:
+        # The version also keys the rendered fragments of this content
+        with setup():
+            manifest = {**build_manifest(subject_id), "version": version}
+        cache.set(_key(subject_id, version), manifest, timeout=_timeout())
+    _local[subject_id] = (version, manifest)
+    return manifest
+
+
+async def aget_manifest(subject_id):
+    version = caching.get_version(NAMESPACE, subject_id)
+    local = _local.get(subject_id)
+    if local is not None and local[0] == version:
+        return local[1]
+
+    manifest = cache.get(_key(subject_id, version))
+    if manifest is None:
+        with setup():
+            manifest = {**await abuild_manifest(subject_id), "version": version}
+        cache.set(_key(subject_id, version), manifest, timeout=_timeout())
+    _local[subject_id] = (version, manifest)
+    return manifest
+
+
+def get_manifest_or_404(subject_id):
+    try:
+        return get_manifest(subject_id)
+    except Subject.DoesNotExist:
+        raise Http404("No Subject matches the given query.")
+
+
+async def aget_manifest_or_404(subject_id):
+    try:
+        return await aget_manifest(subject_id)
+    except Subject.DoesNotExist:
+        raise Http404("No Subject matches the given query.")
+
+
+def invalidate(subject_id):
+    caching.bump_on_commit(NAMESPACE, subject_id)
@@ -0,0 +1,111 @@
+# mediafiles.py
+"""Reference counting for the content-addressed quiz media.
+
+With ``ContentHashStorage`` one file may back any number of ImageFields, so
+a file is only removed once its ``StoredFile`` count drops to zero. Counts
+are kept up to date by the signals in ``signals.py``; bulk operations that
+bypass signals should call :func:`rebuild_references` afterwards.
+
+Saving bytes the storage already has returns the existing name before the
+new reference is counted, so a :func:`collect` can delete the file in
+between. :func:`collect` decides and deletes under the ``StoredFile`` row
+lock, and :func:`acquire` writes the file again if it went missing.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import Subject, Question, Option, Explanation, ImageDerivative, StoredFile
+
+IMAGE_FIELDS = (
+    (Subject, "logo_image"),
+    (Question, "image_content"),
+    (Option, "image_content"),
+    (Explanation, "image_content"),
+)
+
+
+def image_field_name(model):
+    for image_model, field_name in IMAGE_FIELDS:
+        if image_model is model:
+            return field_name
+    return None
+
+
+def acquire(name, content=None, storage=None):
+    """Count one more reference to ``name``, which was just saved from ``content``."""
+    if not name:
+        return
+    with transaction.atomic():
+        # Updating nothing means there is no row yet, or a collect just deleted it
+        while not StoredFile.objects.filter(name=name).update(references=F("references") + 1):
+            StoredFile.objects.get_or_create(name=name)
+        if content is not None and not content.closed and not storage.exists(name):
+            # Collected after the storage found it; the same bytes get the same name back
+            content.seek(0)
+            storage.save(name, content)
+
+
+def acquire_many(counts):
+    """Bulk :func:`acquire` for ``{name: references}``, e.g. after a ``bulk_create``."""
+    counts = {name: references for name, references in counts.items() if name}
+    StoredFile.objects.bulk_create([StoredFile(name=name) for name in counts], ignore_conflicts=True)
+    by_count = defaultdict(list)
+    for name, references in counts.items():
+        by_count[references].append(name)
+    for references, names in by_count.items():
+        StoredFile.objects.filter(name__in=names).update(references=F("references") + references)
+
+
+def release(name, storage):
+    if not name:
+        return
+    StoredFile.objects.filter(name=name, references__gt=0).update(references=F("references") - 1)
+    transaction.on_commit(lambda: collect(name, storage))
+
+
+def collect(name, storage):
+    """Delete ``name`` and its derivatives if nothing references it any more.
+
+    Files without a ``StoredFile`` row predate reference counting and are
+    never deleted here; run ``dedupe_media`` to adopt them.
+    """
+    with transaction.atomic():
+        # Files go before the lock is released, so an acquire waiting on it finds them gone
+        stored = StoredFile.objects.select_for_update().filter(name=name).first()
+        if stored is None or stored.references:
+            return False
+        stored.delete()
+        storage.delete(name)
+
+        derivatives = list(ImageDerivative.objects.filter(source=name).values_list("pk", "name"))
+        ImageDerivative.objects.filter(pk__in=[pk for pk, _ in derivatives]).delete()
+        for _, derivative_name in derivatives:
+            # Identical sources share derivative files too
+            if not ImageDerivative.objects.filter(name=derivative_name).exists():
+                storage.delete(derivative_name)
+    return True
+
+
+def referenced_names():
+    """Count how many rows reference each stored image name."""
+    counts = Counter()
+    for model, field_name in IMAGE_FIELDS:
+        names = (
+            model.objects.exclude(**{field_name: ""}).exclude(**{f"{field_name}__isnull": True})
+            .values_list(field_name, flat=True).iterator(chunk_size=2000)
+        )
+        counts.update(names)
+    return counts
+
+
+@transaction.atomic
+def rebuild_references():
+    counts = referenced_names()
+    StoredFile.objects.all().delete()
+    StoredFile.objects.bulk_create(
+        [StoredFile(name=name, references=references) for name, references in counts.items()],
+        batch_size=500,
+    )
+    return counts
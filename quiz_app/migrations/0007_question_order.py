@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:26
+
+from django.db import migrations, models
+
+
+def number_questions(apps, schema_editor):
+    # Existing questions keep their id order within each subject
+    Question = apps.get_model('quiz_app', 'Question')
+    positions = {}
+    questions = list(Question.objects.order_by('subject_id', 'id').only('id', 'subject_id'))
+    for question in questions:
+        positions[question.subject_id] = positions.get(question.subject_id, 0) + 1
+        question.order = positions[question.subject_id]
+    Question.objects.bulk_update(questions, ['order'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0006_answer_submission'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='question',
+            options={'ordering': ['order', 'id']},
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='order',
+            field=models.PositiveIntegerField(default=0, help_text='Position of the question within its subject.'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['subject', 'order', 'id'], name='quiz_questi_subject_f3c754_idx'),
+        ),
+        migrations.RunPython(number_questions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:28
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0007_question_order'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='submission',
+            name='submitted_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
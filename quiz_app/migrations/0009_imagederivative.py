@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0008_submission_submitted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageDerivative',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(db_index=True, help_text='Storage name of the original upload.', max_length=255)),
+                ('width', models.PositiveIntegerField()),
+                ('format', models.CharField(max_length=10)),
+                ('name', models.CharField(help_text='Storage name of the derivative.', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'quiz_imagederivative',
+                'constraints': [models.UniqueConstraint(fields=('source', 'format', 'width'), name='unique_image_derivative')],
+            },
+        ),
+    ]
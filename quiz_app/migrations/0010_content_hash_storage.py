@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:35
+
+import quiz_app.models
+import quiz_app.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0009_imagederivative'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('references', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'quiz_storedfile',
+            },
+        ),
+        migrations.AlterField(
+            model_name='explanation',
+            name='image_content',
+            field=models.ImageField(blank=True, null=True, storage=quiz_app.storage.quiz_media_storage, upload_to='explanations/'),
+        ),
+        migrations.AlterField(
+            model_name='option',
+            name='image_content',
+            field=models.ImageField(blank=True, null=True, storage=quiz_app.storage.quiz_media_storage, upload_to='options/'),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='image_content',
+            field=models.ImageField(blank=True, null=True, storage=quiz_app.storage.quiz_media_storage, upload_to='questions/'),
+        ),
+        migrations.AlterField(
+            model_name='subject',
+            name='logo_image',
+            field=models.ImageField(blank=True, help_text='Upload an image of size 350 × 180 px.', null=True, storage=quiz_app.storage.quiz_media_storage, upload_to='logos/', validators=[quiz_app.models.validate_image]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0010_content_hash_storage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userprogress',
+            index=models.Index(fields=['updated_at'], name='quiz_userpr_updated_eb04e3_idx'),
+        ),
+    ]
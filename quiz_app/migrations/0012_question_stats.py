@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0011_userprogress_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionStats',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='quiz_app.question')),
+                ('submissions', models.PositiveIntegerField(default=0)),
+                ('learners', models.PositiveIntegerField(default=0, help_text='Learners who answered at least once.')),
+                ('correct', models.PositiveIntegerField(default=0, help_text='Learners who got it right eventually.')),
+                ('first_try_correct', models.PositiveIntegerField(default=0)),
+                ('hints_used', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'question stats',
+                'db_table': 'quiz_questionstats',
+            },
+        ),
+        migrations.CreateModel(
+            name='OptionStats',
+            fields=[
+                ('option', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='quiz_app.option')),
+                ('selections', models.PositiveIntegerField(default=0)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='option_stats', to='quiz_app.question')),
+            ],
+            options={
+                'verbose_name_plural': 'option stats',
+                'db_table': 'quiz_optionstats',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0012_question_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSubjectSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answered', models.PositiveIntegerField(default=0, help_text='Questions answered at least once.')),
+                ('correct', models.PositiveIntegerField(default=0)),
+                ('finished', models.PositiveIntegerField(default=0, help_text='Questions answered correctly or out of attempts.')),
+                ('hints_used', models.PositiveIntegerField(default=0)),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_summaries', to='quiz_app.subject')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subject_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'user subject summaries',
+                'db_table': 'quiz_usersubjectsummary',
+                'constraints': [models.UniqueConstraint(fields=('user', 'subject'), name='unique_user_subject_summary')],
+            },
+        ),
+    ]
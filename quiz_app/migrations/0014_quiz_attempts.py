@@ -0,0 +1,93 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def create_first_attempts(apps, schema_editor):
+    # Existing progress becomes attempt 1 of each (user, subject)
+    QuizAttempt = apps.get_model('quiz_app', 'QuizAttempt')
+    UserProgress = apps.get_model('quiz_app', 'UserProgress')
+    pairs = UserProgress.objects.values('user_id', 'subject_id').annotate(started_at=Min('created_at')).order_by()
+    for pair in pairs.iterator():
+        attempt = QuizAttempt.objects.create(
+            user_id=pair['user_id'], subject_id=pair['subject_id'], number=1, started_at=pair['started_at'],
+        )
+        UserProgress.objects.filter(user_id=pair['user_id'], subject_id=pair['subject_id']).update(attempt=attempt)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0013_user_subject_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuizAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(default=1)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('archived_at', models.DateTimeField(blank=True, null=True)),
+                ('question_count', models.PositiveIntegerField(default=0)),
+                ('answered', models.PositiveIntegerField(default=0)),
+                ('correct', models.PositiveIntegerField(default=0)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='Answers given, all questions together.')),
+                ('hints_used', models.PositiveIntegerField(default=0)),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quiz_app.subject')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='quiz_attempts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'quiz_quizattempt',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.IntegerField(default=0)),
+                ('answered_correctly', models.BooleanField(default=False)),
+                ('hint_used', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quiz_app.question')),
+                ('selected_option', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='quiz_app.option')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quiz_app.subject')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('attempt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_progress', to='quiz_app.quizattempt')),
+            ],
+            options={
+                'verbose_name_plural': 'archived progress',
+                'db_table': 'quiz_archivedprogress',
+            },
+        ),
+        migrations.AddField(
+            model_name='userprogress',
+            name='attempt',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='quiz_app.quizattempt'),
+        ),
+        migrations.RunPython(create_first_attempts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='userprogress',
+            name='attempt',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='quiz_app.quizattempt'),
+        ),
+        migrations.AlterField(
+            model_name='questionstats',
+            name='learners',
+            field=models.PositiveIntegerField(default=0, help_text='Learner attempts that answered at least once.'),
+        ),
+        migrations.AddConstraint(
+            model_name='quizattempt',
+            constraint=models.UniqueConstraint(fields=('user', 'subject', 'number'), name='unique_attempt_number'),
+        ),
+        migrations.AddConstraint(
+            model_name='quizattempt',
+            constraint=models.UniqueConstraint(condition=models.Q(('archived_at__isnull', True)), fields=('user', 'subject'), name='one_active_attempt'),
+        ),
+    ]
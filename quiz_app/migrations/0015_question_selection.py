@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:57
+
+import quiz_app.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0014_quiz_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizattempt',
+            name='question_order',
+            field=models.JSONField(blank=True, default=list, help_text="Question ids in the order they are asked; empty for the subject's order."),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='seed',
+            field=models.PositiveIntegerField(default=quiz_app.models.new_seed),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='selection_mode',
+            field=models.CharField(choices=[('ordered', 'In order'), ('shuffled', 'Shuffled'), ('stratified', 'Stratified by difficulty'), ('adaptive', 'Adaptive')], default='ordered', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='selection_state',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='shuffle_options',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='question_limit',
+            field=models.PositiveIntegerField(blank=True, help_text='Questions per attempt; empty for all.', null=True),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='selection_mode',
+            field=models.CharField(choices=[('ordered', 'In order'), ('shuffled', 'Shuffled'), ('stratified', 'Stratified by difficulty'), ('adaptive', 'Adaptive')], default='ordered', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='shuffle_options',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Search index tables for quiz_app/search.py
+
+from django.db import migrations
+
+SQLITE_CREATE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS quiz_question_search USING fts5(
+    question, hint, options, explanation, subject_id UNINDEXED, tokenize = 'porter unicode61'
+)
+"""
+SQLITE_FILL = """
+INSERT INTO quiz_question_search (rowid, subject_id, question, hint, options, explanation)
+SELECT q.id, q.subject_id, COALESCE(q.text_content, ''), COALESCE(q.hint, ''),
+       COALESCE((SELECT group_concat(o.text_content, ' ') FROM quiz_option o WHERE o.question_id = q.id), ''),
+       COALESCE((SELECT e.text_content FROM quiz_explanation e WHERE e.question_id = q.id), '')
+FROM quiz_question q
+"""
+
+POSTGRESQL_CREATE = """
+CREATE TABLE IF NOT EXISTS quiz_question_search (
+    question_id bigint PRIMARY KEY REFERENCES quiz_question (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+    subject_id bigint NOT NULL,
+    content text NOT NULL,
+    document tsvector NOT NULL
+);
+CREATE INDEX IF NOT EXISTS quiz_question_search_document ON quiz_question_search USING GIN (document);
+CREATE INDEX IF NOT EXISTS quiz_question_search_subject ON quiz_question_search (subject_id);
+"""
+POSTGRESQL_FILL = """
+INSERT INTO quiz_question_search (question_id, subject_id, content, document)
+SELECT q.id, q.subject_id, COALESCE(q.text_content, '') || ' ' || COALESCE(o.options, ''),
+       setweight(to_tsvector('english', COALESCE(q.text_content, '')), 'A')
+       || setweight(to_tsvector('english', COALESCE(o.options, '')), 'B')
+       || setweight(to_tsvector('english', COALESCE(e.text_content, '')), 'C')
+       || setweight(to_tsvector('english', COALESCE(q.hint, '')), 'D')
+FROM quiz_question q
+LEFT JOIN (
+    SELECT question_id, string_agg(text_content, ' ' ORDER BY id) AS options FROM quiz_option GROUP BY question_id
+) o ON o.question_id = q.id
+LEFT JOIN quiz_explanation e ON e.question_id = q.id
+"""
+
+
+def create_search_index(apps, schema_editor):
+    # Other databases have no search backend, see search.get_backend
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(SQLITE_CREATE)
+        schema_editor.execute(SQLITE_FILL)
+    elif vendor == 'postgresql':
+        schema_editor.execute(POSTGRESQL_CREATE)
+        schema_editor.execute(POSTGRESQL_FILL)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP TABLE IF EXISTS quiz_question_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0015_question_selection'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0016_question_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizattempt',
+            name='deadline',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='submitted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='time_limit',
+            field=models.PositiveIntegerField(blank=True, help_text='Minutes allowed per attempt; empty for no time limit.', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='quizattempt',
+            index=models.Index(condition=models.Q(('deadline__isnull', False), ('submitted_at__isnull', True)), fields=['deadline'], name='open_exam_deadline'),
+        ),
+    ]
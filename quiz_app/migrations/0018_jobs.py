@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0017_timed_exams'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Registered task name.', max_length=100)),
+                ('payload', models.JSONField(blank=True, default=dict, help_text='Keyword arguments of the task.')),
+                ('priority', models.SmallIntegerField(default=0, help_text='Higher runs first.')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('idempotency_key', models.CharField(blank=True, help_text='Enqueueing the same key again returns this job instead of adding another.', max_length=255, null=True, unique=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=5)),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Not run before this time (retries back off).')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+            options={
+                'db_table': 'quiz_job',
+                'indexes': [models.Index(condition=models.Q(('status', 'queued')), fields=['-priority', 'run_at', 'id'], name='queued_jobs')],
+            },
+        ),
+    ]
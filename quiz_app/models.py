@@ -1,21 +1,65 @@
 #models.py
+import random
+
 from django.db import models
+from django.utils import timezone
 from django.core.exceptions import ValidationError
-from PIL import Image
+from django.core.files.images import get_image_dimensions
 from django.contrib.auth.models import User
 
+from .storage import quiz_media_storage
+
 
 
 def validate_image(image):
-    img = Image.open(image)
-    if img.width != 350 or img.height != 180:
+    # Only parses the image header; the pixel data is never decoded
+    width, height = get_image_dimensions(image)
+    if width is None:
+        raise ValidationError("Upload a valid image.")
+    if width != 350 or height != 180:
         raise ValidationError("Image must be exactly 350 × 180 pixels.")
     
-    
-class Subject(models.Model):
+
+class RemembersLoadedValues:
+    """Keeps the ``remembered_fields`` values an instance was loaded with, so
+    the save signals can tell what changed without reading the row again."""
+
+    remembered_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Deferred fields are not in __dict__, and image fields hold the stored name until first accessed
+        instance._loaded = {name: instance.__dict__[name] for name in cls.remembered_fields if name in instance.__dict__}
+        return instance
+
+
+class Subject(RemembersLoadedValues, models.Model):
+    ORDERED = 'ordered'
+    SHUFFLED = 'shuffled'
+    STRATIFIED = 'stratified'
+    ADAPTIVE = 'adaptive'
+    SELECTION_MODES = [
+        (ORDERED, 'In order'),
+        (SHUFFLED, 'Shuffled'),
+        (STRATIFIED, 'Stratified by difficulty'),
+        (ADAPTIVE, 'Adaptive'),
+    ]
+
     name = models.CharField(max_length=100)
     description = models.TextField(max_length=200,help_text="Description must be under 200 characters.")
-    logo_image  = models.ImageField(upload_to='logos/', blank=True, null=True,help_text="Upload an image of size 350 × 180 px.",validators=[validate_image])
+    logo_image  = models.ImageField(upload_to='logos/', storage=quiz_media_storage, blank=True, null=True,help_text="Upload an image of size 350 × 180 px.",validators=[validate_image])
+
+    # How each attempt picks its questions, see selection.py
+    selection_mode = models.CharField(max_length=10, choices=SELECTION_MODES, default=ORDERED)
+    question_limit = models.PositiveIntegerField(null=True, blank=True, help_text="Questions per attempt; empty for all.")
+    shuffle_options = models.BooleanField(default=False)
+    # Timed exam, see exams.py
+    time_limit = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Minutes allowed per attempt; empty for no time limit."
+    )
+
+    remembered_fields = ('logo_image',)
 
     class Meta:
         db_table = 'quiz_subject'
@@ -23,7 +67,7 @@ class Subject(models.Model):
     def __str__(self):
         return self.name
 
-class Question(models.Model):
+class Question(RemembersLoadedValues, models.Model):
     TEXT = 'text'
     IMAGE = 'image'
     QUESTION_TYPES = [
@@ -34,46 +78,129 @@ class Question(models.Model):
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
     question_type = models.CharField(max_length=10, choices=QUESTION_TYPES, default=TEXT)
     text_content = models.TextField(blank=True, null=True)
-    image_content = models.ImageField(upload_to='questions/', blank=True, null=True)
+    image_content = models.ImageField(upload_to='questions/', storage=quiz_media_storage, blank=True, null=True)
     hint = models.TextField(blank=True, null=True)
+    order = models.PositiveIntegerField(default=0, help_text="Position of the question within its subject.")
+
+    remembered_fields = ('image_content', 'subject_id', 'order')
     
     class Meta:
         db_table = 'quiz_question'
+        ordering = ['order', 'id']
+        indexes = [
+            models.Index(fields=['subject', 'order', 'id']),
+        ]
     
     def __str__(self):
         return f"Question {self.id} for {self.subject.name}"
 
-class Option(models.Model):
+    def save(self, *args, **kwargs):
+        # New questions go to the end of their subject unless placed explicitly
+        if self._state.adding and not self.order:
+            last = Question.objects.filter(subject_id=self.subject_id).aggregate(models.Max('order'))['order__max']
+            self.order = (last or 0) + 1
+        super().save(*args, **kwargs)
+
+class Option(RemembersLoadedValues, models.Model):
     question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='options')
     text_content = models.TextField(blank=True, null=True)
-    image_content = models.ImageField(upload_to='options/', blank=True, null=True)
+    image_content = models.ImageField(upload_to='options/', storage=quiz_media_storage, blank=True, null=True)
     is_correct = models.BooleanField(default=False)
+
+    remembered_fields = ('image_content',)
     
     class Meta:
         db_table = 'quiz_option'
     
     def __str__(self):
-        return f"Option {self.id} for Question {self.question.id}"
+        return f"Option {self.id} for Question {self.question_id}"
 
-class Explanation(models.Model):
+class Explanation(RemembersLoadedValues, models.Model):
     question = models.OneToOneField(Question, on_delete=models.CASCADE)
     text_content = models.TextField(blank=True, null=True)
-    image_content = models.ImageField(upload_to='explanations/', blank=True, null=True)
+    image_content = models.ImageField(upload_to='explanations/', storage=quiz_media_storage, blank=True, null=True)
+
+    remembered_fields = ('image_content',)
     
     class Meta:
         db_table = 'quiz_explanation'
     
     def __str__(self):
-        return f"Explanation for Question {self.question.id}"
+        return f"Explanation for Question {self.question_id}"
+
+
 
 
 
+def new_seed():
+    return random.getrandbits(31)
+
+
+class QuizAttempt(models.Model):
+    """One run through a subject, see ``attempts.py``.
+
+    The active attempt's answers live in ``UserProgress``. When the learner
+    starts over, they move to ``ArchivedProgress`` and their totals are
+    kept on the attempt row.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='quiz_attempts')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    number = models.PositiveIntegerField(default=1)
+    started_at = models.DateTimeField(default=timezone.now)
+    archived_at = models.DateTimeField(null=True, blank=True)
+
+    # Question selection, fixed when the attempt starts (see selection.py)
+    selection_mode = models.CharField(max_length=10, choices=Subject.SELECTION_MODES, default=Subject.ORDERED)
+    seed = models.PositiveIntegerField(default=new_seed)
+    shuffle_options = models.BooleanField(default=False)
+    question_order = models.JSONField(
+        default=list, blank=True, help_text="Question ids in the order they are asked; empty for the subject's order."
+    )
+    selection_state = models.JSONField(default=dict, blank=True)
+
+    # Timed exams (see exams.py): answers are refused after the deadline,
+    # and the attempt is submitted once it passes
+    deadline = models.DateTimeField(null=True, blank=True)
+    submitted_at = models.DateTimeField(null=True, blank=True)
+
+    # Filled in when the attempt is submitted or archived
+    question_count = models.PositiveIntegerField(default=0)
+    answered = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0, help_text="Answers given, all questions together.")
+    hints_used = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'quiz_quizattempt'
+        constraints = [
+            # Also the index for "latest attempt" lookups (ORDER BY number DESC)
+            models.UniqueConstraint(fields=['user', 'subject', 'number'], name='unique_attempt_number'),
+            models.UniqueConstraint(
+                fields=['user', 'subject'], condition=models.Q(archived_at__isnull=True),
+                name='one_active_attempt',
+            ),
+        ]
+        indexes = [
+            # Exams still to submit, for submit_expired_exams
+            models.Index(
+                fields=['deadline'], condition=models.Q(submitted_at__isnull=True, deadline__isnull=False),
+                name='open_exam_deadline',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Attempt {self.number} of user {self.user_id} on Subject {self.subject_id}"
+
+    @property
+    def score_percentage(self):
+        return int(self.correct * 100 / self.question_count) if self.question_count else 0
 
 
 class UserProgress(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    attempt = models.ForeignKey(QuizAttempt, on_delete=models.CASCADE, related_name='progress')
 
     # ✅ New field to track user’s last chosen option
     selected_option = models.ForeignKey(
@@ -96,17 +223,41 @@ class UserProgress(models.Model):
         ]
         indexes = [
             models.Index(fields=['user', 'subject']),
+            # Admin date hierarchy (min/max and per-day ranges)
+            models.Index(fields=['updated_at']),
         ]
 
     def __str__(self):
         username = self.user.username if self.user else "Anonymous"
-        return f"Progress for {username} on Question {self.question.id}"
+        return f"Progress for {username} on Question {self.question_id}"
+
+class ArchivedProgress(models.Model):
+    """``UserProgress`` rows of archived attempts, moved out of the hot table."""
+    attempt = models.ForeignKey(QuizAttempt, on_delete=models.CASCADE, related_name='archived_progress')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    selected_option = models.ForeignKey(Option, on_delete=models.SET_NULL, null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    answered_correctly = models.BooleanField(default=False)
+    hint_used = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'quiz_archivedprogress'
+        verbose_name_plural = 'archived progress'
+
+    def __str__(self):
+        return f"Archived progress of attempt {self.attempt_id} on Question {self.question_id}"
+
 
 class Submission(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     selected_option = models.ForeignKey(Option, on_delete=models.SET_NULL, null=True, blank=True)
-    submitted_at = models.DateTimeField(auto_now_add=True)
+    # Set explicitly by the buffered writer so the timestamp is the answer time, not the flush time
+    submitted_at = models.DateTimeField(default=timezone.now, db_index=True)
 
     def __str__(self):
         return f"Submission by {self.user} on {self.question}"
@@ -119,3 +270,150 @@ class Answer(models.Model):
 
     def __str__(self):
         return f"Answer for Question {self.question.id}"
+
+
+class ImageDerivative(models.Model):
+    """A resized/re-encoded copy of an uploaded image, see ``images.py``."""
+    source = models.CharField(max_length=255, db_index=True, help_text="Storage name of the original upload.")
+    width = models.PositiveIntegerField()
+    format = models.CharField(max_length=10)
+    name = models.CharField(max_length=255, help_text="Storage name of the derivative.")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'quiz_imagederivative'
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'format', 'width'], name='unique_image_derivative'),
+        ]
+
+    def __str__(self):
+        return f"{self.source} @ {self.width}w ({self.format})"
+
+
+class StoredFile(models.Model):
+    """Reference count for a file in the content-addressed media storage."""
+    name = models.CharField(max_length=255, unique=True)
+    references = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'quiz_storedfile'
+
+    def __str__(self):
+        return f"{self.name} ({self.references} references)"
+
+
+class QuestionStats(models.Model):
+    """Rolled-up answer statistics for a question, see ``analytics.py``.
+
+    Counts are per learner attempt (one ``UserProgress`` or
+    ``ArchivedProgress`` row) except ``submissions``, which counts every answer.
+    """
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    submissions = models.PositiveIntegerField(default=0)
+    learners = models.PositiveIntegerField(default=0, help_text="Learner attempts that answered at least once.")
+    correct = models.PositiveIntegerField(default=0, help_text="Learners who got it right eventually.")
+    first_try_correct = models.PositiveIntegerField(default=0)
+    hints_used = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'quiz_questionstats'
+        verbose_name_plural = 'question stats'
+
+    def __str__(self):
+        return f"Stats for Question {self.question_id}"
+
+    def _rate(self, count):
+        return round(count * 100 / self.learners, 1) if self.learners else None
+
+    @property
+    def first_try_rate(self):
+        return self._rate(self.first_try_correct)
+
+    @property
+    def success_rate(self):
+        return self._rate(self.correct)
+
+    @property
+    def hint_rate(self):
+        return self._rate(self.hints_used)
+
+
+class OptionStats(models.Model):
+    """How often an option was picked (every answer counts)."""
+    option = models.OneToOneField(Option, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='option_stats')
+    selections = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'quiz_optionstats'
+        verbose_name_plural = 'option stats'
+
+    def __str__(self):
+        return f"Stats for Option {self.option_id}"
+
+
+class UserSubjectSummary(models.Model):
+    """A learner's progress in one subject, kept in step with ``UserProgress``
+    by ``summaries.py`` so dashboards read one row per subject."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subject_summaries')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='user_summaries')
+    answered = models.PositiveIntegerField(default=0, help_text="Questions answered at least once.")
+    correct = models.PositiveIntegerField(default=0)
+    finished = models.PositiveIntegerField(default=0, help_text="Questions answered correctly or out of attempts.")
+    hints_used = models.PositiveIntegerField(default=0)
+    last_activity = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'quiz_usersubjectsummary'
+        verbose_name_plural = 'user subject summaries'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'subject'], name='unique_user_subject_summary'),
+        ]
+
+    def __str__(self):
+        return f"Summary for user {self.user_id} on Subject {self.subject_id}"
+
+
+class Job(models.Model):
+    """A unit of background work, run by the ``run_tasks`` worker (see ``tasks.py``)."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100, help_text="Registered task name.")
+    payload = models.JSONField(default=dict, blank=True, help_text="Keyword arguments of the task.")
+    priority = models.SmallIntegerField(default=0, help_text="Higher runs first.")
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    idempotency_key = models.CharField(
+        max_length=255, unique=True, null=True, blank=True,
+        help_text="Enqueueing the same key again returns this job instead of adding another.",
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now, help_text="Not run before this time (retries back off).")
+    created_at = models.DateTimeField(auto_now_add=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        db_table = 'quiz_job'
+        indexes = [
+            # The worker's claim query: due jobs, highest priority first
+            models.Index(
+                fields=['-priority', 'run_at', 'id'], condition=models.Q(status='queued'), name='queued_jobs',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Job {self.pk} ({self.name}, {self.status})"
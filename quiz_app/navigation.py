@@ -0,0 +1,110 @@
+# navigation.py
+"""Per-subject question ordering index.
+
+Maps every question id of a subject to its 1-based position and to the
+previous/next question ids, following ``Question.order``. Lookups are
+dictionary/list accesses, so moving through a subject of thousands of
+questions never costs a query. The index is cached like the manifest
+(in-process copy plus shared cache, versioned). Adding, moving or
+deleting a question bumps the version and the next reader rebuilds the
+index with one query; edits that leave the order alone keep it.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from . import caching
+from .instrumentation import setup
+from .models import Question
+
+NAMESPACE = "navigation"
+
+# subject_id -> (version, index)
+_local = {}
+
+
+class QuestionIndex:
+    def __init__(self, entries):
+        # entries: iterable of (order, question_id)
+        self.keys = sorted(entries)
+        self.ids = [qid for _, qid in self.keys]
+        self.positions = {qid: index for index, qid in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, question_id):
+        return question_id in self.positions
+
+    @property
+    def first_id(self):
+        return self.ids[0] if self.ids else None
+
+    def position(self, question_id):
+        return self.positions[question_id] + 1
+
+    def previous_id(self, question_id):
+        index = self.positions[question_id]
+        return self.ids[index - 1] if index > 0 else None
+
+    def next_id(self, question_id):
+        index = self.positions[question_id] + 1
+        return self.ids[index] if index < len(self.ids) else None
+
+
+def _timeout():
+    return getattr(settings, "QUIZ_MANIFEST_TIMEOUT", 60 * 60 * 24)
+
+
+def _key(subject_id, version):
+    return f"quiz:{NAMESPACE}:{subject_id}:{version}"
+
+
+def build_index(subject_id):
+    return QuestionIndex(
+        Question.objects.filter(subject_id=subject_id).values_list("order", "id")
+    )
+
+
+async def abuild_index(subject_id):
+    return QuestionIndex([
+        entry async for entry in Question.objects.filter(subject_id=subject_id).values_list("order", "id")
+    ])
+
+
+def get_index(subject_id):
+    version = caching.get_version(NAMESPACE, subject_id)
+    local = _local.get(subject_id)
+    if local is not None and local[0] == version:
+        return local[1]
+
+    index = cache.get(_key(subject_id, version))
+    if index is None:
+        with setup():
+            index = build_index(subject_id)
+        cache.set(_key(subject_id, version), index, timeout=_timeout())
+    _local[subject_id] = (version, index)
+    return index
+
+
+async def aget_index(subject_id):
+    version = caching.get_version(NAMESPACE, subject_id)
+    local = _local.get(subject_id)
+    if local is not None and local[0] == version:
+        return local[1]
+
+    index = cache.get(_key(subject_id, version))
+    if index is None:
+        with setup():
+            index = await abuild_index(subject_id)
+        cache.set(_key(subject_id, version), index, timeout=_timeout())
+    _local[subject_id] = (version, index)
+    return index
+
+
+def invalidate(subject_id):
+    """Drop the index once the transaction commits; the next reader rebuilds it.
+
+    A rebuild rather than patching the shared copy: two processes patching
+    the same cached index concurrently would each drop the other's change.
+    """
+    caching.bump_on_commit(NAMESPACE, subject_id)
@@ -0,0 +1,547 @@
+# questionbank.py
+"""Bulk import and export of question banks.
+
+A bank is either JSONL, one question per line::
+
+    {"subject": "Python", "order": 3, "question_type": "text", "text": "...",
+     "image": "questions/q3.png", "hint": "...",
+     "options": [{"text": "...", "image": null, "is_correct": true}, ...],
+     "explanation": {"text": "...", "image": null}}
+
+or CSV with one question per row: ``subject, order, question_type, text,
+image, hint``, then ``option_<n>`` / ``option_<n>_image`` column pairs,
+``correct`` (the number of the correct option) and ``explanation`` /
+``explanation_image``. Either file can be put in a zip as
+``questions.jsonl`` or ``questions.csv`` next to the images it refers to
+(paths inside the archive), or the images can come as a separate zip.
+
+Imports read the file lazily, ``batch_size`` records at a time. Each batch
+is validated on a thread pool and then written in one transaction with
+one ``bulk_create`` per model, so memory depends on the batch size and not
+on the file size. Invalid records are skipped and reported with their line
+number. ``bulk_create`` skips the model signals, so the import refreshes
+caches, the search index, image reference counts and derivatives itself.
+Images a failed batch wrote are deleted again when it rolls back.
+
+Records that look like a question already in the bank (``search.find_duplicates``)
+or repeat an earlier record of the same file are reported as possible
+duplicates, or skipped with ``skip_duplicates``.
+
+Exports stream the questions in chunks in the same formats. Zip exports
+include the images under their storage names, listed by the database
+rather than collected in memory.
+"""
+import csv
+import io
+import json
+import os
+import posixpath
+import re
+import shutil
+import zipfile
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.core.files.base import ContentFile
+from django.core.files.images import get_image_dimensions
+from django.db import transaction
+from django.db.models import Count, Max
+
+from . import catalogue, images, manifest, mediafiles, navigation, search
+from .models import Subject, Question, Option, Explanation, StoredFile
+from .storage import content_hash, hashed_name, quiz_media_storage
+
+JSONL = "jsonl"
+CSV = "csv"
+FORMATS = (JSONL, CSV)
+BANK_NAMES = {JSONL: "questions.jsonl", CSV: "questions.csv"}
+
+OPTION_COLUMN = re.compile(r"^option_(\d+)$")
+QUESTION_TYPES = {value for value, _ in Question.QUESTION_TYPES}
+
+
+class BankError(Exception):
+    """The bank file itself can't be read (as opposed to individual bad records)."""
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _text(value):
+    return str(value).strip() if value is not None else ""
+
+
+# ----------------- READING -----------------
+class QuestionBank:
+    """An opened bank: its records, and the images they refer to.
+
+    ``source`` is a path or a file object (e.g. an upload); ``name`` decides
+    the format of a non-zip file object. ``images`` is an optional zip of
+    images for a plain JSONL/CSV bank.
+    """
+
+    def __init__(self, source, name=None, images=None):
+        name = name or (source if isinstance(source, str) else getattr(source, "name", ""))
+        self.archive = None
+        if zipfile.is_zipfile(source):
+            self.archive = zipfile.ZipFile(source)
+            members = set(self.archive.namelist())
+            member = next((bank for bank in BANK_NAMES.values() if bank in members), None)
+            if member is None:
+                raise BankError("The zip contains neither questions.jsonl nor questions.csv.")
+            self.format = JSONL if member.endswith(".jsonl") else CSV
+            self._file = io.TextIOWrapper(self.archive.open(member), encoding="utf-8-sig", newline="")
+        else:
+            if hasattr(source, "seek"):
+                source.seek(0)
+            self.format = os.path.splitext(name)[1].lstrip(".").lower()
+            if self.format not in FORMATS:
+                raise BankError("Expected a .jsonl, .csv or .zip file.")
+            if isinstance(source, str):
+                self._file = open(source, encoding="utf-8-sig", newline="")
+            else:
+                self._file = io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+            if images:
+                self.archive = zipfile.ZipFile(images)
+        self._members = set(self.archive.namelist()) if self.archive else set()
+
+    def close(self):
+        self._file.close()
+        if self.archive:
+            self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def has_image(self, path):
+        return path in self._members
+
+    def read_image(self, path):
+        return self.archive.read(path)
+
+    def records(self):
+        """Yield ``(line number, record or None, error or None)``."""
+        if self.format == JSONL:
+            return self._jsonl_records()
+        return self._csv_records()
+
+    def _jsonl_records(self):
+        for line_number, line in enumerate(self._file, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                yield line_number, None, f"Invalid JSON: {exc}"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, "Expected a JSON object."
+                continue
+            yield line_number, record, None
+
+    def _csv_records(self):
+        reader = csv.DictReader(self._file)
+        numbers = sorted(
+            int(match.group(1)) for match in map(OPTION_COLUMN.match, reader.fieldnames or []) if match
+        )
+        for row in reader:
+            correct = {part.strip() for part in _text(row.get("correct")).split(",") if part.strip()}
+            options = []
+            for number in numbers:
+                text, image = _text(row.get(f"option_{number}")), _text(row.get(f"option_{number}_image"))
+                if text or image:
+                    options.append({"text": text, "image": image or None, "is_correct": str(number) in correct})
+            explanation_text, explanation_image = _text(row.get("explanation")), _text(row.get("explanation_image"))
+            yield reader.line_num, {
+                "subject": _text(row.get("subject")),
+                "order": _text(row.get("order")) or None,
+                "question_type": _text(row.get("question_type")) or Question.TEXT,
+                "text": _text(row.get("text")),
+                "image": _text(row.get("image")) or None,
+                "hint": _text(row.get("hint")),
+                "options": options,
+                "explanation": (
+                    {"text": explanation_text, "image": explanation_image or None}
+                    if explanation_text or explanation_image else None
+                ),
+            }, None
+
+
+# ----------------- VALIDATION -----------------
+def _image_paths(record):
+    paths = [record.get("image")]
+    paths += [option.get("image") for option in record["options"]]
+    if record.get("explanation"):
+        paths.append(record["explanation"].get("image"))
+    return [path for path in paths if path]
+
+
+def _check_image(path, bank):
+    if not bank.has_image(path):
+        return f"Image {path!r} is not in the archive."
+    width, _ = get_image_dimensions(ContentFile(bank.read_image(path)))
+    if width is None:
+        return f"Image {path!r} is not a valid image."
+    return None
+
+
+def validate_record(record, bank):
+    """Return the problems with ``record`` (an empty list when it can be imported)."""
+    errors = []
+    if not _text(record.get("subject")):
+        errors.append("Missing subject.")
+    if (record.get("question_type") or Question.TEXT) not in QUESTION_TYPES:
+        errors.append(f"Unknown question_type {record.get('question_type')!r}.")
+    if not _text(record.get("text")) and not record.get("image"):
+        errors.append("A question needs text or an image.")
+    order = record.get("order")
+    if order not in (None, "") and not str(order).isdigit():
+        errors.append("order must be a positive integer.")
+
+    options = record.get("options")
+    explanation = record.get("explanation")
+    if not isinstance(options, list) or not all(isinstance(option, dict) for option in options):
+        return errors + ["options must be a list of objects."]
+    if explanation is not None and not isinstance(explanation, dict):
+        return errors + ["explanation must be an object."]
+    if len(options) < 2:
+        errors.append("A question needs at least two options.")
+    for number, option in enumerate(options, 1):
+        if not _text(option.get("text")) and not option.get("image"):
+            errors.append(f"Option {number} has neither text nor an image.")
+    correct = sum(1 for option in options if option.get("is_correct"))
+    if correct != 1:
+        errors.append(f"Expected exactly one correct option, found {correct}.")
+
+    for path in _image_paths(record):
+        error = _check_image(path, bank)
+        if error:
+            errors.append(error)
+    return errors
+
+
+# ----------------- IMPORT -----------------
+class ImportReport:
+    MAX_ERRORS = 1000  # keep memory flat for a file full of bad records
+
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+        self.duplicate_count = 0
+        self.duplicates = []
+
+    def add_error(self, line, messages):
+        self.error_count += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append((line, messages))
+
+    def add_duplicate(self, line, message):
+        self.duplicate_count += 1
+        if len(self.duplicates) < self.MAX_ERRORS:
+            self.duplicates.append((line, message))
+
+    def as_dict(self, limit=20):
+        """The counts and the first ``limit`` errors and duplicates, as JSON-friendly data."""
+        return {
+            "read": self.read,
+            "imported": self.imported,
+            "error_count": self.error_count,
+            "errors": self.errors[:limit],
+            "duplicate_count": self.duplicate_count,
+            "duplicates": self.duplicates[:limit],
+        }
+
+    def __str__(self):
+        summary = f"{self.read} read, {self.imported} imported, {self.error_count} skipped"
+        return f"{summary}, {self.duplicate_count} possible duplicates" if self.duplicate_count else summary
+
+
+class _DuplicateFinder:
+    def __init__(self):
+        # Fingerprint hash -> line, for repeats inside the file
+        self.seen = {}
+
+    def check(self, line, record):
+        """Describe what ``record`` looks like a copy of, or return None."""
+        text = _text(record.get("text"))
+        options = [_text(option.get("text")) for option in record["options"]]
+        fingerprint = search.fingerprint(text, options)
+        if not fingerprint:
+            return None  # nothing to compare an image-only question on
+        key = hash(fingerprint)
+        if key in self.seen:
+            return f"Repeats the question on line {self.seen[key]}."
+        self.seen[key] = line
+        matches = search.find_duplicates(text, options)
+        if matches:
+            question_id, score = matches[0]
+            return f"Looks like a duplicate of question #{question_id} ({score:.0%} similar)."
+        return None
+
+
+class _BankWriter:
+    def __init__(self, bank):
+        self.bank = bank
+        self.storage = quiz_media_storage()
+        self.subject_ids = {}
+        self.next_order = {}
+        self.references = Counter()
+        self.created = []
+
+    def _subject_id(self, name):
+        if name not in self.subject_ids:
+            subject = Subject.objects.filter(name=name).order_by("id").first()
+            if subject is None:
+                subject = Subject.objects.create(name=name, description="")
+            self.subject_ids[name] = subject.pk
+        return self.subject_ids[name]
+
+    def _order(self, subject_id, order):
+        if subject_id not in self.next_order:
+            last = Question.objects.filter(subject_id=subject_id).aggregate(Max("order"))["order__max"]
+            self.next_order[subject_id] = (last or 0) + 1
+        order = int(order) if order not in (None, "") else self.next_order[subject_id]
+        self.next_order[subject_id] = max(self.next_order[subject_id], order + 1)
+        return order
+
+    def _image(self, path, upload_to, subject_id, stored):
+        # ``stored`` maps each saved name to a subject whose manifest shows it
+        if not path:
+            return None
+        content = ContentFile(self.bank.read_image(path))
+        name = upload_to + posixpath.basename(path)
+        target = hashed_name(name, content_hash(content))
+        if not self.storage.exists(target):
+            self.created.append(target)
+        name = self.storage.save(name, content)
+        stored[name] = subject_id
+        self.references[name] += 1
+        return name
+
+    def write(self, records):
+        """Insert ``records`` (already validated) in one transaction."""
+        stored = {}
+        self.references.clear()
+        self.created = []
+        try:
+            self._write(records, stored)
+        except Exception:
+            # The rows are gone, so are the files only this batch wrote
+            for name in self.created:
+                if not StoredFile.objects.filter(name=name).exists():
+                    self.storage.delete(name)
+            raise
+
+    def _write(self, records, stored):
+        with transaction.atomic():
+            questions = []
+            for record in records:
+                subject_id = self._subject_id(_text(record["subject"]))
+                questions.append(Question(
+                    subject_id=subject_id,
+                    question_type=record.get("question_type") or Question.TEXT,
+                    text_content=_text(record.get("text")),
+                    image_content=self._image(record.get("image"), "questions/", subject_id, stored),
+                    hint=_text(record.get("hint")),
+                    order=self._order(subject_id, record.get("order")),
+                ))
+            Question.objects.bulk_create(questions)
+
+            options, explanations = [], []
+            for question, record in zip(questions, records):
+                for option in record["options"]:
+                    options.append(Option(
+                        question=question,
+                        text_content=_text(option.get("text")),
+                        image_content=self._image(option.get("image"), "options/", question.subject_id, stored),
+                        is_correct=bool(option.get("is_correct")),
+                    ))
+                explanation = record.get("explanation")
+                if explanation:
+                    explanations.append(Explanation(
+                        question=question,
+                        text_content=_text(explanation.get("text")),
+                        image_content=self._image(
+                            explanation.get("image"), "explanations/", question.subject_id, stored
+                        ),
+                    ))
+            Option.objects.bulk_create(options)
+            Explanation.objects.bulk_create(explanations)
+
+            mediafiles.acquire_many(self.references)
+            for name, subject_id in stored.items():
+                images.schedule(name, subject_id)
+            for subject_id in {question.subject_id for question in questions}:
+                manifest.invalidate(subject_id)
+                navigation.invalidate(subject_id)
+            catalogue.invalidate()
+            search.schedule([question.pk for question in questions])
+
+
+def import_bank(bank, batch_size=500, workers=4, dry_run=False, skip_duplicates=False, progress=None):
+    """Import every valid record of ``bank``; ``progress(report)`` is called after each batch."""
+    report = ImportReport()
+    writer = _BankWriter(bank)
+    duplicates = _DuplicateFinder()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bank-validate") as pool:
+        for batch in _batches(bank.records(), batch_size):
+            checked = pool.map(
+                lambda item: [item[2]] if item[2] else validate_record(item[1], bank), batch
+            )
+            valid = []
+            for (line, record, _), errors in zip(batch, checked):
+                if errors:
+                    report.add_error(line, errors)
+                    continue
+                # Earlier batches are indexed by now, so they are compared too
+                duplicate = duplicates.check(line, record)
+                if duplicate and skip_duplicates:
+                    report.add_error(line, [duplicate])
+                    continue
+                if duplicate:
+                    report.add_duplicate(line, duplicate)
+                valid.append(record)
+            if valid and not dry_run:
+                writer.write(valid)
+            report.read += len(batch)
+            report.imported += len(valid)
+            if progress:
+                progress(report)
+    return report
+
+
+# ----------------- EXPORT -----------------
+def _rows(questions, chunk_size):
+    return questions.order_by("subject_id", "order", "id").values_list(
+        "id", "subject__name", "order", "question_type", "text_content", "image_content", "hint",
+    ).iterator(chunk_size=chunk_size)
+
+
+def export_records(questions, chunk_size=500):
+    """Yield one record per question of ``questions`` (three queries per chunk)."""
+    for chunk in _batches(_rows(questions, chunk_size), chunk_size):
+        ids = [row[0] for row in chunk]
+        options = defaultdict(list)
+        for question_id, text, image, is_correct in Option.objects.filter(question_id__in=ids).order_by(
+            "id"
+        ).values_list("question_id", "text_content", "image_content", "is_correct"):
+            options[question_id].append({"text": text or "", "image": image or None, "is_correct": is_correct})
+        explanations = {
+            question_id: {"text": text or "", "image": image or None}
+            for question_id, text, image in Explanation.objects.filter(question_id__in=ids).values_list(
+                "question_id", "text_content", "image_content"
+            )
+        }
+        for question_id, subject, order, question_type, text, image, hint in chunk:
+            yield {
+                "subject": subject,
+                "order": order,
+                "question_type": question_type,
+                "text": text or "",
+                "image": image or None,
+                "hint": hint or "",
+                "options": options[question_id],
+                "explanation": explanations.get(question_id),
+            }
+
+
+def jsonl_lines(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_header(option_count):
+    header = ["subject", "order", "question_type", "text", "image", "hint"]
+    for number in range(1, option_count + 1):
+        header += [f"option_{number}", f"option_{number}_image"]
+    return header + ["correct", "explanation", "explanation_image"]
+
+
+def csv_lines(records, option_count):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(csv_header(option_count))
+    for record in records:
+        row = [record[key] or "" for key in ("subject", "order", "question_type", "text", "image", "hint")]
+        correct = ""
+        for number in range(1, option_count + 1):
+            option = record["options"][number - 1] if number <= len(record["options"]) else {}
+            row += [option.get("text", ""), option.get("image") or ""]
+            if option.get("is_correct"):
+                correct = str(number)
+        explanation = record["explanation"] or {}
+        yield writer.writerow(row + [correct, explanation.get("text", ""), explanation.get("image") or ""])
+
+
+def option_count(questions):
+    counts = Option.objects.filter(question__in=questions.values("pk")).values("question_id").annotate(
+        options=Count("id")
+    ).order_by()
+    return counts.aggregate(most=Max("options"))["most"] or 0
+
+
+def bank_lines(questions, fmt, records=None):
+    """The lines of ``questions`` as a ``fmt`` bank (``records`` defaults to ``export_records``)."""
+    records = export_records(questions) if records is None else records
+    if fmt == CSV:
+        return csv_lines(records, option_count(questions))
+    return jsonl_lines(records)
+
+
+def image_names(questions, chunk_size=2000):
+    """Every image of ``questions``, their options and explanations, once each."""
+    ids = questions.values("pk")
+    names = [
+        model.objects.filter(**{lookup: ids}).exclude(image_content="").exclude(image_content__isnull=True)
+        .order_by().values_list("image_content", flat=True)
+        for model, lookup in ((Question, "pk__in"), (Option, "question__in"), (Explanation, "question__in"))
+    ]
+    # UNION drops the repeats
+    return names[0].union(*names[1:]).order_by("image_content").iterator(chunk_size=chunk_size)
+
+
+def write_bank(fh, questions, fmt=JSONL, with_images=False, progress=None):
+    """Write ``questions`` to the binary file ``fh``: the bank file itself, or a
+    zip of the bank plus its images when ``with_images``. Returns the number of questions."""
+    count = 0
+
+    def counted(records):
+        nonlocal count
+        for record in records:
+            count += 1
+            if progress and count % 500 == 0:
+                progress(count)
+            yield record
+
+    if not with_images:
+        for line in bank_lines(questions, fmt, counted(export_records(questions))):
+            fh.write(line.encode("utf-8"))
+        return count
+
+    storage = quiz_media_storage()
+    with zipfile.ZipFile(fh, "w", zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(BANK_NAMES[fmt], "w") as member:
+            for line in bank_lines(questions, fmt, counted(export_records(questions))):
+                member.write(line.encode("utf-8"))
+        for name in image_names(questions):
+            if not storage.exists(name):
+                continue
+            # Images are already compressed
+            info = zipfile.ZipInfo(name)
+            info.compress_type = zipfile.ZIP_STORED
+            with storage.open(name, "rb") as source, archive.open(info, "w", force_zip64=True) as member:
+                shutil.copyfileobj(source, member)
+    return count
@@ -0,0 +1,322 @@
+# recording.py
+"""Answer recording pipeline.
+
+``record_answer`` writes the user's progress row with a single ``UPDATE``
+that only matches while the row still holds the attempts it was read with
+(a concurrent answer makes it reload and apply the answer again, so the
+stats and summary deltas always describe the row they change), or inserts
+it on the learner's first answer to the question, updates the
+user's subject summary in the same transaction (``summaries.py``) and the
+leaderboards once it commits (``leaderboards.py``), and hands the matching
+``Submission`` history row to a writer. In the default buffered mode the
+writer collects submissions in memory and inserts them with ``bulk_create``
+once ``BATCH_SIZE`` rows are pending or ``FLUSH_INTERVAL`` seconds have
+passed; whatever is still pending is flushed at interpreter exit. Rows
+whose user or question was deleted before the flush are dropped (and
+logged), and a deleted option is cleared as ``on_delete`` would have. Set
+``QUIZ_ANSWER_RECORDING['MODE'] = 'sync'`` to insert submissions inline
+instead (a graded batch in one ``bulk_create``), e.g. to compare the two
+under load.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from . import analytics, leaderboards, summaries
+from .models import Option, Question, UserProgress, Submission
+from .scoring import is_finished
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "MODE": "buffered",
+    "BATCH_SIZE": 200,
+    "FLUSH_INTERVAL": 2.0,
+    # Upper bound on rows kept around when the database keeps failing
+    "MAX_PENDING": 10000,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "QUIZ_ANSWER_RECORDING", {})}
+
+
+class SyncSubmissionWriter:
+    def add(self, submission):
+        submission.save(force_insert=True)
+        analytics.record([submission])
+
+    def add_many(self, submissions):
+        Submission.objects.bulk_create(submissions)
+        analytics.record(submissions)
+
+    async def aadd(self, submission):
+        await submission.asave(force_insert=True)
+        await analytics.arecord([submission])
+
+    def flush(self):
+        pass
+
+
+class BufferedSubmissionWriter:
+    def __init__(self, batch_size, flush_interval, max_pending):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _append(self, submissions):
+        with self._lock:
+            self._pending.extend(submissions)
+            full = len(self._pending) >= self.batch_size
+        self._ensure_flusher()
+        return full
+
+    def add(self, submission):
+        self.add_many([submission])
+
+    def add_many(self, submissions):
+        if self._append(submissions):
+            self.flush()
+
+    async def aadd(self, submission):
+        if self._append([submission]):
+            await sync_to_async(self.flush, thread_sensitive=False)()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                batch = self._write(batch)
+            except Exception:
+                logger.exception("Could not flush %d submissions; keeping them for the next flush", len(batch))
+                with self._lock:
+                    # Answers that arrived during the flush count towards the cap too; the oldest go first
+                    kept = batch + self._pending
+                    dropped = max(len(kept) - self.max_pending, 0)
+                    self._pending = kept[dropped:]
+                if dropped:
+                    logger.error("Dropped the %d oldest unwritten submissions (MAX_PENDING is %d)", dropped, self.max_pending)
+                return 0
+            try:
+                analytics.record(batch)
+            except Exception:
+                # The submissions are in; reconcile_question_stats repairs the rollups
+                logger.exception("Could not update question stats for %d submissions", len(batch))
+            return len(batch)
+
+    def _write(self, batch):
+        try:
+            Submission.objects.bulk_create(batch, batch_size=self.batch_size)
+            return batch
+        except IntegrityError:
+            # Something was deleted after it was answered; retrying the batch as it is would fail forever
+            batch = _without_deleted_references(batch)
+            Submission.objects.bulk_create(batch, batch_size=self.batch_size)
+            return batch
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _ensure_flusher(self):
+        # One timer thread per process; forked workers start their own.
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="submission-flusher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            close_old_connections()
+            self.flush()
+
+
+def _existing(model, ids):
+    return set(model.objects.filter(pk__in=ids).values_list("pk", flat=True))
+
+
+def _without_deleted_references(batch):
+    """Drop submissions whose user or question is gone and clear deleted options,
+    as the foreign keys' ``on_delete`` would have done to a stored row."""
+    users = _existing(User, {submission.user_id for submission in batch})
+    questions = _existing(Question, {submission.question_id for submission in batch})
+    options = _existing(Option, {submission.selected_option_id for submission in batch} - {None})
+
+    kept = []
+    for submission in batch:
+        if submission.user_id not in users or submission.question_id not in questions:
+            logger.warning(
+                "Dropped the submission of user %s for question %s at %s: the %s was deleted",
+                submission.user_id, submission.question_id, submission.submitted_at,
+                "user" if submission.user_id not in users else "question",
+            )
+            continue
+        if submission.selected_option_id is not None and submission.selected_option_id not in options:
+            submission.selected_option_id = None
+        kept.append(submission)
+    return kept
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = get_config()
+                if config["MODE"] == "sync":
+                    _writer = SyncSubmissionWriter()
+                else:
+                    _writer = BufferedSubmissionWriter(
+                        config["BATCH_SIZE"], config["FLUSH_INTERVAL"], config["MAX_PENDING"]
+                    )
+    return _writer
+
+
+def reset_writer():
+    """Flush and drop the current writer so the next call re-reads settings."""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.flush()
+        _writer = None
+
+
+def flush():
+    if _writer is not None:
+        return _writer.flush()
+    return 0
+
+
+atexit.register(flush)
+
+
+def apply_answer(progress, option_id, is_correct, now, hint_used=False):
+    """Update ``progress`` in memory for one answer and return its ``Submission``.
+
+    The submission carries the answer's ``analytics.AnswerDelta`` for the
+    question stats and its ``summaries.SummaryDelta``, both taken before
+    ``progress`` changes.
+    """
+    delta = analytics.answer_delta(progress, is_correct, hint_used)
+    summary_delta = summaries.answer_delta(progress, is_correct, hint_used)
+    progress.attempts += 1
+    progress.answered_correctly = is_correct
+    progress.selected_option_id = option_id
+    progress.hint_used = progress.hint_used or hint_used
+    progress.updated_at = now
+    submission = Submission(
+        user_id=progress.user_id,
+        question_id=progress.question_id,
+        selected_option_id=option_id,
+        submitted_at=now,
+    )
+    submission.stats_delta = delta
+    submission.summary_delta = summary_delta
+    return submission
+
+
+def _save_progress(progress, seen_attempts, summary_delta):
+    """Write ``progress`` unless another answer changed the row since it was
+    read with ``seen_attempts``, or created it if ``progress`` is unsaved;
+    returns whether it was written."""
+    try:
+        with transaction.atomic():
+            if progress.pk is None:
+                progress.save(force_insert=True)
+                written = True
+            else:
+                written = UserProgress.objects.filter(pk=progress.pk, attempts=seen_attempts).update(
+                    attempts=progress.attempts,
+                    answered_correctly=progress.answered_correctly,
+                    selected_option_id=progress.selected_option_id,
+                    hint_used=progress.hint_used,
+                    updated_at=progress.updated_at,
+                )
+            if written:
+                summaries.apply([summary_delta], progress.updated_at)
+                leaderboards.record([summary_delta])
+    except IntegrityError:
+        # Another request created the row first
+        return False
+    return bool(written)
+
+
+def _reload(progress):
+    if progress.pk is None:
+        progress.pk = UserProgress.objects.values_list("pk", flat=True).get(
+            user_id=progress.user_id, question_id=progress.question_id
+        )
+    progress.refresh_from_db()
+
+
+def record_answer(progress, option_id, is_correct, hint_used=False):
+    """Record one answer against ``progress`` and update it in place. An
+    unsaved ``progress`` (the learner's first answer) is inserted.
+
+    Returns ``progress``, or None without recording anything if the question
+    is finished (``scoring.is_finished``), also when a concurrent answer
+    finished it first.
+    """
+    while True:
+        if is_finished(progress.attempts, progress.answered_correctly):
+            return None
+        seen_attempts = progress.attempts
+        submission = apply_answer(progress, option_id, is_correct, timezone.now(), hint_used)
+        if _save_progress(progress, seen_attempts, submission.summary_delta):
+            break
+        _reload(progress)
+    get_writer().add(submission)
+    return progress
+
+
+async def arecord_answer(progress, option_id, is_correct, hint_used=False):
+    while True:
+        if is_finished(progress.attempts, progress.answered_correctly):
+            return None
+        seen_attempts = progress.attempts
+        submission = apply_answer(progress, option_id, is_correct, timezone.now(), hint_used)
+        # The progress row and the summary share a transaction, which the async ORM can't hold
+        if await sync_to_async(_save_progress)(progress, seen_attempts, submission.summary_delta):
+            break
+        await sync_to_async(_reload)(progress)
+    await get_writer().aadd(submission)
+    return progress
+
+
+def record_answers(progress_rows, submissions):
+    """Persist answers already applied with ``apply_answer``: one bulk UPDATE of
+    the progress rows, the subject summaries, and the submissions handed to
+    the writer.
+
+    Call it inside the transaction that locked ``progress_rows``.
+    """
+    UserProgress.objects.bulk_update(
+        progress_rows, ["attempts", "answered_correctly", "selected_option", "hint_used", "updated_at"]
+    )
+    if submissions:
+        deltas = [submission.summary_delta for submission in submissions]
+        summaries.apply(deltas, submissions[-1].submitted_at)
+        leaderboards.record(deltas)
+        get_writer().add_many(submissions)
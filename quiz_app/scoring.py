@@ -0,0 +1,102 @@
+# scoring.py
+"""Results engine shared by the results page and the results API.
+
+Scores come from one joined fetch of the per-question rows, a LEFT JOIN
+from the subject's questions to the user's progress, so questions the user
+never reached are listed too; the totals are counted from the same rows. An attempt
+that asks only some of the subject's questions (``selection.py``) passes
+their ids, and its rows come back in the order they were asked. Nothing
+here fills a cache, so both read from the replica when one is configured.
+"""
+from django.db.models import FilteredRelation, Q
+
+from .db import read_from_replica
+from .models import Question
+
+MAX_ATTEMPTS = 2
+
+CORRECT = "Correct"
+INCORRECT = "Incorrect"
+INCOMPLETE = "Incomplete"
+UNANSWERED = "Unanswered"
+
+
+def _questions_with_progress(user, subject_id, question_ids=None):
+    questions = Question.objects.filter(subject_id=subject_id)
+    if question_ids is not None:
+        questions = questions.filter(id__in=question_ids)
+    return questions.annotate(
+        progress=FilteredRelation("userprogress", condition=Q(userprogress__user=user)),
+    )
+
+
+def is_finished(attempts, answered_correctly):
+    """Whether a question takes no more answers: right, or out of attempts."""
+    return bool(answered_correctly) or attempts >= MAX_ATTEMPTS
+
+
+def _status(attempts, answered_correctly):
+    if answered_correctly:
+        return CORRECT
+    if not attempts:
+        return UNANSWERED
+    if attempts >= MAX_ATTEMPTS:
+        return INCORRECT
+    return INCOMPLETE
+
+
+def _rows(questions):
+    return questions.order_by("order", "id").values_list(
+        "id", "text_content", "progress__attempts", "progress__answered_correctly", "progress__hint_used",
+    )
+
+
+def _totals(rows):
+    totals = dict.fromkeys(("total_questions", "correct", "incorrect", "answered", "hints_used"), 0)
+    for _, _, attempts, answered_correctly, hint_used in rows:
+        totals["total_questions"] += 1
+        totals["correct"] += bool(answered_correctly)
+        totals["incorrect"] += not answered_correctly and (attempts or 0) >= MAX_ATTEMPTS
+        totals["answered"] += bool(attempts)
+        totals["hints_used"] += bool(hint_used)
+    return totals
+
+
+def _summarise(rows, question_ids=None):
+    totals = _totals(rows)
+    total = totals["total_questions"]
+    totals["unanswered"] = total - totals["answered"]
+    # Answered but neither correct nor out of attempts, as in ``_status``
+    totals["incomplete"] = totals["answered"] - totals["correct"] - totals["incorrect"]
+    totals["score_percentage"] = int(totals["correct"] * 100 / total) if total else 0
+
+    results = []
+    for question_id, text, attempts, answered_correctly, hint_used in rows:
+        results.append({
+            "question_id": question_id,
+            "question_text": text or "Unnamed Question",
+            "attempts": attempts or 0,
+            "hints_used": bool(hint_used),
+            "status": _status(attempts, answered_correctly),
+        })
+
+    if question_ids is not None:
+        positions = {question_id: position for position, question_id in enumerate(question_ids)}
+        results.sort(key=lambda row: positions[row["question_id"]])
+
+    totals["results"] = results
+    return totals
+
+
+def compute_results(user, subject_id, question_ids=None):
+    """Results for ``user`` at ``subject_id``, limited to ``question_ids`` if given."""
+    questions = _questions_with_progress(user, subject_id, question_ids)
+    with read_from_replica():
+        return _summarise(list(_rows(questions)), question_ids)
+
+
+async def acompute_results(user, subject_id, question_ids=None):
+    questions = _questions_with_progress(user, subject_id, question_ids)
+    with read_from_replica():
+        rows = [row async for row in _rows(questions)]
+    return _summarise(rows, question_ids)
@@ -0,0 +1,390 @@
+# search.py
+"""Full-text search over the question bank.
+
+Every question has one search document: its text, hint, option texts and
+explanation, weighted in that order (question text counts most). The
+documents live in an inverted index next to the quiz tables, picked by
+``QUIZ_SEARCH['BACKEND']``:
+
+* ``sqlite``: an FTS5 virtual table ranked with bm25.
+* ``postgresql``: a tsvector column with a GIN index, ranked with ts_rank_cd.
+* ``auto`` (default): whichever matches the database; search is off on
+  other databases.
+
+Both tables are created by migration ``0016_question_search``. A backend is
+any object with the methods of :class:`SearchBackend`.
+
+The index follows the content through the model signals: a saved or
+deleted question, option or explanation queues its question, and the
+queued questions are reindexed once the transaction commits. Bulk imports
+queue their questions themselves. ``rebuild_search_index`` rebuilds the
+index from the tables.
+
+Searches power the admin question search, the learner search page, and
+:func:`find_duplicates`, which the bank import uses to flag questions that
+are already in the bank.
+"""
+import re
+import threading
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router, transaction
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .db import read_from_replica
+from .models import Explanation, Option, Question
+
+PAGE_SIZE = 20
+MAX_QUERY_TERMS = 32
+# Token-set similarity from which two questions count as near-duplicates
+DUPLICATE_THRESHOLD = 0.8
+
+DEFAULTS = {
+    "BACKEND": "auto",
+}
+
+Document = namedtuple("Document", ["question_id", "subject_id", "question", "hint", "options", "explanation"])
+Hit = namedtuple("Hit", ["question_id", "subject_id", "score", "snippet", "content"])
+
+# Marks the matched words in snippets; escaped and turned into <mark> for display
+_START, _STOP = "\x02", "\x03"
+_WORD = re.compile(r"\w+")
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "QUIZ_SEARCH", {})}
+
+
+def terms(text):
+    """The words of ``text``, lower-cased, in order and without repeats."""
+    return list(dict.fromkeys(word.lower() for word in _WORD.findall(text or "")))
+
+
+# ----------------- DOCUMENTS -----------------
+def documents(question_ids):
+    """The search documents of ``question_ids``; deleted questions are left out. Three queries."""
+    question_ids = list(question_ids)
+    options = defaultdict(list)
+    for question_id, text in Option.objects.filter(question_id__in=question_ids).order_by("id").values_list(
+        "question_id", "text_content"
+    ):
+        options[question_id].append(text or "")
+    explanations = dict(
+        Explanation.objects.filter(question_id__in=question_ids).values_list("question_id", "text_content")
+    )
+    return [
+        Document(pk, subject_id, text or "", hint or "", " ".join(options[pk]), explanations.get(pk) or "")
+        for pk, subject_id, text, hint in Question.objects.filter(pk__in=question_ids).values_list(
+            "pk", "subject_id", "text_content", "hint"
+        )
+    ]
+
+
+# ----------------- BACKENDS -----------------
+class SearchBackend:
+    """The interface of a search backend."""
+
+    def index(self, documents, removed=()):
+        """Add or replace ``documents`` and drop the questions in ``removed``."""
+        raise NotImplementedError
+
+    def clear(self, subject_id=None):
+        """Drop every document (of ``subject_id`` only, if given)."""
+        raise NotImplementedError
+
+    def search(self, words, subject_id=None, limit=PAGE_SIZE, offset=0, any_word=False):
+        """``Hit``s for the questions matching all of ``words`` (any of them with
+        ``any_word``), best first. The last word also matches as a prefix
+        unless ``any_word`` is set."""
+        raise NotImplementedError
+
+
+class SQLiteBackend(SearchBackend):
+    TABLE = "quiz_question_search"
+    # bm25 weights of the question, hint, options and explanation columns
+    WEIGHTS = (10.0, 1.0, 4.0, 2.0)
+
+    def __init__(self, alias="default"):
+        self.alias = alias
+
+    def _cursor(self, write):
+        alias = router.db_for_write(Question) if write else router.db_for_read(Question)
+        return connections[alias or self.alias].cursor()
+
+    def index(self, documents, removed=()):
+        ids = [document.question_id for document in documents] + list(removed)
+        with transaction.atomic(), self._cursor(True) as cursor:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                cursor.execute(
+                    f"DELETE FROM {self.TABLE} WHERE rowid IN ({', '.join(['%s'] * len(chunk))})", chunk
+                )
+            cursor.executemany(
+                f"INSERT INTO {self.TABLE} (rowid, subject_id, question, hint, options, explanation) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                [tuple(document) for document in documents],
+            )
+
+    def clear(self, subject_id=None):
+        with self._cursor(True) as cursor:
+            if subject_id is None:
+                cursor.execute(f"DELETE FROM {self.TABLE}")
+            else:
+                cursor.execute(f"DELETE FROM {self.TABLE} WHERE subject_id = %s", [subject_id])
+
+    @staticmethod
+    def _match(words, any_word):
+        quoted = [f'"{word}"' for word in words]
+        if any_word:
+            return " OR ".join(quoted)
+        quoted[-1] += " *"
+        return " ".join(quoted)
+
+    def search(self, words, subject_id=None, limit=PAGE_SIZE, offset=0, any_word=False):
+        if not words:
+            return []
+        sql = (
+            f"SELECT rowid, subject_id, bm25({self.TABLE}, {', '.join(map(str, self.WEIGHTS))}) AS rank, "
+            f"snippet({self.TABLE}, 0, char(2), char(3), '…', 16), question || ' ' || options "
+            f"FROM {self.TABLE} WHERE {self.TABLE} MATCH %s"
+        )
+        params = [self._match(words, any_word)]
+        if subject_id is not None:
+            sql += " AND subject_id = %s"
+            params.append(subject_id)
+        sql += " ORDER BY rank, rowid LIMIT %s OFFSET %s"
+        with self._cursor(False) as cursor:
+            cursor.execute(sql, params + [limit, offset])
+            # bm25 is lower for better matches
+            return [Hit(pk, int(subject), -rank, snippet, content) for pk, subject, rank, snippet, content in cursor]
+
+
+class PostgreSQLBackend(SQLiteBackend):
+    CONFIG = "english"
+    DOCUMENT = (
+        "setweight(to_tsvector(%(config)s, %(question)s), 'A') || setweight(to_tsvector(%(config)s, %(options)s), 'B')"
+        " || setweight(to_tsvector(%(config)s, %(explanation)s), 'C') || setweight(to_tsvector(%(config)s, %(hint)s), 'D')"
+    )
+
+    def index(self, documents, removed=()):
+        with transaction.atomic(), self._cursor(True) as cursor:
+            if removed:
+                cursor.execute(f"DELETE FROM {self.TABLE} WHERE question_id = ANY(%s)", [list(removed)])
+            cursor.executemany(
+                f"INSERT INTO {self.TABLE} (question_id, subject_id, content, document) "
+                f"VALUES (%(question_id)s, %(subject_id)s, %(content)s, {self.DOCUMENT}) "
+                "ON CONFLICT (question_id) DO UPDATE SET subject_id = EXCLUDED.subject_id, "
+                "content = EXCLUDED.content, document = EXCLUDED.document",
+                [
+                    {**document._asdict(), "config": self.CONFIG, "content": f"{document.question} {document.options}"}
+                    for document in documents
+                ],
+            )
+
+    def search(self, words, subject_id=None, limit=PAGE_SIZE, offset=0, any_word=False):
+        if not words:
+            return []
+        query = " | ".join(words) if any_word else " & ".join(words) + ":*"
+        sql = (
+            "SELECT question_id, subject_id, ts_rank_cd(document, query) AS rank, "
+            "ts_headline(%s, content, query, 'StartSel=\x02, StopSel=\x03, MaxFragments=1, MaxWords=16'), content "
+            f"FROM {self.TABLE}, to_tsquery(%s, %s) query WHERE document @@ query"
+        )
+        params = [self.CONFIG, self.CONFIG, query]
+        if subject_id is not None:
+            sql += " AND subject_id = %s"
+            params.append(subject_id)
+        sql += " ORDER BY rank DESC, question_id LIMIT %s OFFSET %s"
+        with self._cursor(False) as cursor:
+            cursor.execute(sql, params + [limit, offset])
+            return [Hit(*row) for row in cursor]
+
+
+BACKENDS = {"sqlite": SQLiteBackend, "postgresql": PostgreSQLBackend}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The configured backend, or None when search isn't available on this database."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = get_config()["BACKEND"]
+                if name == "auto":
+                    name = connections["default"].vendor
+                    _backend = BACKENDS[name]() if name in BACKENDS else False
+                elif name in BACKENDS:
+                    _backend = BACKENDS[name]()
+                else:
+                    raise ImproperlyConfigured(
+                        f"Unknown QUIZ_SEARCH['BACKEND'] {name!r}; expected 'auto' or one of {sorted(BACKENDS)}."
+                    )
+    return _backend or None
+
+
+def reset_backend():
+    """Drop the current backend so the next call re-reads settings."""
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+# ----------------- INDEXING -----------------
+_pending = threading.local()
+
+
+def reindex(question_ids):
+    """Bring the documents of ``question_ids`` up to date."""
+    backend = get_backend()
+    if backend is None:
+        return
+    question_ids = set(question_ids)
+    found = documents(question_ids)
+    backend.index(found, removed=question_ids - {document.question_id for document in found})
+
+
+def _flush():
+    question_ids, _pending.ids = getattr(_pending, "ids", set()), set()
+    if question_ids:
+        reindex(question_ids)
+
+
+def schedule(question_ids):
+    """Reindex ``question_ids`` once the current transaction commits.
+
+    Questions queued in one transaction are reindexed together; the first
+    commit callback takes them all and the others find nothing left.
+    """
+    if not hasattr(_pending, "ids"):
+        _pending.ids = set()
+    _pending.ids.update(question_ids)
+    transaction.on_commit(_flush)
+
+
+def rebuild(subject_ids=None, chunk_size=500, progress=None):
+    """Rebuild the index of ``subject_ids`` (default: all subjects) from the
+    tables, ``chunk_size`` questions at a time. Returns the number indexed."""
+    backend = get_backend()
+    if backend is None:
+        return 0
+    questions = Question.objects.all()
+    if subject_ids is None:
+        backend.clear()
+    else:
+        for subject_id in subject_ids:
+            backend.clear(subject_id)
+        questions = questions.filter(subject_id__in=subject_ids)
+    ids = questions.order_by("pk").values_list("pk", flat=True)
+    done = 0
+    last_id = 0
+    while True:
+        chunk = list(ids.filter(pk__gt=last_id)[:chunk_size])
+        if not chunk:
+            break
+        backend.index(documents(chunk))
+        last_id = chunk[-1]
+        done += len(chunk)
+        if progress:
+            progress(done)
+    return done
+
+
+# ----------------- SEARCHING -----------------
+def matching_ids(text, limit=1000):
+    """Ids of the best ``limit`` questions matching ``text``, best first; None when search is off."""
+    backend = get_backend()
+    if backend is None:
+        return None
+    return [hit.question_id for hit in backend.search(terms(text)[:MAX_QUERY_TERMS], limit=limit)]
+
+
+def _highlight(snippet):
+    return mark_safe(escape(snippet).replace(_START, "<mark>").replace(_STOP, "</mark>"))
+
+
+def search_page(text, subject_id=None, number=1, size=PAGE_SIZE):
+    """One page of results for the learner search page. Question details cost one query.
+
+    Nothing caches a page, so it is read from the replica when one is configured.
+    """
+    with read_from_replica():
+        return _search_page(text, subject_id, number, size)
+
+
+def _search_page(text, subject_id, number, size):
+    backend = get_backend()
+    words = terms(text)[:MAX_QUERY_TERMS]
+    number = max(number, 1)
+    page = {
+        "query": text,
+        "subject_id": subject_id,
+        "page": number,
+        "available": backend is not None,
+        "results": [],
+        "has_next": False,
+    }
+    if backend is None or not words:
+        return page
+
+    # One extra hit tells whether there is a next page, without counting every match
+    hits = backend.search(words, subject_id, limit=size + 1, offset=(number - 1) * size)
+    page["has_next"] = len(hits) > size
+    hits = hits[:size]
+    questions = Question.objects.select_related("subject").only(
+        "text_content", "subject__name", "subject__selection_mode"
+    ).in_bulk([hit.question_id for hit in hits])
+    for hit in hits:
+        question = questions.get(hit.question_id)
+        if question is None:
+            continue  # deleted since it was indexed
+        page["results"].append({
+            "question_id": question.pk,
+            "subject_id": question.subject_id,
+            "subject": question.subject.name,
+            "text": question.text_content or "Unnamed Question",
+            "snippet": _highlight(hit.snippet),
+            "score": round(hit.score, 4),
+            # Other modes only ask some questions, so link those to the subject
+            "in_order": question.subject.selection_mode == question.subject.ORDERED,
+        })
+    return page
+
+
+# ----------------- NEAR-DUPLICATES -----------------
+def fingerprint(text, options=()):
+    """The words a question is compared on: its text and option texts, short words left out."""
+    return frozenset(word for word in terms(" ".join([text or "", *options])) if len(word) > 2)
+
+
+def similarity(first, second):
+    """Jaccard similarity of two fingerprints."""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def find_duplicates(text, options=(), subject_id=None, threshold=DUPLICATE_THRESHOLD, candidates=5):
+    """Indexed questions that look like a copy of the question ``text`` with
+    ``options``, as ``[(question_id, similarity)]``, most similar first.
+
+    The index narrows the bank down to the best ``candidates`` by rank;
+    only those are compared word by word.
+    """
+    backend = get_backend()
+    words = fingerprint(text, options)
+    if backend is None or not words:
+        return []
+    # The longest words are the most telling
+    query = sorted(words, key=lambda word: (-len(word), word))[:MAX_QUERY_TERMS]
+    matches = []
+    for hit in backend.search(query, subject_id, limit=candidates, any_word=True):
+        score = similarity(words, fingerprint(hit.content))
+        if score >= threshold:
+            matches.append((hit.question_id, score))
+    return sorted(matches, key=lambda match: -match[1])
@@ -0,0 +1,272 @@
+# selection.py
+"""Question selection: which questions an attempt asks, and in what order.
+
+Every ``QuizAttempt`` fixes its order when it starts, following its
+subject's ``selection_mode``:
+
+* ``ordered``: the subject's own order (``navigation.py``); nothing is stored.
+* ``shuffled``: a seeded shuffle, cut to ``question_limit``.
+* ``stratified``: a seeded sample that keeps the subject's mix of easy,
+  medium and hard questions, easy ones first.
+* ``adaptive``: starts with a medium question; every finished question
+  appends the next one, a level harder after a correct answer and a level
+  easier after a miss.
+
+Difficulty comes from each question's first-try rate in ``QuestionStats``.
+The per-subject buckets are computed once and cached; an adaptive attempt
+keeps its own seeded copy with a cursor per bucket, so picking the next
+question is O(1).
+
+The order is stored once on the attempt as an array of ids. ``get_order``
+serves it as an ``AttemptOrder``, the same position/previous/next lookups
+as ``navigation.QuestionIndex``, cached per attempt, so moving through an
+attempt never queries. Option order can be shuffled too, seeded per
+attempt and question so a reload shows the same order.
+"""
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import caching, navigation
+from .instrumentation import setup
+from .models import QuestionStats, QuizAttempt, Subject, new_seed
+
+EASY, MEDIUM, HARD = 0, 1, 2
+# First-try rates (%) that make a question easy or hard
+EASY_RATE = 70
+HARD_RATE = 40
+# Questions answered by fewer learners count as medium
+MIN_LEARNERS = 5
+BUCKETS_TIMEOUT = 60 * 10
+
+
+def _timeout():
+    return getattr(settings, "QUIZ_MANIFEST_TIMEOUT", 60 * 60 * 24)
+
+
+# ----------------- DIFFICULTY -----------------
+def _level(rate):
+    if rate is None:
+        return MEDIUM
+    if rate >= EASY_RATE:
+        return EASY
+    if rate < HARD_RATE:
+        return HARD
+    return MEDIUM
+
+
+def build_buckets(subject_id):
+    """The subject's question ids split into ``[easy, medium, hard]``, in subject order."""
+    rates = {
+        question_id: first_try_correct * 100 / learners
+        for question_id, first_try_correct, learners in QuestionStats.objects.filter(
+            question__subject_id=subject_id, learners__gte=MIN_LEARNERS,
+        ).values_list("question_id", "first_try_correct", "learners")
+    }
+    buckets = [[], [], []]
+    for question_id in navigation.get_index(subject_id).ids:
+        buckets[_level(rates.get(question_id))].append(question_id)
+    return buckets
+
+
+def difficulty_buckets(subject_id):
+    # Follows the navigation version, so added and deleted questions show up at once
+    key = f"quiz:difficulty:{subject_id}:{caching.get_version(navigation.NAMESPACE, subject_id)}"
+    buckets = cache.get(key)
+    if buckets is None:
+        buckets = build_buckets(subject_id)
+        cache.set(key, buckets, timeout=BUCKETS_TIMEOUT)
+    return buckets
+
+
+# ----------------- PLANNING -----------------
+def _stratified(buckets, limit, rng):
+    total = sum(len(bucket) for bucket in buckets)
+    limit = min(limit or total, total)
+    if not total:
+        return []
+    # Largest-remainder allocation, so the sample keeps the bucket proportions
+    quotas = [len(bucket) * limit / total for bucket in buckets]
+    counts = [int(quota) for quota in quotas]
+    by_remainder = sorted(range(len(buckets)), key=lambda level: quotas[level] - counts[level], reverse=True)
+    for level in by_remainder[:limit - sum(counts)]:
+        counts[level] += 1
+    order = []
+    for bucket, count in zip(buckets, counts):
+        order.extend(rng.sample(bucket, count))
+    return order
+
+
+def _pick(state, level):
+    """Take the next question of ``level``, or of the nearest level with any left."""
+    buckets, cursors = state["buckets"], state["cursors"]
+    for candidate in (level, level - 1, level + 1, level - 2, level + 2):
+        if 0 <= candidate < len(buckets) and cursors[candidate] < len(buckets[candidate]):
+            cursors[candidate] += 1
+            return buckets[candidate][cursors[candidate] - 1]
+    return None
+
+
+def plan(subject, seed=None):
+    """The selection fields of a new ``QuizAttempt`` at ``subject``."""
+    subject_id = subject.pk
+    seed = new_seed() if seed is None else seed
+    fields = {
+        "selection_mode": subject.selection_mode,
+        "seed": seed,
+        "shuffle_options": subject.shuffle_options,
+        "question_order": [],
+        "selection_state": {},
+    }
+    rng = random.Random(seed)
+    limit = subject.question_limit or None
+
+    if subject.selection_mode == Subject.SHUFFLED:
+        ids = list(navigation.get_index(subject_id).ids)
+        rng.shuffle(ids)
+        fields["question_order"] = ids[:limit]
+    elif subject.selection_mode == Subject.STRATIFIED:
+        fields["question_order"] = _stratified(difficulty_buckets(subject_id), limit, rng)
+    elif subject.selection_mode == Subject.ADAPTIVE:
+        buckets = [rng.sample(bucket, len(bucket)) for bucket in difficulty_buckets(subject_id)]
+        total = sum(len(bucket) for bucket in buckets)
+        state = {"buckets": buckets, "cursors": [0, 0, 0], "level": MEDIUM, "planned": min(limit or total, total)}
+        first = _pick(state, MEDIUM)
+        fields["question_order"] = [first] if first is not None else []
+        fields["selection_state"] = state
+    return fields
+
+
+def planned_count(question_order, selection_state):
+    """How many questions an attempt that is not ``ordered`` asks."""
+    return selection_state.get("planned", len(question_order))
+
+
+# ----------------- ATTEMPT ORDER -----------------
+class AttemptOrder(navigation.QuestionIndex):
+    """An attempt's questions in the order they are asked.
+
+    ``len()`` is the number of questions planned, which for an adaptive
+    attempt is more than the ones picked so far.
+    """
+
+    def __init__(self, ids, planned, seed, shuffle_options, adaptive=False):
+        super().__init__(enumerate(ids))
+        self.planned = max(planned, len(self.ids))
+        self.seed = seed
+        self.shuffle_options = shuffle_options
+        self.adaptive = adaptive
+        self.follows_subject = False
+
+    @classmethod
+    def following(cls, index, seed, shuffle_options):
+        """The subject's own order; shares ``index``'s lookups instead of copying them."""
+        order = cls.__new__(cls)
+        order.keys, order.ids, order.positions = index.keys, index.ids, index.positions
+        order.planned = len(index.ids)
+        order.seed = seed
+        order.shuffle_options = shuffle_options
+        order.adaptive = False
+        order.follows_subject = True
+        return order
+
+    def __len__(self):
+        return self.planned
+
+    @property
+    def question_ids(self):
+        """The ids to scope results to, or None for the whole subject."""
+        return None if self.follows_subject else self.ids
+
+    def options(self, question):
+        options = question["options"]
+        if not self.shuffle_options:
+            return options
+        # A copy: the list belongs to the cached manifest
+        options = list(options)
+        random.Random(f"{self.seed}:{question['id']}").shuffle(options)
+        return options
+
+
+_ATTEMPT_FIELDS = ("selection_mode", "question_order", "selection_state", "seed", "shuffle_options")
+
+
+def _order_key(attempt_id, subject_id):
+    return f"quiz:attempt-order:{attempt_id}:{caching.get_version(navigation.NAMESPACE, subject_id)}"
+
+
+def _cacheable(row, index):
+    mode, order, state, seed, shuffle_options = row
+    if mode == Subject.ORDERED:
+        # Only the seed: the ids are the subject index's, already cached
+        return seed, shuffle_options
+    ids = [question_id for question_id in order if question_id in index]
+    planned = state.get("planned", len(ids)) if mode == Subject.ADAPTIVE else len(ids)
+    return AttemptOrder(ids, planned, seed, shuffle_options, adaptive=mode == Subject.ADAPTIVE)
+
+
+def _resolve(cached, index):
+    if isinstance(cached, AttemptOrder):
+        return cached
+    seed, shuffle_options = cached
+    return AttemptOrder.following(index, seed, shuffle_options)
+
+
+def get_order(subject_id, attempt_id):
+    """The ``AttemptOrder`` of ``attempt_id`` (the subject's order if None)."""
+    index = navigation.get_index(subject_id)
+    if attempt_id is None:
+        return AttemptOrder.following(index, 0, False)
+    key = _order_key(attempt_id, subject_id)
+    cached = cache.get(key)
+    if cached is None:
+        with setup():
+            row = QuizAttempt.objects.filter(pk=attempt_id).values_list(*_ATTEMPT_FIELDS).first()
+        if row is None:
+            # Deleted since its id was cached; the delete signal forgets the id
+            return AttemptOrder.following(index, 0, False)
+        cached = _cacheable(row, index)
+        cache.set(key, cached, timeout=_timeout())
+    return _resolve(cached, index)
+
+
+async def aget_order(subject_id, attempt_id):
+    index = await navigation.aget_index(subject_id)
+    if attempt_id is None:
+        return AttemptOrder.following(index, 0, False)
+    key = _order_key(attempt_id, subject_id)
+    cached = cache.get(key)
+    if cached is None:
+        with setup():
+            row = await QuizAttempt.objects.filter(pk=attempt_id).values_list(*_ATTEMPT_FIELDS).afirst()
+        if row is None:
+            # Deleted since its id was cached; the delete signal forgets the id
+            return AttemptOrder.following(index, 0, False)
+        cached = _cacheable(row, index)
+        cache.set(key, cached, timeout=_timeout())
+    return _resolve(cached, index)
+
+
+def advance(subject_id, attempt_id, question_id, answered_correctly):
+    """For an adaptive attempt, pick the question after the just finished
+    ``question_id``. Returns the attempt's current order."""
+    with transaction.atomic():
+        attempt = QuizAttempt.objects.select_for_update().filter(pk=attempt_id).first()
+        if attempt is None or attempt.selection_mode != Subject.ADAPTIVE:
+            return get_order(subject_id, attempt_id)
+        order, state = attempt.question_order, attempt.selection_state
+        # Only the newest question moves the attempt on, and only once
+        if order and order[-1] == question_id and len(order) < state["planned"]:
+            state["level"] = min(max(state["level"] + (1 if answered_correctly else -1), EASY), HARD)
+            next_id = _pick(state, state["level"])
+            if next_id is not None:
+                order.append(next_id)
+                attempt.save(update_fields=["question_order", "selection_state"])
+
+    index = navigation.get_index(subject_id)
+    current = _cacheable(tuple(getattr(attempt, name) for name in _ATTEMPT_FIELDS), index)
+    key = _order_key(attempt_id, subject_id)
+    transaction.on_commit(lambda: cache.set(key, current, timeout=_timeout()))
+    return current
@@ -0,0 +1,162 @@
+# serving.py
+"""Serve static and media files from Django with proper HTTP caching.
+
+Used when ``QUIZ_SERVE_ASSETS`` is on, so a deployment without a CDN or a
+front-end web server still gets:
+
+* ``ETag``/``Last-Modified`` validators and 304 responses,
+* single ``Range`` requests (206/416), for clients resuming downloads,
+* far-future ``immutable`` caching for names that change with their
+  content: manifest-hashed static files and content-hashed media,
+* the ``.br``/``.gz`` copies written by ``collectstatic`` for clients that
+  accept them.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from .storage import COMPRESSIBLE_EXTENSIONS, quiz_media_storage
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, max-age=0, must-revalidate"
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_HASHED = re.compile(r"^[0-9a-f]{64}$")
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+_hashed_static = None
+
+
+def _path(storage, name):
+    try:
+        return storage.path(name)
+    except SuspiciousFileOperation:
+        raise Http404("Invalid path")
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        raise Http404("File not found")
+    if not os.path.isfile(path):
+        raise Http404("File not found")
+    return stat
+
+
+def _encoded_variant(request, path):
+    accepted = request.headers.get("Accept-Encoding", "")
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.isfile(path + suffix):
+            return encoding, path + suffix
+    return None, path
+
+
+def _byte_range(header, size):
+    """Return ``(start, end)`` (inclusive) for a single range, None to ignore it, or False if unsatisfiable."""
+    match = RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if not length:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(fh, start, length):
+    try:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        fh.close()
+
+
+def serve_file(request, storage, name, immutable=False, precompressed=False):
+    path = _path(storage, name)
+    encoding = None
+    if precompressed and not request.headers.get("Range"):
+        encoding, path = _encoded_variant(request, path)
+    stat = _stat(path)
+
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{"-" + encoding if encoding else ""}"'
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        byte_range = None
+        if request.headers.get("Range") and request.headers.get("If-Range", etag) == etag:
+            byte_range = _byte_range(request.headers["Range"], stat.st_size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{stat.st_size}"
+        elif byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                _read_range(open(path, "rb"), start, end - start + 1), status=206, content_type=content_type
+            )
+            response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            response["Content-Length"] = str(end - start + 1)
+        else:
+            response = FileResponse(
+                open(path, "rb"), content_type=content_type, filename=posixpath.basename(name)
+            )
+            if encoding:
+                response["Content-Encoding"] = encoding
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Accept-Ranges"] = "bytes"
+    response["Cache-Control"] = IMMUTABLE if immutable else REVALIDATE
+    if precompressed:
+        patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
+def _is_hashed_static(name):
+    global _hashed_static
+    if _hashed_static is None:
+        _hashed_static = frozenset(getattr(staticfiles_storage, "hashed_files", {}).values())
+    return name in _hashed_static
+
+
+def _is_hashed_media(name):
+    return bool(CONTENT_HASHED.match(posixpath.splitext(posixpath.basename(name))[0]))
+
+
+@require_safe
+def static_file(request, path):
+    return serve_file(
+        request, staticfiles_storage, path,
+        immutable=_is_hashed_static(path),
+        precompressed=path.endswith(COMPRESSIBLE_EXTENSIONS),
+    )
+
+
+@require_safe
+def media_file(request, path):
+    return serve_file(request, quiz_media_storage(), path, immutable=_is_hashed_media(path))
+
@@ -0,0 +1,261 @@
+# session.py
+"""JSON quiz-session API used by the prefetching client in ``static/js/quiz.js``.
+
+``question_batch`` serves a window of upcoming questions straight from the
+cached manifest, without anything that gives the answer away
+(``is_correct``, explanations), so the client can prefetch them and their
+images. ``grade_answers`` grades a batch of queued answers: each one is
+checked against the manifest, and the user's progress rows are locked,
+updated and written back in one transaction with the same rules as the
+question page (``MAX_ATTEMPTS``; the correct answer and explanation are only
+revealed once the attempts are used up). Once a timed exam is over, answers
+come back ``expired``.
+
+Every answer carries a client-generated ``client_id``. Graded results are
+kept in the cache for ``REPLAY_TIMEOUT`` seconds under the user, attempt
+and ``client_id``, so a batch that is sent again after a lost response is
+answered from there instead of counting twice.
+"""
+import json
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import attempts, exams, selection
+from .models import UserProgress
+from .recording import apply_answer, record_answers
+from .scoring import MAX_ATTEMPTS
+
+DEFAULT_BATCH_QUESTIONS = 5
+MAX_BATCH_QUESTIONS = 20
+MAX_BATCH_ANSWERS = 100
+REPLAY_TIMEOUT = 60 * 60 * 24
+
+CORRECT = "correct"
+INCORRECT = "incorrect"
+CLOSED = "closed"
+INVALID = "invalid"
+EXPIRED = "expired"
+
+
+class InvalidRequest(ValueError):
+    """A malformed session API request; the message is safe to show to the client."""
+
+
+# ----------------- QUESTIONS -----------------
+def _int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidRequest(f"'{name}' must be an integer.")
+
+
+def window(index, start=None, count=None):
+    """The question ids from ``start`` (inclusive, default the first question) on."""
+    count = DEFAULT_BATCH_QUESTIONS if count in (None, "") else _int(count, "count")
+    count = max(1, min(count, MAX_BATCH_QUESTIONS))
+    if start in (None, ""):
+        offset = 0
+    else:
+        start = _int(start, "start")
+        if start not in index:
+            raise InvalidRequest("'start' is not a question of this subject.")
+        offset = index.position(start) - 1
+    return index.ids[offset:offset + count]
+
+
+def _progress_rows(user, question_ids):
+    return UserProgress.objects.filter(user=user, question_id__in=question_ids).values(
+        "question_id", "attempts", "answered_correctly", "hint_used", "selected_option_id",
+    )
+
+
+def progress_for(user, question_ids):
+    return {row["question_id"]: row for row in _progress_rows(user, question_ids)}
+
+
+async def aprogress_for(user, question_ids):
+    return {row["question_id"]: row async for row in _progress_rows(user, question_ids)}
+
+
+def _finished(attempts, answered_correctly):
+    return bool(answered_correctly) or attempts >= MAX_ATTEMPTS
+
+
+def _public_question(question, index, progress):
+    attempts = progress.get("attempts", 0)
+    answered_correctly = progress.get("answered_correctly", False)
+    return {
+        "id": question["id"],
+        "position": index.position(question["id"]),
+        "previous_id": index.previous_id(question["id"]),
+        "next_id": index.next_id(question["id"]),
+        "question_type": question["question_type"],
+        "text_content": question["text_content"],
+        "image": question["image"],
+        "hint": question["hint"],
+        "options": [
+            {"id": option["id"], "text_content": option["text_content"], "image": option["image"]}
+            for option in index.options(question)
+        ],
+        "progress": {
+            "attempts": attempts,
+            "hint_used": progress.get("hint_used", False),
+            "selected_option_id": progress.get("selected_option_id"),
+            "finished": _finished(attempts, answered_correctly),
+        },
+    }
+
+
+def question_batch(manifest, index, question_ids, progress):
+    questions = manifest["questions"]
+    next_start = index.next_id(question_ids[-1]) if question_ids else None
+    return {
+        "subject": {"id": manifest["subject"]["id"], "name": manifest["subject"]["name"]},
+        "total_questions": len(index),
+        "max_attempts": MAX_ATTEMPTS,
+        "questions": [_public_question(questions[qid], index, progress.get(qid, {})) for qid in question_ids],
+        "next_start": next_start,
+    }
+
+
+# ----------------- ANSWERS -----------------
+def parse_answers(body):
+    """Decode a ``{"answers": [...]}`` request body and validate its shape.
+
+    Whether the questions and options exist is checked while grading.
+    """
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise InvalidRequest("Request body must be JSON.")
+    answers = payload.get("answers") if isinstance(payload, dict) else None
+    if not isinstance(answers, list) or not answers:
+        raise InvalidRequest("Expected a non-empty 'answers' list.")
+    if len(answers) > MAX_BATCH_ANSWERS:
+        raise InvalidRequest(f"At most {MAX_BATCH_ANSWERS} answers per batch.")
+
+    parsed = []
+    for answer in answers:
+        if not isinstance(answer, dict):
+            raise InvalidRequest("Every answer must be an object.")
+        client_id = answer.get("client_id")
+        if not isinstance(client_id, str) or not 0 < len(client_id) <= 64:
+            raise InvalidRequest("Every answer needs a 'client_id' string of up to 64 characters.")
+        parsed.append({
+            "client_id": client_id,
+            "question_id": _int(answer.get("question_id"), "question_id"),
+            "option_id": _int(answer.get("option_id"), "option_id"),
+            "hint_used": bool(answer.get("hint_used", False)),
+        })
+    return parsed
+
+
+def _replay_key(user_id, attempt_id, client_id):
+    return f"quiz:answer:{user_id}:{attempt_id}:{client_id}"
+
+
+def _reveal(question):
+    correct_option = next((opt for opt in question["options"] if opt["is_correct"]), None)
+    explanation = question["explanation"]
+    return {
+        "correct_option_id": correct_option["id"] if correct_option else None,
+        "explanation": explanation["text_content"] if explanation else None,
+    }
+
+
+def _grade(answer, question, progress, now):
+    """Grade one answer against locked ``progress``; returns ``(result, submission or None)``."""
+    result = {"client_id": answer["client_id"], "question_id": answer["question_id"]}
+    if question is None:
+        return dict(result, status=INVALID, error="Unknown question."), None
+    option = next((opt for opt in question["options"] if opt["id"] == answer["option_id"]), None)
+    if option is None:
+        return dict(result, status=INVALID, error="Unknown option."), None
+
+    submission = None
+    if _finished(progress.attempts, progress.answered_correctly):
+        status = CLOSED
+    else:
+        submission = apply_answer(progress, option["id"], option["is_correct"], now, answer["hint_used"])
+        status = CORRECT if option["is_correct"] else INCORRECT
+
+    finished = _finished(progress.attempts, progress.answered_correctly)
+    result.update(
+        status=status,
+        attempts=progress.attempts,
+        attempts_left=max(MAX_ATTEMPTS - progress.attempts, 0) if not progress.answered_correctly else 0,
+        finished=finished,
+    )
+    if finished and not progress.answered_correctly:
+        result.update(_reveal(question))
+    return result, submission
+
+
+def grade_answers(user, subject_id, manifest, answers):
+    """Grade ``answers`` (from ``parse_answers``) in order and return one result per answer."""
+    attempt_id = attempts.active_attempt_id(user, subject_id)
+    keys = {answer["client_id"]: _replay_key(user.pk, attempt_id, answer["client_id"]) for answer in answers}
+    results = {}
+    cached = cache.get_many(list(keys.values()))
+    for client_id, key in keys.items():
+        if key in cached:
+            results[client_id] = cached[key]
+
+    fresh = [answer for answer in answers if answer["client_id"] not in results]
+    if fresh and exams.status(attempt_id)["expired"]:
+        # ⏰ The exam is over; nothing is graded or kept for replay
+        for answer in fresh:
+            results[answer["client_id"]] = {
+                "client_id": answer["client_id"], "question_id": answer["question_id"], "status": EXPIRED,
+            }
+    elif fresh:
+        order = selection.get_order(subject_id, attempt_id)
+        # Questions outside the attempt's selection count as unknown
+        questions = {
+            answer["question_id"]: manifest["questions"][answer["question_id"]]
+            for answer in fresh if answer["question_id"] in manifest["questions"] and answer["question_id"] in order
+        }
+        question_ids = set(questions)
+        with transaction.atomic():
+            UserProgress.objects.bulk_create(
+                [
+                    UserProgress(user=user, subject_id=subject_id, question_id=qid, attempt_id=attempt_id)
+                    for qid in question_ids
+                ],
+                ignore_conflicts=True,
+            )
+            rows = {
+                row.question_id: row
+                for row in UserProgress.objects.select_for_update().filter(user=user, question_id__in=question_ids)
+            }
+
+            now = timezone.now()
+            submissions, changed = [], {}
+            for answer in fresh:
+                if answer["client_id"] in results:
+                    continue  # the same client_id twice in one batch
+                result, submission = _grade(
+                    answer, questions.get(answer["question_id"]), rows.get(answer["question_id"]), now
+                )
+                results[answer["client_id"]] = result
+                if submission is not None:
+                    submissions.append(submission)
+                    changed[answer["question_id"]] = rows[answer["question_id"]]
+
+            if submissions:
+                record_answers(list(changed.values()), submissions)
+
+        if order.adaptive:
+            for answer in fresh:
+                result = results[answer["client_id"]]
+                if result["status"] in (CORRECT, INCORRECT) and result["finished"]:
+                    selection.advance(subject_id, attempt_id, answer["question_id"], result["status"] == CORRECT)
+
+        cache.set_many(
+            {keys[answer["client_id"]]: results[answer["client_id"]] for answer in fresh},
+            timeout=REPLAY_TIMEOUT,
+        )
+
+    return [results[answer["client_id"]] for answer in answers]
@@ -0,0 +1,137 @@
+# signals.py
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import attempts, catalogue, images, manifest, mediafiles, navigation, search
+from .models import Subject, Question, Option, Explanation, QuizAttempt
+
+
+def _subject_id_for(instance):
+    # Options and explanations reach their subject through the question. During
+    # a cascading delete the question row may already be gone; its own
+    # post_delete takes care of the invalidation then.
+    try:
+        return instance.question.subject_id
+    except Question.DoesNotExist:
+        return None
+
+
+@receiver(pre_save, sender=Subject)
+@receiver(pre_save, sender=Question)
+@receiver(pre_save, sender=Option)
+@receiver(pre_save, sender=Explanation)
+def remember_previous_values(sender, instance, **kwargs):
+    # The stored image (for reference counting) and, for questions, the subject
+    # and order (to know whether the subjects' navigation indexes changed), as
+    # they were loaded. Only an instance built by hand for an existing row
+    # has to read them.
+    fields = sender.remembered_fields
+    if instance._state.adding:
+        previous = {}
+    elif hasattr(instance, "_loaded") and all(name in instance._loaded for name in fields):
+        previous = instance._loaded
+    else:
+        previous = sender.objects.filter(pk=instance.pk).values(*fields).first() or {}
+    instance._previous = previous
+    # What this save writes is what the next save of the instance compares to
+    instance._loaded = {name: _raw(instance, name) for name in fields}
+
+
+def _raw(instance, name):
+    value = getattr(instance, name)
+    return value.name if hasattr(value, "name") and hasattr(value, "storage") else value
+
+
+# ----------------- CACHE INVALIDATION -----------------
+@receiver([post_save, post_delete], sender=Subject)
+def subject_changed(sender, instance, **kwargs):
+    manifest.invalidate(instance.pk)
+    catalogue.invalidate()
+
+
+@receiver(post_save, sender=Question)
+def question_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous", {})
+    manifest.invalidate(instance.subject_id)
+    # Text edits leave the order alone, and with it the index
+    if created or previous.get("order") != instance.order or previous.get("subject_id") != instance.subject_id:
+        navigation.invalidate(instance.subject_id)
+    if created:
+        catalogue.invalidate()
+
+    previous_subject_id = previous.get("subject_id")
+    if previous_subject_id and previous_subject_id != instance.subject_id:
+        manifest.invalidate(previous_subject_id)
+        navigation.invalidate(previous_subject_id)
+        catalogue.invalidate()
+
+
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    manifest.invalidate(instance.subject_id)
+    navigation.invalidate(instance.subject_id)
+    catalogue.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Option)
+@receiver([post_save, post_delete], sender=Explanation)
+def question_content_changed(sender, instance, **kwargs):
+    subject_id = _subject_id_for(instance)
+    if subject_id is not None:
+        manifest.invalidate(subject_id)
+
+
+@receiver(post_delete, sender=QuizAttempt)
+def attempt_deleted(sender, instance, **kwargs):
+    # Its id may still be cached as the user's active attempt
+    attempts.forget(instance.user_id, instance.subject_id)
+
+
+# ----------------- SEARCH INDEX -----------------
+@receiver([post_save, post_delete], sender=Question)
+def question_search_changed(sender, instance, **kwargs):
+    search.schedule([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Option)
+@receiver([post_save, post_delete], sender=Explanation)
+def question_content_search_changed(sender, instance, **kwargs):
+    # The question's own post_delete drops it from the index if it's gone
+    search.schedule([instance.question_id])
+
+
+# ----------------- IMAGE FILES -----------------
+def _image_subject_id(instance):
+    if isinstance(instance, Subject):
+        return instance.pk
+    if isinstance(instance, Question):
+        return instance.subject_id
+    return _subject_id_for(instance)
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=Option)
+@receiver(post_save, sender=Explanation)
+def image_saved(sender, instance, **kwargs):
+    field_name = mediafiles.image_field_name(sender)
+    field_file = getattr(instance, field_name)
+    previous = getattr(instance, "_previous", {}).get(field_name) or ""
+    if (field_file.name or "") == previous:
+        return
+
+    # The upload this save wrote, if the field was given one
+    mediafiles.acquire(field_file.name, getattr(field_file, "_file", None), field_file.storage)
+    mediafiles.release(previous, field_file.storage)
+
+    if field_file:
+        images.schedule(field_file.name, _image_subject_id(instance))
+
+
+@receiver(post_delete, sender=Subject)
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=Option)
+@receiver(post_delete, sender=Explanation)
+def image_deleted(sender, instance, **kwargs):
+    field_file = getattr(instance, mediafiles.image_field_name(sender))
+    mediafiles.release(field_file.name, field_file.storage)
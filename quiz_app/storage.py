@@ -0,0 +1,104 @@
+# storage.py
+"""Storage backends.
+
+``ContentHashStorage`` is the content-addressed storage for quiz images.
+Files are stored as ``<upload_to>/<sha256><ext>``. Uploading bytes that are
+already stored returns the existing name instead of writing a renamed
+copy, so identical uploads share one file. Because several rows can then
+point at the same file, deletions go through the reference counts kept in
+``mediafiles.py`` rather than deleting files directly.
+
+``CompressedManifestStaticFilesStorage`` is the static files storage used
+when ``QUIZ_SERVE_ASSETS`` is on: fingerprinted names from the manifest,
+plus ``.gz`` (and ``.br`` when the ``brotli`` package is installed) copies
+written by ``collectstatic`` for ``serving.py`` to hand out.
+"""
+import gzip
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".map", ".svg", ".json", ".txt", ".html", ".xml")
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    if hasattr(content, "seek"):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, "seek"):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def hashed_name(name, digest):
+    directory, filename = posixpath.split(name)
+    extension = posixpath.splitext(filename)[1].lower()
+    return posixpath.join(directory, f"{digest}{extension}")
+
+
+class ContentHashStorage(FileSystemStorage):
+    def _save(self, name, content):
+        target = hashed_name(name, content_hash(content))
+        if self.exists(target):
+            return target
+        # Written under a unique name, then hard linked into place. The link
+        # fails if another save of the same bytes got there first, and readers
+        # never see a half-written file.
+        staging = super()._save(posixpath.join(posixpath.dirname(target), f".{uuid.uuid4().hex}.tmp"), content)
+        try:
+            os.link(self.path(staging), self.path(target))
+        except FileExistsError:
+            pass
+        finally:
+            self.delete(staging)
+        return target
+
+
+_storage = None
+
+
+def quiz_media_storage():
+    """Storage callable for the quiz ImageFields (keeps migrations settings-free)."""
+    global _storage
+    if _storage is None:
+        _storage = ContentHashStorage()
+    return _storage
+
+
+def compressed_variants(data):
+    """Yield ``(suffix, bytes)`` for each encoding that actually makes ``data`` smaller."""
+    encoders = [(".gz", lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        encoders.insert(0, (".br", lambda raw: brotli.compress(raw, quality=11)))
+    for suffix, encode in encoders:
+        encoded = encode(data)
+        if len(encoded) < len(data) * 0.95:
+            yield suffix, encoded
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for name in self.hashed_files.values():
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            with self.open(name) as fh:
+                data = fh.read()
+            for suffix, encoded in compressed_variants(data):
+                # Hashed names never change content, so an existing variant is current
+                if not self.exists(name + suffix):
+                    self._save(name + suffix, ContentFile(encoded))
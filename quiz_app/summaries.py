@@ -0,0 +1,205 @@
+# summaries.py
+"""Per-user, per-subject progress summaries.
+
+``UserSubjectSummary`` holds what a dashboard needs for one learner and one
+subject (questions answered, correct and finished, hints used, last
+activity), so "my progress" is a single indexed lookup instead of a GROUP BY
+over the learner's ``UserProgress`` rows.
+
+``recording`` keeps it current: every answer carries a ``SummaryDelta``
+taken from the progress row before the answer, and :func:`apply` adds the
+deltas in the same transaction that writes the progress rows.
+:func:`rebuild` recomputes summaries from ``UserProgress`` in chunks of
+users, for backfilling and for rows changed outside the quiz (deleted
+questions, progress edited by hand); see ``rebuild_progress_summaries``.
+"""
+from collections import Counter, defaultdict, namedtuple
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Greatest
+
+from .db import read_from_replica
+from .instrumentation import setup
+from .models import QuizAttempt, Subject, UserProgress, UserSubjectSummary
+from .selection import planned_count
+from .scoring import MAX_ATTEMPTS
+
+COUNTERS = ("answered", "correct", "finished", "hints_used")
+
+SummaryDelta = namedtuple("SummaryDelta", ["user_id", "subject_id", "answered", "correct", "finished", "hints_used"])
+
+
+def _finished(attempts, answered_correctly):
+    return bool(answered_correctly) or attempts >= MAX_ATTEMPTS
+
+
+def answer_delta(progress, is_correct, hint_used):
+    """The summary change of one answer, from ``progress`` as it was *before* the answer."""
+    attempts = progress.attempts + 1
+    return SummaryDelta(
+        user_id=progress.user_id,
+        subject_id=progress.subject_id,
+        answered=int(progress.attempts == 0),
+        # Signed, so a delta computed against a stale row still nets out
+        correct=int(is_correct) - int(progress.answered_correctly),
+        finished=int(_finished(attempts, is_correct)) - int(_finished(progress.attempts, progress.answered_correctly)),
+        hints_used=int(hint_used and not progress.hint_used),
+    )
+
+
+# ----------------- INCREMENTAL -----------------
+def _increment(name, value):
+    # Clamped, so a decrement on a summary that was never backfilled can't go negative
+    return Greatest(F(name) + value, 0) if value < 0 else F(name) + value
+
+
+def apply(deltas, now):
+    """Add ``deltas`` to the summaries. Call it inside the transaction that
+    writes the matching progress rows."""
+    totals = defaultdict(Counter)
+    for delta in deltas:
+        if delta.user_id is None:
+            continue
+        counters = totals[delta.user_id, delta.subject_id]
+        for name in COUNTERS:
+            counters[name] += getattr(delta, name)
+
+    for (user_id, subject_id), counters in totals.items():
+        summary = UserSubjectSummary.objects.filter(user_id=user_id, subject_id=subject_id)
+        update = {name: _increment(name, value) for name, value in counters.items() if value}
+        # The row exists for every answer but a user's first in a subject
+        if not summary.update(last_activity=now, **update):
+            with setup():
+                UserSubjectSummary.objects.bulk_create(
+                    [UserSubjectSummary(user_id=user_id, subject_id=subject_id)], ignore_conflicts=True,
+                )
+                summary.update(last_activity=now, **update)
+
+
+def reset(user_id, subject_id, now):
+    """Start ``user_id``'s summary for ``subject_id`` over, for a new attempt."""
+    UserSubjectSummary.objects.filter(user_id=user_id, subject_id=subject_id).update(
+        last_activity=now, **{name: 0 for name in COUNTERS}
+    )
+
+
+# ----------------- REBUILD -----------------
+def _aggregated(user_ids):
+    return UserProgress.objects.filter(user_id__in=user_ids, attempts__gt=0).values("user_id", "subject_id").annotate(
+        answered=Count("id"),
+        correct=Count("id", filter=Q(answered_correctly=True)),
+        finished=Count("id", filter=Q(answered_correctly=True) | Q(attempts__gte=MAX_ATTEMPTS)),
+        hints_used=Count("id", filter=Q(hint_used=True)),
+        last_activity=Max("updated_at"),
+    ).order_by()
+
+
+def _save_chunk(user_ids, rows):
+    summaries = [UserSubjectSummary(**row) for row in rows]
+    keep = {(row["user_id"], row["subject_id"]) for row in rows}
+    with transaction.atomic():
+        stale = [
+            pk for pk, user_id, subject_id in UserSubjectSummary.objects.filter(user_id__in=user_ids).values_list(
+                "pk", "user_id", "subject_id"
+            )
+            if (user_id, subject_id) not in keep
+        ]
+        if stale:
+            UserSubjectSummary.objects.filter(pk__in=stale).delete()
+        UserSubjectSummary.objects.bulk_create(
+            summaries, update_conflicts=True, unique_fields=["user", "subject"],
+            update_fields=[*COUNTERS, "last_activity"],
+        )
+
+
+def rebuild(users=None, chunk_size=500, progress=None):
+    """Recompute the summaries of ``users`` (default: everyone) from
+    ``UserProgress``. One aggregate query and one upsert per ``chunk_size`` users."""
+    users = User.objects.all() if users is None else users
+    ids = users.order_by("pk").values_list("pk", flat=True)
+    done = 0
+    last_id = 0
+    while True:
+        user_ids = list(ids.filter(pk__gt=last_id)[:chunk_size])
+        if not user_ids:
+            break
+        _save_chunk(user_ids, list(_aggregated(user_ids)))
+        last_id = user_ids[-1]
+        done += len(user_ids)
+        if progress:
+            progress(done)
+    return done
+
+
+# ----------------- DASHBOARD -----------------
+def _summary_rows(user):
+    # Ordered attempts ask the whole subject, which the catalogue already counts
+    selected = QuizAttempt.objects.filter(
+        user=OuterRef("user"), subject=OuterRef("subject"), archived_at__isnull=True,
+    ).exclude(selection_mode=Subject.ORDERED)
+    return UserSubjectSummary.objects.filter(user=user).values("subject_id", *COUNTERS, "last_activity").annotate(
+        question_order=Subquery(selected.values("question_order")[:1]),
+        selection_state=Subquery(selected.values("selection_state")[:1]),
+    )
+
+
+def _with_question_count(row):
+    question_order, selection_state = row.pop("question_order"), row.pop("selection_state")
+    if question_order is not None:
+        row["question_count"] = planned_count(question_order, selection_state)
+    return row
+
+
+def for_user(user):
+    """Return ``{subject_id: summary row}`` for ``user``, from the replica if
+    there is one (nothing caches these rows). A subject whose active attempt
+    asks only some of its questions also gets that attempt's ``question_count``."""
+    with read_from_replica():
+        return {row["subject_id"]: _with_question_count(row) for row in _summary_rows(user)}
+
+
+async def afor_user(user):
+    with read_from_replica():
+        return {row["subject_id"]: _with_question_count(row) async for row in _summary_rows(user)}
+
+
+def _percentage(count, total):
+    return int(count * 100 / total) if total else 0
+
+
+def dashboard(subjects, summaries):
+    """Combine the catalogue's ``subjects`` with a user's ``summaries``.
+
+    Subjects the user worked on come first, most recent first.
+    """
+    entries = []
+    totals = Counter()
+    for subject in subjects:
+        row = summaries.get(subject["id"], {})
+        # The questions of the learner's attempt, as on the results page
+        total = row.get("question_count", subject["question_count"])
+        entry = {
+            "id": subject["id"],
+            "name": subject["name"],
+            "question_count": total,
+            **{name: row.get(name, 0) for name in COUNTERS},
+            "last_activity": row.get("last_activity"),
+        }
+        entry["completion"] = _percentage(entry["finished"], total)
+        entry["score_percentage"] = _percentage(entry["correct"], total)
+        entries.append(entry)
+        totals.update({name: entry[name] for name in COUNTERS}, question_count=total)
+
+    started = sorted((e for e in entries if e["last_activity"]), key=lambda e: e["last_activity"], reverse=True)
+    return {
+        "subjects": started + [e for e in entries if not e["last_activity"]],
+        "subjects_started": len(started),
+        "totals": {
+            **{name: totals[name] for name in COUNTERS},
+            "question_count": totals["question_count"],
+            "completion": _percentage(totals["finished"], totals["question_count"]),
+            "score_percentage": _percentage(totals["correct"], totals["question_count"]),
+        },
+    }
@@ -0,0 +1,308 @@
+# tasks.py
+"""A small background task queue on the ``Job`` table.
+
+Work that is too slow for a request (image derivatives, question bank
+imports, stats rollups) is registered as a task and enqueued as a ``Job``
+row. The ``run_tasks`` command runs them on a thread pool. There is no
+broker: the database is the queue, so a single box needs nothing else.
+
+* Enqueueing inside a transaction commits the job with the change that
+  caused it, or not at all.
+* Workers claim due jobs highest ``priority`` first. Claiming is a
+  conditional UPDATE (or ``SELECT ... FOR UPDATE SKIP LOCKED`` where the
+  database has it), so several workers never run the same job.
+* A job that raises is retried with exponential backoff and jitter until
+  it has had ``max_attempts``; ``PermanentFailure`` fails it at once.
+* An ``idempotency_key`` makes enqueueing the same work twice return the
+  first job, unless that job failed: then it gives up the key and the work
+  is queued again. Finished jobs are kept for ``RETENTION`` seconds.
+* A job whose worker died is handed out again once it has been running
+  for ``LOCK_TIMEOUT`` seconds.
+
+``MODE`` defaults to ``'inline'``: jobs still get their row, but run in the
+enqueueing thread as soon as the transaction commits, so nothing is left
+waiting for a worker that was never started. Deployments set it to
+``'queue'`` and run ``run_tasks``.
+"""
+import hashlib
+import logging
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+HIGH = 10
+NORMAL = 0
+LOW = -10
+
+DEFAULTS = {
+    # 'inline': jobs run on commit; 'queue': they wait for a run_tasks worker
+    "MODE": "inline",
+    # Threads per worker process
+    "WORKERS": 4,
+    # Seconds an idle worker waits before looking for due jobs again
+    "POLL_INTERVAL": 1.0,
+    "MAX_ATTEMPTS": 5,
+    # Retry n waits about BACKOFF_BASE * 2**(n - 1) seconds, at most BACKOFF_MAX
+    "BACKOFF_BASE": 10,
+    "BACKOFF_MAX": 60 * 60,
+    # A job running longer than this is assumed dead and handed out again
+    "LOCK_TIMEOUT": 60 * 30,
+    # Finished jobs are deleted after this many seconds
+    "RETENTION": 60 * 60 * 24 * 7,
+    # Where uploads wait for the job that reads them (never served)
+    "FILE_DIR": os.path.join(tempfile.gettempdir(), "quiz-tasks"),
+}
+# How often a worker requeues dead jobs and prunes old ones
+SWEEP_INTERVAL = 60
+ERROR_LENGTH = 4000
+
+Task = namedtuple("Task", ["func", "priority", "max_attempts"])
+
+_registry = {}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "QUIZ_TASKS", {})}
+
+
+class PermanentFailure(Exception):
+    """Raised by a task to fail its job without retrying."""
+
+
+# ----------------- REGISTRY -----------------
+def task(name, priority=NORMAL, max_attempts=None):
+    """Register the decorated function as the task ``name``.
+
+    Jobs store only the name and JSON keyword arguments, so callers enqueue
+    by name and need not import the function.
+    """
+    def decorator(func):
+        _registry[name] = Task(func, priority, max_attempts)
+        return func
+    return decorator
+
+
+def get_task(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise LookupError(f"No task named {name!r}") from None
+
+
+# ----------------- ENQUEUE -----------------
+def enqueue(name, kwargs=None, priority=None, key=None, delay=0):
+    """Queue the task ``name`` with ``kwargs`` and return its ``Job``.
+
+    If a job with idempotency ``key`` exists already, that job is returned
+    and nothing is added. A failed job keeps its row for inspection but
+    hands its key to the new job.
+    """
+    spec = get_task(name)
+    if key is not None:
+        existing = Job.objects.filter(idempotency_key=key).first()
+        if existing is not None and existing.status != Job.FAILED:
+            return existing
+        if existing is not None:
+            Job.objects.filter(pk=existing.pk, status=Job.FAILED).update(idempotency_key=None)
+    try:
+        with transaction.atomic():
+            job = Job.objects.create(
+                name=name,
+                payload=kwargs or {},
+                priority=spec.priority if priority is None else priority,
+                idempotency_key=key,
+                max_attempts=spec.max_attempts or get_config()["MAX_ATTEMPTS"],
+                run_at=timezone.now() + timedelta(seconds=delay),
+            )
+    except IntegrityError:
+        if key is None:
+            raise
+        # Another request enqueued the same key in the meantime
+        return Job.objects.get(idempotency_key=key)
+    if get_config()["MODE"] == "inline":
+        transaction.on_commit(lambda: run_inline(job.pk))
+    return job
+
+
+def stash(upload):
+    """Copy ``upload`` to ``FILE_DIR`` for a job to read. Returns ``(path, sha256)``.
+
+    The job deletes the file when it is done with it.
+    """
+    directory = get_config()["FILE_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, uuid.uuid4().hex + os.path.splitext(upload.name)[1].lower())
+    digest = hashlib.sha256()
+    with open(path, "wb") as fh:
+        for chunk in upload.chunks():
+            digest.update(chunk)
+            fh.write(chunk)
+    return path, digest.hexdigest()
+
+
+# ----------------- CLAIM & RUN -----------------
+def _due(now):
+    return Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by("-priority", "run_at", "id")
+
+
+def _claimed(worker, now):
+    return {"status": Job.RUNNING, "locked_by": worker, "locked_at": now, "attempts": F("attempts") + 1}
+
+
+def claim(worker, limit, now=None):
+    """Mark up to ``limit`` due jobs as running by ``worker`` and return them."""
+    now = now or timezone.now()
+    claimed = _claimed(worker, now)
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(_due(now).select_for_update(skip_locked=True).values_list("pk", flat=True)[:limit])
+            Job.objects.filter(pk__in=ids).update(**claimed)
+    else:
+        # A candidate another worker took first matches no row and is skipped
+        ids = []
+        for pk in _due(now).values_list("pk", flat=True)[:limit * 2]:
+            if Job.objects.filter(pk=pk, status=Job.QUEUED).update(**claimed):
+                ids.append(pk)
+                if len(ids) == limit:
+                    break
+    return list(Job.objects.filter(pk__in=ids).order_by("-priority", "run_at", "id"))
+
+
+def backoff(attempts):
+    """Seconds to wait before retry number ``attempts``, with jitter."""
+    config = get_config()
+    delay = min(config["BACKOFF_BASE"] * 2 ** (attempts - 1), config["BACKOFF_MAX"])
+    return random.uniform(delay / 2, delay)
+
+
+def _failed(job, error, permanent):
+    now = timezone.now()
+    update = {"locked_by": "", "locked_at": None, "last_error": error[-ERROR_LENGTH:]}
+    if permanent or job.attempts >= job.max_attempts:
+        update.update(status=Job.FAILED, finished_at=now)
+    else:
+        update.update(status=Job.QUEUED, run_at=now + timedelta(seconds=backoff(job.attempts)))
+    Job.objects.filter(pk=job.pk).update(**update)
+    return update["status"]
+
+
+def run_job(job):
+    """Run a claimed ``job`` and record how it went. Returns its new status."""
+    spec = _registry.get(job.name)
+    if spec is None:
+        logger.error("Job %s: no task named %r", job.pk, job.name)
+        return _failed(job, f"No task named {job.name!r}", permanent=True)
+    close_old_connections()
+    try:
+        try:
+            result = spec.func(**job.payload)
+        except Exception as exc:
+            logger.exception("Job %s (%s) failed on attempt %d", job.pk, job.name, job.attempts)
+            return _failed(job, traceback.format_exc(), permanent=isinstance(exc, PermanentFailure))
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.DONE, finished_at=timezone.now(), locked_by="", locked_at=None, result=result,
+            last_error="",
+        )
+        return Job.DONE
+    finally:
+        close_old_connections()
+
+
+def run_inline(job_id):
+    if Job.objects.filter(pk=job_id, status=Job.QUEUED).update(**_claimed("inline", timezone.now())):
+        run_job(Job.objects.get(pk=job_id))
+
+
+def sweep(now=None):
+    """Requeue jobs whose worker died and delete finished jobs past ``RETENTION``."""
+    now = now or timezone.now()
+    config = get_config()
+    stale = Job.objects.filter(
+        status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=config["LOCK_TIMEOUT"])
+    )
+    unlocked = {"locked_by": "", "locked_at": None, "last_error": "Worker stopped while running the job."}
+    stale.filter(attempts__gte=F("max_attempts")).update(status=Job.FAILED, finished_at=now, **unlocked)
+    requeued = stale.update(status=Job.QUEUED, run_at=now, **unlocked)
+    Job.objects.filter(
+        status__in=[Job.DONE, Job.FAILED], finished_at__lt=now - timedelta(seconds=config["RETENTION"])
+    ).delete()
+    return requeued
+
+
+def retry(jobs):
+    """Queue finished or failed ``jobs`` (a queryset) to run again now."""
+    return jobs.exclude(status=Job.RUNNING).update(
+        status=Job.QUEUED, run_at=timezone.now(), attempts=0, finished_at=None, last_error="",
+    )
+
+
+# ----------------- WORKER -----------------
+class Worker:
+    """Runs due jobs on a pool of ``workers`` threads until ``stop()``."""
+
+    def __init__(self, workers=None, poll_interval=None, name=None):
+        config = get_config()
+        self.workers = workers or config["WORKERS"]
+        self.poll_interval = config["POLL_INTERVAL"] if poll_interval is None else poll_interval
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = threading.Event()
+
+    def stop(self):
+        """Take no more jobs; the ones running are finished first."""
+        self._stopping.set()
+
+    def run(self, burst=False, progress=None):
+        """Run jobs; with ``burst``, return once none are due. Returns how many ran.
+
+        ``progress(job, status)`` is called as each job finishes.
+        """
+        done = 0
+        running = {}
+        last_sweep = None
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="quiz-task") as pool:
+            while not self._stopping.is_set():
+                close_old_connections()
+                if last_sweep is None or time.monotonic() - last_sweep >= SWEEP_INTERVAL:
+                    sweep()
+                    last_sweep = time.monotonic()
+                free = self.workers - len(running)
+                jobs = claim(self.name, free) if free else []
+                for job in jobs:
+                    running[pool.submit(run_job, job)] = job
+                if not jobs and not running:
+                    if burst:
+                        break
+                    self._stopping.wait(self.poll_interval)
+                    continue
+                if running:
+                    # Wake up when a slot frees, or after a poll interval to look for new jobs
+                    finished, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        job = running.pop(future)
+                        done += 1
+                        if progress:
+                            progress(job, future.result())
+            for future in list(running):
+                job = running.pop(future)
+                done += 1
+                if progress:
+                    progress(job, future.result())
+        close_old_connections()
+        return done
@@ -0,0 +1,54 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+
+def _timeout():
+    return getattr(settings, "QUIZ_FRAGMENT_TIMEOUT", 60 * 60 * 24)
+
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, name, version, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.version = version
+        self.vary_on = vary_on
+
+    def render(self, context):
+        version = self.version.resolve(context)
+        timeout = _timeout()
+        if version is None or not timeout:
+            return self.nodelist.render(context)
+        parts = ":".join(str(value.resolve(context)) for value in self.vary_on)
+        key = f"quiz:fragment:{self.name}:{version}:{parts}"
+        html = cache.get(key)
+        if html is None:
+            html = self.nodelist.render(context)
+            cache.set(key, html, timeout=timeout)
+        return mark_safe(html)
+
+
+@register.tag
+def fragment(parser, token):
+    """Cache the rendered block under a content version, like the manifest.
+
+    Usage: {% fragment "question-body" 1 content_version question.id %}...{% endfragment %}
+
+    The number after the name is the block's markup revision: bump it when
+    the block, or a template it includes, changes so the old markup isn't
+    served. Everything inside must depend only on the content version and
+    the vary-on values: per-user state stays outside. A None version (or a
+    QUIZ_FRAGMENT_TIMEOUT of 0) renders the block uncached.
+    """
+    bits = token.split_contents()
+    if len(bits) < 4 or bits[1][0] not in "\"'" or bits[1][0] != bits[1][-1] or not bits[2].isdigit():
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' takes a quoted name, a markup revision, a version and optional vary-on values"
+        )
+    nodelist = parser.parse(("endfragment",))
+    parser.delete_first_token()
+    name = f"{bits[1][1:-1]}.{bits[2]}"
+    return FragmentNode(nodelist, name, parser.compile_filter(bits[3]), [parser.compile_filter(bit) for bit in bits[4:]])
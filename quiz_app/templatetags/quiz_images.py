@@ -0,0 +1,23 @@
+from django import template
+
+register = template.Library()
+
+
+@register.inclusion_tag("includes/picture.html")
+def picture(image, alt="", css_class="", sizes="100vw"):
+    """Render an ``images.image_info`` dict as a <picture> with AVIF/WebP srcsets.
+
+    Usage: {% picture question.image alt=question.text_content sizes="(min-width: 768px) 50vw, 100vw" %}
+    """
+    return {"image": image, "alt": alt, "css_class": css_class, "sizes": sizes}
+
+
+@register.filter
+def srcset(image, mime_type="image/webp"):
+    """The srcset of one format, e.g. {{ subject.logo|srcset:"image/avif" }}."""
+    if not image:
+        return ""
+    for source in image["sources"]:
+        if source["type"] == mime_type:
+            return source["srcset"]
+    return ""
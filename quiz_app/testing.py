@@ -0,0 +1,37 @@
+# testing.py
+"""Test helpers for the quiz app."""
+from urllib.parse import urlsplit
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+from .instrumentation import budget_for, in_setup
+
+
+class QueryBudgetMixin:
+    """For ``TestCase``: request a URL and fail if its view runs more
+    queries than it declares with ``@query_budget``. Queries inside
+    ``instrumentation.setup()`` don't count, as in the middleware."""
+
+    def assertWithinQueryBudget(self, path, method="get", data=None, **extra):
+        match = resolve(urlsplit(path).path)
+        budget = budget_for(match.func)
+        if budget is None:
+            self.fail(f"{match.view_name} declares no query budget")
+        setup = []
+
+        def note_setup(execute, sql, params, many, context):
+            setup.append(in_setup())
+            return execute(sql, params, many, context)
+
+        with CaptureQueriesContext(connection) as context, connection.execute_wrapper(note_setup):
+            response = getattr(self.client, method)(path, data, **extra)
+        budgeted = setup.count(False)
+        if budgeted > budget:
+            queries = "\n".join(
+                f"{i}. {'(setup) ' if is_setup else ''}{query['sql']}"
+                for i, (query, is_setup) in enumerate(zip(context.captured_queries, setup), start=1)
+            )
+            self.fail(f"{match.view_name} ran {budgeted} queries, over its budget of {budget}:\n{queries}")
+        return response
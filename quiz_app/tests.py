@@ -1,3 +1,1711 @@
-from django.test import TestCase
+# tests.py
+"""Tests for the quiz app.
 
-# Create your tests here.
+Views run through whichever module ``urls.py`` picked, so the suite covers
+the async views too when it is run with ``QUIZ_ASYNC_VIEWS=1``.
+"""
+import gzip
+import itertools
+import json
+import os
+import random
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from asgiref.sync import iscoroutinefunction
+from PIL import Image
+
+from django.conf import settings
+from django.contrib import admin as django_admin
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.http import Http404
+from django.template import Context, Template, TemplateSyntaxError
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver
+from django.utils import timezone
+
+from quiz_project import database
+
+from . import (
+    admin, admin_pagination, analytics, async_views, attempts, benchmarking, catalogue, db, exams, history, images,
+    instrumentation, leaderboards, manifest, mediafiles, navigation, questionbank, recording, scoring, search,
+    selection, serving, summaries, tasks, views,
+)
+from .instrumentation import budget_for
+from .leaderboards import _Buckets
+from .models import (
+    ArchivedProgress, Explanation, ImageDerivative, Job, Option, OptionStats, Question, QuestionStats, QuizAttempt,
+    StoredFile, Subject, Submission, UserProgress, UserSubjectSummary,
+)
+from .storage import ContentHashStorage, compressed_variants
+from .testing import QueryBudgetMixin
+
+_usernames = (f"learner{n}" for n in itertools.count())
+
+
+def cold_caches():
+    """Forget everything cached, as after a deploy."""
+    cache.clear()
+    manifest._local.clear()
+    navigation._local.clear()
+    leaderboards.reset_backend()
+    search.reset_backend()
+
+
+class QuizTestCase(TestCase):
+    """A subject of seven questions, each with a right and a wrong option."""
+
+    questions = 7
+
+    def setUp(self):
+        cold_caches()
+        recording.reset_writer()
+        self.subject = Subject.objects.create(name="Biology", description="Cells")
+        self.qs = []
+        for i in range(self.questions):
+            question = Question.objects.create(subject=self.subject, text_content=f"Question {i} word", hint="h")
+            right = Option.objects.create(question=question, text_content="right", is_correct=True)
+            wrong = Option.objects.create(question=question, text_content="wrong")
+            Explanation.objects.create(question=question, text_content="because")
+            self.qs.append((question, right, wrong))
+        self.user = self.login()
+
+    def tearDown(self):
+        recording.reset_writer()
+        leaderboards.reset_backend()
+
+    def login(self):
+        user = User.objects.create_user(next(_usernames))
+        self.client.force_login(user)
+        return user
+
+    def question_url(self, question, subject=None):
+        return f"/subject/{(subject or self.subject).id}/question/{question.id}/"
+
+    def post_answers(self, answers, subject=None):
+        return self.client.post(
+            f"/api/subject/{(subject or self.subject).id}/session/answers/",
+            json.dumps({"answers": answers}),
+            content_type="application/json",
+        )
+
+
+# ----------------- MANIFEST -----------------
+class ManifestTests(QuizTestCase):
+    def test_served_from_memory_until_content_changes(self):
+        built = manifest.get_manifest(self.subject.id)
+        self.assertEqual(len(built["questions"]), self.questions)
+        with self.assertNumQueries(0):
+            self.assertIs(manifest.get_manifest(self.subject.id), built)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Option.objects.filter(pk=self.qs[0][2].pk).first().save()
+        self.assertIsNot(manifest.get_manifest(self.subject.id), built)
+
+    def test_saving_a_loaded_row_does_not_read_it_again(self):
+        question = Question.objects.get(pk=self.qs[0][0].pk)
+        question.text_content = "Edited"
+        with CaptureQueriesContext(connection) as context:
+            question.save()
+        self.assertFalse([query for query in context if query["sql"].startswith("SELECT")])
+
+        # The next save compares against what the first one wrote
+        question.subject = Subject.objects.create(name="Zoology")
+        with self.captureOnCommitCallbacks(execute=True):
+            question.save()
+        self.assertEqual(question._previous["subject_id"], self.subject.id)
+
+    def test_moving_a_question_invalidates_both_subjects(self):
+        other = Subject.objects.create(name="Zoology")
+        before = manifest.get_manifest(self.subject.id), manifest.get_manifest(other.id)
+        question = Question.objects.get(pk=self.qs[0][0].pk)
+        question.subject = other
+        with self.captureOnCommitCallbacks(execute=True):
+            question.save()
+
+        self.assertEqual(len(manifest.get_manifest(self.subject.id)["questions"]), self.questions - 1)
+        self.assertIn(question.id, manifest.get_manifest(other.id)["questions"])
+        self.assertIsNot(manifest.get_manifest(other.id), before[1])
+
+
+# ----------------- NAVIGATION -----------------
+class NavigationTests(QuizTestCase):
+    def test_follows_question_order(self):
+        ids = [question.id for question, _, _ in self.qs]
+        index = navigation.get_index(self.subject.id)
+        self.assertEqual(index.ids, ids)
+        self.assertEqual(index.first_id, ids[0])
+        self.assertEqual(index.position(ids[2]), 3)
+        self.assertIsNone(index.previous_id(ids[0]))
+        self.assertEqual(index.next_id(ids[0]), ids[1])
+        self.assertIsNone(index.next_id(ids[-1]))
+        with self.assertNumQueries(0):
+            self.assertIs(navigation.get_index(self.subject.id), index)
+
+    def test_rebuilt_when_the_order_changes(self):
+        index = navigation.get_index(self.subject.id)
+        question = Question.objects.get(pk=self.qs[-1][0].pk)
+        question.text_content = "Edited"
+        with self.captureOnCommitCallbacks(execute=True):
+            question.save()
+        self.assertIs(navigation.get_index(self.subject.id), index)
+
+        question.order = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            question.save()
+        self.assertEqual(navigation.get_index(self.subject.id).first_id, question.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            question.delete()
+        self.assertNotIn(question.id, navigation.get_index(self.subject.id))
+
+    def test_shared_copy_survives_a_restart(self):
+        index = navigation.get_index(self.subject.id)
+        navigation._local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(navigation.get_index(self.subject.id).ids, index.ids)
+
+
+# ----------------- CATALOGUE -----------------
+@override_settings(QUIZ_ANSWER_RECORDING={"MODE": "sync"})
+class CatalogueTests(QuizTestCase):
+    def test_counts_and_completion(self):
+        empty = Subject.objects.create(name="Astronomy")
+        counts = {subject["id"]: subject["question_count"] for subject in catalogue.get_catalogue()}
+        self.assertEqual(counts, {self.subject.id: self.questions, empty.id: 0})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for question, right, _ in self.qs[:2]:
+                self.client.post(self.question_url(question), {"answer": right.id})
+        with self.assertNumQueries(1):
+            subjects = {subject["id"]: subject for subject in catalogue.get_catalogue(self.user)}
+        self.assertEqual(subjects[self.subject.id]["completed"], 2)
+        self.assertEqual(subjects[self.subject.id]["completion"], int(2 * 100 / self.questions))
+        self.assertEqual(subjects[empty.id]["completion"], 0)
+
+    def test_new_questions_invalidate(self):
+        catalogue.get_catalogue()
+        with self.captureOnCommitCallbacks(execute=True):
+            Question.objects.create(subject=self.subject, text_content="Another")
+        subject, = catalogue.get_catalogue()
+        self.assertEqual(subject["question_count"], self.questions + 1)
+
+    def test_homepage(self):
+        response = self.client.get("/")
+        self.assertContains(response, "Biology")
+
+
+# ----------------- RESULTS -----------------
+class ResultsTests(QuizTestCase):
+    questions = 4
+
+    def progress(self, user, question, **fields):
+        return UserProgress.objects.create(
+            user=user, subject=self.subject, question=question,
+            attempt_id=attempts.active_attempt_id(user, self.subject.id), **fields,
+        )
+
+    def test_totals(self):
+        (q0, _, _), (q1, _, _), (q2, _, _), (q3, _, _) = self.qs
+        self.progress(self.user, q0, answered_correctly=True, attempts=1, hint_used=True)
+        self.progress(self.user, q1, attempts=2)
+        self.progress(self.user, q2, attempts=1)
+        self.progress(User.objects.create_user("other"), q3, answered_correctly=True, attempts=1)
+
+        response = self.client.get(f"/subject/{self.subject.id}/results/")
+        self.assertContains(response, "Unanswered")
+        data = self.client.get(f"/api/subject/{self.subject.id}/results/").json()
+        self.assertEqual(
+            (data["correct"], data["incorrect"], data["incomplete"], data["unanswered"], data["hints_used"]),
+            (1, 1, 1, 1, 1),
+        )
+        self.assertEqual(data["score_percentage"], 25)
+        self.assertEqual(
+            [row["status"] for row in data["results"]], ["Correct", "Incorrect", "Incomplete", "Unanswered"]
+        )
+
+    def test_api_needs_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(f"/api/subject/{self.subject.id}/results/").status_code, 401)
+
+
+# ----------------- ANSWER RECORDING -----------------
+class BufferedWriterTests(QuizTestCase):
+    questions = 1
+
+    def writer(self, **options):
+        writer = recording.BufferedSubmissionWriter(**{"batch_size": 3, "flush_interval": 60, "max_pending": 100, **options})
+        # No timer thread: the test flushes by hand
+        patcher = mock.patch.object(writer, "_ensure_flusher")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return writer
+
+    def submission(self, option):
+        return Submission(user=self.user, question=option.question, selected_option=option)
+
+    def test_flushes_full_batches(self):
+        question, right, wrong = self.qs[0]
+        writer = self.writer()
+        writer.add(self.submission(wrong))
+        writer.add_many([self.submission(wrong)])
+        self.assertEqual((writer.pending(), Submission.objects.count()), (2, 0))
+        writer.add(self.submission(right))
+        self.assertEqual((writer.pending(), Submission.objects.count()), (0, 3))
+
+        writer.add(self.submission(right))
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(Submission.objects.count(), 4)
+
+    @override_settings(QUIZ_ANSWER_RECORDING={"MODE": "buffered", "BATCH_SIZE": 3, "FLUSH_INTERVAL": 60})
+    def test_answers_update_progress_before_the_flush(self):
+        recording.reset_writer()
+        question, right, wrong = self.qs[0]
+        progress = UserProgress.objects.create(
+            user=self.user, subject=self.subject, question=question,
+            attempt_id=attempts.active_attempt_id(self.user, self.subject.id),
+        )
+        with mock.patch.object(recording.BufferedSubmissionWriter, "_ensure_flusher"):
+            recording.record_answer(progress, wrong.id, False)
+            recording.record_answer(progress, right.id, True)
+        progress.refresh_from_db()
+        self.assertEqual((progress.attempts, progress.answered_correctly, progress.selected_option_id), (2, True, right.id))
+        self.assertEqual(Submission.objects.count(), 0)
+        self.assertEqual(recording.flush(), 2)
+
+    def test_failed_flush_keeps_up_to_max_pending(self):
+        question, right, wrong = self.qs[0]
+        writer = self.writer(batch_size=100, max_pending=3)
+        made = [self.submission(wrong) for _ in range(5)]
+        writer.add_many(made)
+        with mock.patch.object(Submission.objects, "bulk_create", side_effect=RuntimeError("database down")):
+            with self.assertLogs("quiz_app.recording", "ERROR"):
+                self.assertEqual(writer.flush(), 0)
+        self.assertEqual(writer.pending(), 3)
+        self.assertEqual(writer.flush(), 3)
+        self.assertEqual(set(Submission.objects.values_list("pk", flat=True)), {s.pk for s in made[2:]})
+
+    def test_deleted_rows_are_dropped_instead_of_retried(self):
+        question, right, wrong = self.qs[0]
+        gone = Question.objects.create(subject=self.subject, text_content="Gone")
+        gone_option = Option.objects.create(question=question, text_content="gone")
+        writer = self.writer(batch_size=100)
+        writer.add_many([
+            self.submission(right),
+            self.submission(gone_option),
+            Submission(user=self.user, question=gone, selected_option=None),
+        ])
+        gone.delete()
+        gone_option.delete()
+
+        # SQLite only checks the foreign keys when the test transaction ends
+        bulk_create = Submission.objects.bulk_create
+        with mock.patch.object(
+            Submission.objects, "bulk_create", wraps=bulk_create,
+            side_effect=[IntegrityError("FOREIGN KEY constraint failed"), mock.DEFAULT],
+        ):
+            with self.assertLogs("quiz_app.recording", "WARNING") as logs:
+                self.assertEqual(writer.flush(), 2)
+        self.assertIn("question was deleted", logs.output[0])
+        self.assertEqual(writer.pending(), 0)
+        self.assertCountEqual(Submission.objects.values_list("selected_option_id", flat=True), [right.id, None])
+
+    @override_settings(QUIZ_ANSWER_RECORDING={"MODE": "sync"})
+    def test_concurrent_answers_see_each_other(self):
+        recording.reset_writer()
+        question, right, wrong = self.qs[0]
+        progress = UserProgress.objects.create(
+            user=self.user, subject=self.subject, question=question,
+            attempt_id=attempts.active_attempt_id(self.user, self.subject.id),
+        )
+        stale = UserProgress.objects.get(pk=progress.pk)
+        recording.record_answer(progress, wrong.id, False)
+        # Read before the first answer was written, as by a second request
+        recording.record_answer(stale, right.id, True)
+
+        self.assertEqual((stale.attempts, stale.answered_correctly), (2, True))
+        stats = QuestionStats.objects.get(question=question)
+        self.assertEqual((stats.submissions, stats.learners, stats.correct, stats.first_try_correct), (2, 1, 1, 0))
+        summary = UserSubjectSummary.objects.get(user=self.user, subject=self.subject)
+        self.assertEqual((summary.answered, summary.correct, summary.finished), (1, 1, 1))
+
+
+# ----------------- DATABASE -----------------
+class DatabaseSettingsTests(SimpleTestCase):
+    def test_sqlite(self):
+        databases = database.database_settings(Path("/srv"), {"QUIZ_DB_BUSY_TIMEOUT": "5000"})
+        self.assertEqual(databases["default"]["NAME"], Path("/srv/db.sqlite3"))
+        self.assertEqual(databases["default"]["OPTIONS"], {"timeout": 5.0})
+        self.assertNotIn("replica", databases)
+        # The timeout is set once, as a connection option
+        self.assertEqual(database.sqlite_pragmas({"QUIZ_DB_BUSY_TIMEOUT": "5000"}), {})
+        self.assertEqual(
+            database.sqlite_pragmas({"QUIZ_SQLITE_JOURNAL_MODE": "WAL"}),
+            {"journal_mode": "WAL", "synchronous": "NORMAL"},
+        )
+
+    def test_server_and_replica(self):
+        databases = database.database_settings(Path("/srv"), {
+            "QUIZ_DB_ENGINE": "postgresql", "QUIZ_DB_POOL": "1", "QUIZ_DB_REPLICA_HOST": "replica.internal",
+        })
+        self.assertEqual(databases["default"]["CONN_MAX_AGE"], 0)
+        self.assertEqual(databases["replica"]["HOST"], "replica.internal")
+        self.assertEqual(databases["replica"]["TEST"], {"MIRROR": "default"})
+        with self.assertRaises(ValueError):
+            database.database_settings(Path("/srv"), {"QUIZ_DB_ENGINE": "oracle"})
+
+
+class ReplicaRoutingTests(QuizTestCase):
+    def reads(self, function, *args):
+        """The models ``function`` reads, each with whether it was routed to the replica."""
+        routed = []
+
+        def db_for_read(router, model, **hints):
+            routed.append((model.__name__, db._read_from_replica.get()))
+
+        with mock.patch.object(db.ReplicaRouter, "db_for_read", autospec=True, side_effect=db_for_read):
+            function(*args)
+        return set(routed)
+
+    def test_only_uncached_reads_use_the_replica(self):
+        self.assertEqual(self.reads(scoring.compute_results, self.user, self.subject.id), {("Question", True)})
+        self.assertEqual(self.reads(summaries.for_user, self.user), {("UserSubjectSummary", True)})
+        self.assertIn(("Subject", False), self.reads(catalogue.get_catalogue, self.user))
+        self.assertIn(("UserSubjectSummary", True), self.reads(catalogue.get_catalogue, self.user))
+        self.assertEqual(self.reads(manifest.get_manifest, self.subject.id) & {("Subject", True)}, set())
+
+    def test_router(self):
+        router = db.ReplicaRouter()
+        with mock.patch.dict(settings.DATABASES, {"replica": {}}):
+            self.assertIsNone(router.db_for_read(Question))
+            with db.read_from_replica():
+                self.assertEqual(router.db_for_read(Question), "replica")
+                self.assertEqual(router.db_for_write(Question), "default")
+        with db.read_from_replica():
+            self.assertIsNone(router.db_for_read(Question))
+
+
+# ----------------- ASYNC VIEWS -----------------
+QUIZ_VIEWS = (
+    "subject_list", "subject_questions", "question_detail", "retake", "results", "results_api", "dashboard",
+    "dashboard_api", "leaderboard", "leaderboard_api", "search_questions", "search_api", "session_questions",
+    "session_answers", "exam_status",
+)
+
+
+@override_settings(QUIZ_ANSWER_RECORDING={"MODE": "sync"})
+class AsyncViewTests(QuizTestCase):
+    """The async views called directly, whichever module the URLs use."""
+
+    def request(self, method, path, data=None):
+        request = getattr(AsyncRequestFactory(), method)(path, data or {})
+        user = self.user
+
+        async def auser():
+            return user
+
+        request.auser = auser
+        request.session = {}
+        return request
+
+    def test_every_quiz_view_has_an_async_twin(self):
+        for name in QUIZ_VIEWS:
+            self.assertTrue(iscoroutinefunction(getattr(async_views, name)), name)
+            self.assertFalse(iscoroutinefunction(getattr(views, name)), name)
+
+    async def test_answering_a_question(self):
+        question, right, wrong = self.qs[0]
+        url = self.question_url(question)
+        response = await async_views.question_detail(self.request("get", url), self.subject.id, question.id)
+        self.assertContains(response, "Question 0 word")
+
+        response = await async_views.question_detail(
+            self.request("post", url, {"answer": wrong.id}), self.subject.id, question.id
+        )
+        self.assertEqual(response.status_code, 200)
+        response = await async_views.question_detail(
+            self.request("post", url, {"answer": right.id}), self.subject.id, question.id
+        )
+        self.assertRedirects(response, self.question_url(self.qs[1][0]), fetch_redirect_response=False)
+
+        progress = await UserProgress.objects.aget(user=self.user, question=question)
+        self.assertEqual((progress.attempts, progress.answered_correctly), (2, True))
+        data = json.loads((await async_views.results_api(
+            self.request("get", f"/api/subject/{self.subject.id}/results/"), self.subject.id
+        )).content)
+        self.assertEqual((data["correct"], data["unanswered"]), (1, self.questions - 1))
+
+    async def test_logged_out(self):
+        request = self.request("get", "/dashboard/")
+        request.auser = mock.AsyncMock(return_value=AnonymousUser())
+        response = await async_views.dashboard(request)
+        self.assertEqual(response.status_code, 302)
+        request = self.request("get", "/api/dashboard/")
+        request.auser = mock.AsyncMock(return_value=AnonymousUser())
+        self.assertEqual((await async_views.dashboard_api(request)).status_code, 401)
+
+
+# ----------------- IMAGE DERIVATIVES -----------------
+def png(width=800, height=400, color="red"):
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, format="PNG")
+    return ContentFile(buffer.getvalue())
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = ContentHashStorage(location=directory.name, base_url="/media/")
+
+    @override_settings(QUIZ_IMAGE_WIDTHS=(320, 1024))
+    def test_generates_each_width_and_format_once(self):
+        name = self.storage.save("questions/cell.png", png())
+        made = images.generate_derivatives(name, self.storage)
+        self.assertEqual(made, 2 * len(images.derivative_formats()))
+        # Never upscaled past the original's 800 pixels
+        self.assertEqual(
+            set(ImageDerivative.objects.filter(source=name).values_list("width", flat=True)), {320, 800}
+        )
+        self.assertEqual(images.generate_derivatives(name, self.storage), 0)
+
+        info = images.image_info(
+            Question._meta.get_field("image_content"), name, images.derivatives_for([name], self.storage)
+        )
+        self.assertIn("320w", info["sources"][-1]["srcset"])
+        self.assertEqual(info["sources"][-1]["type"], "image/webp")
+
+    @override_settings(QUIZ_TASKS={"MODE": "queue"})
+    def test_failed_jobs_can_be_queued_again(self):
+        images.schedule("questions/cell.png", 1)
+        images.schedule("questions/cell.png", 1)
+        job = Job.objects.get()
+
+        Job.objects.filter(pk=job.pk).update(status=Job.FAILED)
+        images.schedule("questions/cell.png", 1)
+        job.refresh_from_db()
+        self.assertIsNone(job.idempotency_key)
+        retry = Job.objects.get(status=Job.QUEUED)
+        self.assertEqual(retry.idempotency_key, "derivatives:1:questions/cell.png")
+        self.assertEqual(retry.payload, {"name": "questions/cell.png", "subject_id": 1})
+
+
+# ----------------- MEDIA FILES -----------------
+class MediaFileTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = ContentHashStorage(location=directory.name)
+
+    def references(self, name):
+        return StoredFile.objects.filter(name=name).values_list("references", flat=True).first()
+
+    def test_identical_uploads_share_a_file_until_released(self):
+        first = self.storage.save("questions/a.png", png())
+        self.assertEqual(self.storage.save("questions/c.png", png()), first)
+        mediafiles.acquire(first)
+        mediafiles.acquire(first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            mediafiles.release(first, self.storage)
+        self.assertTrue(self.storage.exists(first))
+        with self.captureOnCommitCallbacks(execute=True):
+            mediafiles.release(first, self.storage)
+        self.assertFalse(self.storage.exists(first))
+        self.assertIsNone(self.references(first))
+
+    def test_collect_keeps_referenced_and_unknown_files(self):
+        name = self.storage.save("questions/a.png", png())
+        self.assertFalse(mediafiles.collect(name, self.storage))
+        mediafiles.acquire(name)
+        self.assertFalse(mediafiles.collect(name, self.storage))
+        self.assertTrue(self.storage.exists(name))
+
+    def test_file_collected_between_save_and_acquire_is_written_again(self):
+        name = self.storage.save("questions/a.png", png())
+        StoredFile.objects.create(name=name, references=0)
+        # A second upload of the same bytes finds the file...
+        content = png()
+        self.assertEqual(self.storage.save("questions/b.png", content), name)
+        # ...which the first upload's collect removes before the reference is counted
+        self.assertTrue(mediafiles.collect(name, self.storage))
+        mediafiles.acquire(name, content, self.storage)
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.references(name), 1)
+
+
+# ----------------- ASSET SERVING -----------------
+class ServingTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = FileSystemStorage(location=directory.name)
+        self.body = b"body { color: red; }\n" * 50
+        self.storage.save("app.css", ContentFile(self.body))
+        for suffix, encoded in compressed_variants(self.body):
+            self.storage.save("app.css" + suffix, ContentFile(encoded))
+
+    def get(self, name="app.css", **headers):
+        request = RequestFactory().get("/static/" + name, headers=headers)
+        return serving.serve_file(request, self.storage, name, precompressed=True)
+
+    def test_validators_and_conditional_requests(self):
+        response = self.get()
+        self.assertEqual(b"".join(response.streaming_content), self.body)
+        self.assertEqual(response["Cache-Control"], serving.REVALIDATE)
+        self.assertEqual(self.get(**{"If-None-Match": response["ETag"]}).status_code, 304)
+        self.assertEqual(self.get(**{"If-None-Match": '"stale"'}).status_code, 200)
+        with self.assertRaises(Http404):
+            self.get("missing.css")
+        with self.assertRaises(Http404):
+            self.get("../outside.css")
+
+    def test_ranges(self):
+        response = self.get(Range="bytes=5-9")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.body[5:10])
+        self.assertEqual(response["Content-Range"], f"bytes 5-9/{len(self.body)}")
+        self.assertEqual(b"".join(self.get(Range="bytes=-4").streaming_content), self.body[-4:])
+        self.assertEqual(self.get(Range=f"bytes={len(self.body)}-").status_code, 416)
+        # A range of an older version is ignored
+        self.assertEqual(self.get(Range="bytes=5-9", **{"If-Range": '"old"'}).status_code, 200)
+
+    def test_precompressed_copies(self):
+        response = self.get(**{"Accept-Encoding": "gzip"})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), self.body)
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertNotEqual(response["ETag"], self.get()["ETag"])
+
+    def test_content_hashed_media_is_immutable(self):
+        self.assertTrue(serving._is_hashed_media("questions/" + "a" * 64 + ".png"))
+        self.assertFalse(serving._is_hashed_media("questions/photo.png"))
+
+
+# ----------------- SESSION API -----------------
+@override_settings(QUIZ_ANSWER_RECORDING={"MODE": "sync"})
+class SessionApiTests(QuizTestCase):
+    def test_questions(self):
+        data = self.client.get(f"/api/subject/{self.subject.id}/session/questions/?count=3").json()
+        self.assertEqual([q["id"] for q in data["questions"]], [q.id for q, _, _ in self.qs[:3]])
+        self.assertEqual(data["next_start"], self.qs[3][0].id)
+        self.assertNotIn("is_correct", json.dumps(data))
+        self.assertNotIn("because", json.dumps(data))
+
+        data = self.client.get(
+            f"/api/subject/{self.subject.id}/session/questions/?start={self.qs[5][0].id}&count=5"
+        ).json()
+        self.assertEqual(len(data["questions"]), 2)
+        self.assertIsNone(data["next_start"])
+        self.assertEqual(
+            self.client.get(f"/api/subject/{self.subject.id}/session/questions/?start=x").status_code, 400
+        )
+
+    def test_grading(self):
+        (q0, right0, _), (q1, right1, wrong1), (q2, _, _) = self.qs[:3]
+        with self.captureOnCommitCallbacks(execute=True):
+            results = self.post_answers([
+                {"client_id": "a", "question_id": q0.id, "option_id": right0.id},
+                {"client_id": "b", "question_id": q1.id, "option_id": wrong1.id},
+                {"client_id": "c", "question_id": q1.id, "option_id": wrong1.id, "hint_used": True},
+                {"client_id": "d", "question_id": q1.id, "option_id": right1.id},
+                {"client_id": "e", "question_id": q2.id, "option_id": right1.id},
+            ]).json()["results"]
+        self.assertEqual([r["status"] for r in results], ["correct", "incorrect", "incorrect", "closed", "invalid"])
+        # The answer is revealed after the second wrong attempt only
+        self.assertNotIn("correct_option_id", results[1])
+        self.assertEqual((results[2]["correct_option_id"], results[2]["explanation"]), (right1.id, "because"))
+
+        progress = UserProgress.objects.get(user=self.user, question=q1)
+        self.assertEqual(progress.attempts, 2)
+        self.assertTrue(progress.hint_used)
+        self.assertEqual(Submission.objects.count(), 3)
+        summary = self.client.get(f"/api/subject/{self.subject.id}/results/").json()
+        self.assertEqual((summary["correct"], summary["incorrect"]), (1, 1))
+
+    def test_replayed_answers_are_not_graded_twice(self):
+        question, _, wrong = self.qs[0]
+        answer = {"client_id": "b", "question_id": question.id, "option_id": wrong.id}
+        first = self.post_answers([answer]).json()["results"][0]
+        self.assertEqual(self.post_answers([answer]).json()["results"][0], first)
+        self.assertEqual(Submission.objects.count(), 1)
+        self.assertEqual(UserProgress.objects.get(user=self.user, question=question).attempts, 1)
+
+        # The same client id in a new attempt, or from another user, is a new answer
+        self.client.post(f"/subject/{self.subject.id}/retake/")
+        self.assertEqual(self.post_answers([answer]).json()["results"][0]["attempts"], 1)
+        self.login()
+        self.assertEqual(self.post_answers([answer]).json()["results"][0]["attempts"], 1)
+
+    def test_page_names_the_attempt(self):
+        response = self.client.get(self.question_url(self.qs[0][0]))
+        attempt_id = attempts.active_attempt_id(self.user, self.subject.id)
+        self.assertContains(response, f'data-attempt-id="{attempt_id}"')
+
+    def test_bad_requests(self):
+        self.assertEqual(self.post_answers([{"client_id": 1}]).status_code, 400)
+        url = f"/api/subject/{self.subject.id}/session/answers/"
+        self.assertEqual(self.client.post(url, "nope", content_type="application/json").status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.client.logout()
+        self.assertEqual(self.post_answers([]).status_code, 401)
+        self.assertEqual(self.client.get(f"/api/subject/{self.subject.id}/session/questions/").status_code, 401)
+
+
+# ----------------- QUESTION BANK -----------------
+def bank_zip(records, files):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("questions.jsonl", "".join(json.dumps(record) + "\n" for record in records))
+        for name, content in files.items():
+            archive.writestr(name, content.read())
+    buffer.seek(0)
+    return buffer
+
+
+class QuestionBankTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = ContentHashStorage(location=directory.name)
+        patcher = mock.patch.object(questionbank, "quiz_media_storage", return_value=self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record(self, text, image=None):
+        return {
+            "subject": "Botany", "text": text, "image": image, "hint": "",
+            "options": [
+                {"text": "yes", "image": image, "is_correct": True},
+                {"text": "no", "image": None, "is_correct": False},
+            ],
+            "explanation": {"text": "because", "image": None},
+        }
+
+    def test_import_and_export_with_images(self):
+        source = bank_zip(
+            [self.record("Leaves are green", "leaf.png"), self.record("Leaves fall", "leaf.png"), {"subject": "Botany"}],
+            {"leaf.png": png()},
+        )
+        with questionbank.QuestionBank(source, "bank.zip") as bank:
+            report = questionbank.import_bank(bank, batch_size=2, workers=1)
+        self.assertEqual((report.read, report.imported, report.error_count), (3, 2, 1))
+        self.assertEqual(report.errors[0][0], 3)
+        images = {
+            Question.objects.values_list("image_content", flat=True).first(),
+            Option.objects.exclude(image_content="").values_list("image_content", flat=True).first(),
+        }
+        self.assertEqual(
+            dict(StoredFile.objects.filter(name__in=images).values_list("name", "references")),
+            dict.fromkeys(images, 2),
+        )
+
+        exported = BytesIO()
+        self.assertEqual(questionbank.write_bank(exported, Question.objects.all(), with_images=True), 2)
+        with zipfile.ZipFile(exported) as archive:
+            names = archive.namelist()
+            lines = archive.read("questions.jsonl").decode().splitlines()
+        # Shared images are stored once
+        self.assertEqual(sorted(names), sorted(["questions.jsonl", *images]))
+        self.assertEqual([json.loads(line)["text"] for line in lines], ["Leaves are green", "Leaves fall"])
+
+    def test_failed_batch_leaves_no_images(self):
+        source = bank_zip([self.record("Leaves are green", "leaf.png")], {"leaf.png": png(color="green")})
+        with questionbank.QuestionBank(source, "bank.zip") as bank:
+            with mock.patch.object(Option.objects, "bulk_create", side_effect=RuntimeError("disk full")):
+                with self.assertRaises(RuntimeError):
+                    questionbank.import_bank(bank, workers=1)
+        self.assertFalse(Question.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.storage.location, "questions")), [])
+
+    def test_csv(self):
+        subject = Subject.objects.create(name="Botany")
+        question = Question.objects.create(subject=subject, text_content="Leaves are green")
+        Option.objects.create(question=question, text_content="yes", is_correct=True)
+        Option.objects.create(question=question, text_content="no")
+        exported = BytesIO()
+        questionbank.write_bank(exported, Question.objects.all(), questionbank.CSV)
+        lines = exported.getvalue().decode().splitlines()
+        self.assertEqual(lines[0].split(",")[-3:], ["correct", "explanation", "explanation_image"])
+
+        exported.seek(0)
+        with questionbank.QuestionBank(exported, "bank.csv") as bank:
+            record = next(bank.records())[1]
+        self.assertEqual([option["is_correct"] for option in record["options"]], [True, False])
+
+
+# ----------------- ADMIN -----------------
+class AdminTests(QuizTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser(next(_usernames), password="x"))
+        attempt_id = attempts.active_attempt_id(self.user, self.subject.id)
+        for question, right, _ in self.qs:
+            UserProgress.objects.create(
+                user=self.user, subject=self.subject, question=question, selected_option=right,
+                attempt_id=attempt_id, attempts=1, answered_correctly=True,
+            )
+
+    def test_history_pages_by_cursor(self):
+        ids = sorted(UserProgress.objects.values_list("pk", flat=True), reverse=True)
+        with mock.patch.object(admin.UserProgressAdmin, "list_per_page", 3):
+            first = self.client.get("/admin/quiz_app/userprogress/")
+            self.assertEqual([row.pk for row in first.context["cl"].result_list], ids[:3])
+            self.assertEqual(first.context["cl"].next_cursor, ids[2])
+            self.assertContains(first, f"?cursor={ids[2]}")
+            self.assertNotContains(first, "?p=")
+
+            second = self.client.get(f"/admin/quiz_app/userprogress/?cursor={ids[2]}")
+            self.assertEqual([row.pk for row in second.context["cl"].result_list], ids[3:6])
+            last = self.client.get(f"/admin/quiz_app/userprogress/?cursor={ids[5]}")
+        self.assertEqual([row.pk for row in last.context["cl"].result_list], ids[6:])
+        self.assertIsNone(last.context["cl"].next_cursor)
+
+    def test_history_admins_are_read_only(self):
+        response = self.client.get("/admin/quiz_app/userprogress/")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context["has_add_permission"])
+        progress = UserProgress.objects.first()
+        response = self.client.post(f"/admin/quiz_app/userprogress/{progress.pk}/change/", {"attempts": 3})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get("/admin/quiz_app/submission/").status_code, 200)
+
+    def test_question_changelist_loads_subjects_with_the_rows(self):
+        response = self.client.get("/admin/quiz_app/question/")
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get("/admin/quiz_app/question/")
+        self.assertFalse([query for query in context if 'FROM "quiz_app_subject"' in query["sql"]])
+
+    def test_estimated_count(self):
+        queryset = UserProgress.objects.all()
+        self.assertEqual(admin_pagination.estimated_count(queryset), self.questions)
+        with mock.patch.object(admin_pagination, "table_estimate", return_value=250_000):
+            self.assertEqual(admin_pagination.estimated_count(queryset), 250_000)
+            # Filtered counts are exact, whatever the table statistics say
+            self.assertEqual(admin_pagination.estimated_count(queryset.filter(question=self.qs[0][0])), 1)
+        with mock.patch.object(admin_pagination, "COUNT_LIMIT", 5):
+            self.assertEqual(admin_pagination.estimated_count(queryset.filter(answered_correctly=True)), 5)
+
+
+# ----------------- QUESTION STATS -----------------
+@override_settings(QUIZ_ANSWER_RECORDING={"MODE": "sync"})
+class QuestionStatsTests(QuizTestCase):
+    def setUp(self):
+        super().setUp()
+        recording.reset_writer()
+
+    def answer(self, question, option):
+        return self.client.post(self.question_url(question), {"answer": option.id})
+
+    def counters(self):
+        return {
+            row["question_id"]: row for row in QuestionStats.objects.values(
+                "question_id", "submissions", "learners", "correct", "first_try_correct", "hints_used",
+            )
+        }
+
+    def test_incremental_stats_match_reconciliation(self):
+        (q0, right0, _), (q1, right1, wrong1), (q2, _, wrong2), (q3, right3, wrong3) = self.qs[:4]
+        self.answer(q0, right0)
+        self.answer(q1, wrong1)
+        self.answer(q1, right1)
+        self.answer(q2, wrong2)
+        self.answer(q2, wrong2)
+        self.answer(q3, right3)
+        self.answer(q3, wrong3)
+
+        incremental = self.counters()
+        self.assertEqual(incremental[q0.id]["first_try_correct"], 1)
+        self.assertEqual(incremental[q3.id]["submissions"], 1)
+        analytics.reconcile(Question.objects.filter(pk__in=incremental))
+        self.assertEqual(self.counters(), incremental)
+
+    def test_deltas_take_back_what_an_answer_undoes(self):
+        progress = UserProgress(attempts=1, answered_correctly=True)
+        delta = analytics.answer_delta(progress, False, False)
+        self.assertEqual((delta.correct, delta.first_try_correct), (-1, -1))
+        progress = UserProgress(attempts=1, answered_correctly=False)
+        delta = analytics.answer_delta(progress, True, False)
+        self.assertEqual((delta.correct, delta.first_try_correct), (1, 0))
+
+    def test_finished_question_takes_no_more_answers(self):
+        (q0, right0, wrong0), (q1, right1, wrong1) = self.qs[:2]
+        self.answer(q0, right0)
+        response = self.answer(q0, wrong0)
+        self.assertContains(response, "Already Answered")
+
+        self.answer(q1, wrong1)
+        self.answer(q1, wrong1)
+        response = self.answer(q1, right1)
+        self.assertContains(response, "Attempts Completed")
+
+        progress = UserProgress.objects.get(user=self.user, question=q1)
+        self.assertEqual((progress.attempts, progress.answered_correctly), (2, False))
+        self.assertEqual(UserProgress.objects.get(user=self.user, question=q0).answered_correctly, True)
+        self.assertEqual(Submission.objects.filter(user=self.user).count(), 3)
+
+    def test_concurrent_answer_that_finishes_the_question_wins(self):
+        question, right, wrong = self.qs[0]
+        progress = UserProgress.objects.create(
+            user=self.user, subject=self.subject, question=question,
+            attempt_id=attempts.active_attempt_id(self.user, self.subject.id),
+        )
+        stale = UserProgress.objects.get(pk=progress.pk)
+        recording.record_answer(progress, right.id, True)
+        self.assertIsNone(recording.record_answer(stale, wrong.id, False))
+        self.assertEqual((stale.attempts, stale.answered_correctly), (1, True))
+        self.assertEqual(Submission.objects.filter(question=question).count(), 1)
+
+
+# ----------------- DASHBOARD -----------------
+class DashboardTests(QuizTestCase):
+    def test_counts_the_questions_of_the_attempt(self):
+        Subject.objects.filter(pk=self.subject.pk).update(selection_mode=Subject.SHUFFLED, question_limit=4)
+        attempt_id = attempts.active_attempt_id(self.user, self.subject.id)
+        first_id = selection.get_order(self.subject.id, attempt_id).first_id
+        question, right, _ = next(entry for entry in self.qs if entry[0].id == first_id)
+        self.client.post(self.question_url(question), {"answer": right.id})
+        recording.flush()
+
+        entry = self.client.get("/api/dashboard/").json()["subjects"][0]
+        results = self.client.get(f"/api/subject/{self.subject.id}/results/").json()
+        self.assertEqual(entry["question_count"], 4)
+        self.assertEqual(entry["question_count"], results["total_questions"])
+        self.assertEqual(entry["score_percentage"], results["score_percentage"])
+        self.assertEqual(entry["completion"], 25)
+
+    def test_subject_order_counts_the_whole_subject(self):
+        self.client.get(self.question_url(self.qs[0][0]))
+        entry = self.client.get("/api/dashboard/").json()["subjects"][0]
+        self.assertEqual(entry["question_count"], self.questions)
+
+
+# ----------------- LEADERBOARDS -----------------
+class BucketsTests(SimpleTestCase):
+    def test_matches_a_sorted_list(self):
+        rng = random.Random(7)
+        expected = rng.sample(range(10000), 3000)
+        with mock.patch.object(_Buckets, "LOAD", 16):
+            buckets = _Buckets(expected)
+            expected.sort()
+            for _ in range(2000):
+                if rng.random() < 0.5 and expected:
+                    key = expected.pop(rng.randrange(len(expected)))
+                    buckets.remove(key)
+                else:
+                    key = rng.randrange(10000, 20000)
+                    if key in expected:
+                        continue
+                    buckets.add(key)
+                    expected.insert(next((i for i, k in enumerate(expected) if k > key), len(expected)), key)
+                probe = expected[rng.randrange(len(expected))]
+                self.assertEqual(buckets.position(probe), expected.index(probe))
+            self.assertEqual(len(buckets), len(expected))
+            self.assertEqual(buckets.slice(0, len(expected)), expected)
+            self.assertEqual(buckets.slice(100, 25), expected[100:125])
+
+
+@override_settings(QUIZ_ANSWER_RECORDING={"MODE": "sync"})
+class LeaderboardTests(QuizTestCase):
+    def test_ranks_follow_committed_answers(self):
+        (q0, right0, wrong0), (q1, right1, _) = self.qs[:2]
+        leaderboards.page(leaderboards.GLOBAL)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_answers([
+                {"client_id": "a", "question_id": q0.id, "option_id": wrong0.id},
+                {"client_id": "b", "question_id": q0.id, "option_id": right0.id},
+            ])
+        first = self.user
+        second = self.login()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_answers([
+                {"client_id": "a", "question_id": q0.id, "option_id": right0.id},
+                {"client_id": "b", "question_id": q1.id, "option_id": right1.id},
+            ])
+
+        board = self.client.get("/api/leaderboard/").json()
+        self.assertEqual([entry["user_id"] for entry in board["entries"]], [second.id, first.id])
+        self.assertEqual((board["me"]["rank"], board["me"]["correct"]), (1, 2))
+        subject_board = self.client.get(f"/api/subject/{self.subject.id}/leaderboard/").json()
+        self.assertEqual(subject_board["entries"], board["entries"])
+
+        # The incremental board agrees with one loaded from the database
+        leaderboards.reset_backend()
+        self.assertEqual(leaderboards.page(leaderboards.GLOBAL)["entries"], board["entries"])
+
+
+# ----------------- RETAKES -----------------
+@override_settings(QUIZ_ANSWER_RECORDING={"MODE": "sync"})
+class RetakeTests(QuizTestCase):
+    def test_retake_archives_the_attempt(self):
+        (q0, right0, _), (q1, _, wrong1) = self.qs[:2]
+        leaderboards.page("global")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_answers([
+                {"client_id": "a", "question_id": q0.id, "option_id": right0.id},
+                {"client_id": "b", "question_id": q1.id, "option_id": wrong1.id, "hint_used": True},
+            ])
+        first = QuizAttempt.objects.get(user=self.user)
+        self.assertEqual(first.number, 1)
+        self.assertEqual(self.client.get(f"/subject/{self.subject.id}/retake/").status_code, 405)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f"/subject/{self.subject.id}/retake/")
+        self.assertRedirects(response, f"/subject/{self.subject.id}/", fetch_redirect_response=False)
+        first.refresh_from_db()
+        self.assertIsNotNone(first.archived_at)
+        self.assertEqual(
+            (first.answered, first.correct, first.attempts, first.hints_used, first.question_count), (2, 1, 2, 1, 7)
+        )
+        self.assertEqual(ArchivedProgress.objects.filter(attempt=first).count(), 2)
+        self.assertFalse(UserProgress.objects.filter(user=self.user).exists())
+
+        second = QuizAttempt.objects.get(user=self.user, archived_at__isnull=True)
+        self.assertEqual(second.number, 2)
+        results = self.client.get(f"/api/subject/{self.subject.id}/results/").json()
+        self.assertEqual((results["correct"], results["answered"]), (0, 0))
+        self.assertEqual(summaries.for_user(self.user)[self.subject.id]["answered"], 0)
+        self.assertEqual(leaderboards.page("global", user=self.user)["me"]["correct"], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_answers([{"client_id": "c", "question_id": q0.id, "option_id": right0.id}])
+        self.assertEqual(UserProgress.objects.get(user=self.user, question=q0).attempt_id, second.id)
+        # Question stats keep counting the learner once, across attempts
+        stats = QuestionStats.objects.get(question=q0)
+        before = (stats.learners, stats.correct, stats.first_try_correct)
+        analytics.reconcile()
+        stats.refresh_from_db()
+        self.assertEqual((stats.learners, stats.correct, stats.first_try_correct), before)
+        self.assertContains(self.client.get(f"/subject/{self.subject.id}/results/"), "Retry Quiz")
+
+    def test_deleted_attempt_falls_back_to_the_subject_order(self):
+        Subject.objects.filter(pk=self.subject.pk).update(selection_mode=Subject.SHUFFLED, question_limit=4)
+        self.client.get(f"/subject/{self.subject.id}/")
+        attempt = QuizAttempt.objects.get(user=self.user)
+        self.assertEqual(len(selection.get_order(self.subject.id, attempt.id)), 4)
+        cache.clear()
+        self.assertEqual(attempts.active_attempt_id(self.user, self.subject.id), attempt.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            attempt.delete()
+        self.assertEqual(len(selection.get_order(self.subject.id, attempt.id)), self.questions)
+        self.assertNotEqual(attempts.active_attempt_id(self.user, self.subject.id), attempt.id)
+
+
+# ----------------- QUESTION SELECTION -----------------
+@override_settings(QUIZ_ANSWER_RECORDING={"MODE": "sync"})
+class SelectionTests(QuizTestCase):
+    def use(self, mode, limit=None, shuffle=False):
+        Subject.objects.filter(pk=self.subject.pk).update(
+            selection_mode=mode, question_limit=limit, shuffle_options=shuffle
+        )
+
+    def difficulties(self):
+        """The first two questions easy, the last two hard, the rest medium."""
+        questions = [q for q, _, _ in self.qs]
+        for question in questions:
+            rate = 9 if question in questions[:2] else 1 if question in questions[5:] else 5
+            QuestionStats.objects.update_or_create(question=question, defaults={"learners": 10, "first_try_correct": rate})
+        return {q.id for q in questions[:2]}, {q.id for q in questions[2:5]}, {q.id for q in questions[5:]}
+
+    def test_shuffled(self):
+        self.use(Subject.SHUFFLED, limit=4, shuffle=True)
+        response = self.client.get(f"/subject/{self.subject.id}/")
+        attempt = QuizAttempt.objects.get(user=self.user)
+        order = attempt.question_order
+        self.assertEqual(len(order), 4)
+        self.assertRedirects(response, f"/subject/{self.subject.id}/question/{order[0]}/", fetch_redirect_response=False)
+
+        outside = next(q for q, _, _ in self.qs if q.id not in order)
+        self.assertEqual(self.client.get(self.question_url(outside)).status_code, 404)
+        response = self.client.get(f"/subject/{self.subject.id}/question/{order[1]}/")
+        self.assertEqual((response.context["total_questions"], response.context["current_question"]), (4, 2))
+        self.assertEqual(response.context["previous_question"]["id"], order[0])
+        # Options keep their shuffled order between visits
+        again = self.client.get(f"/subject/{self.subject.id}/question/{order[1]}/")
+        self.assertEqual(
+            [o["id"] for o in response.context["options"]], [o["id"] for o in again.context["options"]]
+        )
+
+        results = self.client.get(f"/api/subject/{self.subject.id}/results/").json()
+        self.assertEqual([row["question_id"] for row in results["results"]], order)
+        session = self.client.get(f"/api/subject/{self.subject.id}/session/questions/?count=10").json()
+        self.assertEqual([q["id"] for q in session["questions"]], order)
+
+    def test_stratified(self):
+        easy, medium, hard = self.difficulties()
+        self.use(Subject.STRATIFIED, limit=4)
+        order = selection.plan(Subject.objects.get(pk=self.subject.pk), seed=3)["question_order"]
+        levels = [0 if pk in easy else 2 if pk in hard else 1 for pk in order]
+        self.assertEqual(levels, [0, 1, 1, 2])
+
+    def test_adaptive(self):
+        easy, medium, hard = self.difficulties()
+        self.use(Subject.ADAPTIVE, limit=4)
+        options = {q.id: (right, wrong) for q, right, wrong in self.qs}
+        self.client.get(f"/subject/{self.subject.id}/")
+        attempt = QuizAttempt.objects.get(user=self.user)
+        self.assertEqual(len(attempt.question_order), 1)
+        first = attempt.question_order[0]
+        self.assertIn(first, medium)
+
+        # Right moves up a level
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/subject/{self.subject.id}/question/{first}/", {"answer": options[first][0].id})
+        attempt.refresh_from_db()
+        second = attempt.question_order[1]
+        self.assertIn(second, hard)
+        selection.advance(self.subject.id, attempt.id, first, True)
+        attempt.refresh_from_db()
+        self.assertEqual(len(attempt.question_order), 2)
+
+        # Wrong twice moves down a level
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(2):
+                self.client.post(f"/subject/{self.subject.id}/question/{second}/", {"answer": options[second][1].id})
+        attempt.refresh_from_db()
+        self.assertIn(attempt.question_order[2], medium)
+
+    def test_deleted_question_leaves_the_order(self):
+        self.use(Subject.SHUFFLED)
+        self.client.get(f"/subject/{self.subject.id}/")
+        attempt = QuizAttempt.objects.get(user=self.user)
+        gone = attempt.question_order[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            Question.objects.get(pk=gone).delete()
+        order = selection.get_order(self.subject.id, attempt.id)
+        self.assertNotIn(gone, order.ids)
+        self.assertEqual(len(order), self.questions - 1)
+
+
+# ----------------- SEARCH -----------------
+class SearchTests(QuizTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.organelle = Question.objects.create(
+                subject=self.subject, text_content="Which organelle produces energy in the cell?", hint="Power",
+            )
+            Option.objects.create(question=self.organelle, text_content="Mitochondria", is_correct=True)
+            Option.objects.create(question=self.organelle, text_content="Nucleus")
+
+    def search(self, text, **params):
+        return self.client.get("/api/search/", {"q": text, **params}).json()
+
+    def test_finds_questions_by_any_of_their_text(self):
+        page = self.search("organelle")
+        self.assertEqual([row["question_id"] for row in page["results"]], [self.organelle.id])
+        self.assertIn("<mark>organelle</mark>", page["results"][0]["snippet"])
+        # Option texts are indexed too, and the last word matches as a prefix
+        self.assertEqual([row["question_id"] for row in self.search("mitochon")["results"]], [self.organelle.id])
+        self.assertEqual(self.search("organelle", subject=Subject.objects.create(name="Zoology").id)["results"], [])
+        self.assertEqual(self.search("")["results"], [])
+
+    def test_pages(self):
+        search.rebuild()
+        first = self.search("word")
+        self.assertEqual(len(first["results"]), self.questions)
+        self.assertFalse(first["has_next"])
+        page = search.search_page("word", number=2, size=3)
+        self.assertEqual(len(page["results"]), 3)
+        self.assertTrue(page["has_next"])
+
+    def test_index_follows_the_content(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Option.objects.filter(question=self.organelle, is_correct=True).first().delete()
+        self.assertEqual(self.search("mitochondria")["results"], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.organelle.delete()
+        self.assertEqual(self.search("organelle")["results"], [])
+
+    def test_find_duplicates(self):
+        matches = search.find_duplicates("Which organelle produces the energy in a cell", ["Mitochondria", "Nucleus"])
+        self.assertEqual([question_id for question_id, _ in matches], [self.organelle.id])
+        self.assertEqual(search.find_duplicates("Which bone is the longest?", ["Femur", "Tibia"]), [])
+
+    def test_admin_search_uses_the_index(self):
+        self.client.force_login(User.objects.create_superuser(next(_usernames), password="x"))
+        response = self.client.get("/admin/quiz_app/question/", {"q": "energy"})
+        self.assertEqual([question.pk for question in response.context["cl"].result_list], [self.organelle.id])
+
+
+# ----------------- EXAMS -----------------
+@override_settings(QUIZ_ANSWER_RECORDING={"MODE": "sync"})
+class ExamTests(QuizTestCase):
+    def setUp(self):
+        super().setUp()
+        Subject.objects.filter(pk=self.subject.pk).update(time_limit=10)
+        self.subject.refresh_from_db()
+        cache.clear()
+
+    def test_expired_answers_are_refused(self):
+        (q0, right0, _), (q1, right1, _) = self.qs[:2]
+        response = self.client.get(self.question_url(q0))
+        self.assertContains(response, "data-exam-timer")
+        attempt = QuizAttempt.objects.get(user=self.user)
+        self.assertAlmostEqual((attempt.deadline - attempt.started_at).total_seconds(), 600, delta=2)
+        token = response.context["exam"]["token"]
+        status = self.client.get(f"/api/exam/{token}/").json()
+        self.assertTrue(status["timed"])
+        self.assertFalse(status["expired"])
+        self.assertEqual(self.client.get("/api/exam/bogus/").status_code, 404)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_answers([{"client_id": "a", "question_id": q0.id, "option_id": right0.id}])
+        with mock.patch("django.utils.timezone.now", return_value=timezone.now() + timedelta(minutes=11)):
+            with self.captureOnCommitCallbacks(execute=True):
+                result = self.post_answers([{"client_id": "b", "question_id": q1.id, "option_id": right1.id}])
+            self.assertEqual(result.json()["results"][0]["status"], "expired")
+            self.client.post(self.question_url(q1), {"answer": right1.id})
+            self.assertFalse(UserProgress.objects.filter(user=self.user, question=q1).exists())
+            status = self.client.get(f"/api/exam/{token}/").json()
+            self.assertTrue(status["expired"])
+            self.assertTrue(status["submitted"])
+            self.assertContains(self.client.get(f"/subject/{self.subject.id}/results/"), "Time's up")
+        attempt.refresh_from_db()
+        self.assertIsNotNone(attempt.submitted_at)
+        self.assertEqual((attempt.answered, attempt.correct), (1, 1))
+
+    def test_sweep_submits_expired_attempts(self):
+        self.client.get(self.question_url(self.qs[0][0]))
+        self.assertEqual(exams.submit_expired(), 0)
+        later = timezone.now() + timedelta(minutes=11)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(exams.submit_expired(later), 1)
+        self.assertIsNotNone(QuizAttempt.objects.get(user=self.user).submitted_at)
+        self.assertEqual(exams.submit_expired(later), 0)
+
+    def test_heartbeat_token_expires(self):
+        token = exams.heartbeat_token(42, 60)
+        self.assertEqual(exams.attempt_for_token(token), 42)
+        with mock.patch("django.core.signing.time.time", return_value=datetime.now().timestamp() + 61):
+            self.assertIsNone(exams.attempt_for_token(token))
+        self.assertIsNone(exams.attempt_for_token(token[:-1] + "x"))
+
+    def test_untimed(self):
+        Subject.objects.filter(pk=self.subject.pk).update(time_limit=None)
+        cache.clear()
+        self.assertNotContains(self.client.get(self.question_url(self.qs[0][0])), "data-exam-timer")
+        self.assertIsNone(QuizAttempt.objects.get(user=self.user).deadline)
+
+
+# ----------------- QUERY BUDGETS -----------------
+@override_settings(QUIZ_ANSWER_RECORDING={"MODE": "sync"})
+class QueryBudgetTests(QueryBudgetMixin, QuizTestCase):
+    """Every budgeted view stays within its budget, both for a new user with
+    nothing cached and every image field set, and once warm. Cold requests
+    only pay extra inside ``instrumentation.setup()``."""
+
+    questions = 5
+
+    def setUp(self):
+        super().setUp()
+        self.timed = Subject.objects.create(name="Chemistry", description="Atoms", time_limit=10)
+        for i in range(self.questions):
+            question = Question.objects.create(subject=self.timed, text_content=f"Timed {i} word", hint="h")
+            Option.objects.create(question=question, text_content="right", is_correct=True)
+            Option.objects.create(question=question, text_content="wrong")
+            Explanation.objects.create(question=question, text_content="because")
+        Subject.objects.update(logo_image="logos/logo.png")
+        Question.objects.update(image_content="questions/question.png")
+        Option.objects.update(image_content="options/option.png")
+        Explanation.objects.update(image_content="explanations/explanation.png")
+
+    def cold(self, path, method="get", data=None, **extra):
+        cold_caches()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.assertWithinQueryBudget(path, method, data, **extra)
+        self.assertLess(response.status_code, 400)
+        return response
+
+    def warm(self, path, method="get", data=None, **extra):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.assertWithinQueryBudget(path, method, data, **extra)
+        self.assertLess(response.status_code, 400)
+        return response
+
+    def both(self, path):
+        self.cold(path)
+        self.warm(path)
+
+    def answer_some(self, subject):
+        questions = list(Question.objects.filter(subject=subject).order_by("order", "id")[:2])
+        with self.captureOnCommitCallbacks(execute=True):
+            for question, correct in zip(questions, (False, True)):
+                option = question.options.get(is_correct=correct)
+                self.client.post(self.question_url(question, subject), {"answer": option.id})
+
+    def session_answers(self, subject, tag, count=100):
+        questions = list(Question.objects.filter(subject=subject).order_by("order", "id"))
+        answers = []
+        for i in range(count):
+            question = questions[i % len(questions)]
+            answers.append({
+                "client_id": f"{tag}{i}",
+                "question_id": question.id,
+                "option_id": question.options.get(is_correct=i % 2 == 0).id,
+            })
+        return json.dumps({"answers": answers})
+
+    def test_every_budgeted_view_is_tested(self):
+        budgeted = {
+            pattern.name for pattern in get_resolver("quiz_app.urls").url_patterns
+            if budget_for(pattern.callback) is not None
+        }
+        self.assertEqual(budgeted, {
+            "subject_list", "subject_questions", "question_detail", "results", "results_api", "dashboard",
+            "dashboard_api", "leaderboard", "subject_leaderboard", "leaderboard_api", "subject_leaderboard_api",
+            "search", "search_api", "session_questions", "session_answers", "exam_status",
+        })
+
+    def test_async_views_share_the_budgets(self):
+        for name in dir(views):
+            view = getattr(views, name)
+            if callable(view) and budget_for(view) is not None:
+                self.assertEqual(budget_for(getattr(async_views, name)), budget_for(view), name)
+
+    def test_over_budget_fails(self):
+        with mock.patch.object(views.subject_list, "query_budget", 0), \
+                mock.patch.object(async_views.subject_list, "query_budget", 0):
+            with self.assertRaises(AssertionError):
+                self.assertWithinQueryBudget("/")
+        with self.assertRaises(AssertionError):
+            self.assertWithinQueryBudget(f"/subject/{self.subject.id}/retake/", "post")
+
+    def test_subject_list(self):
+        self.answer_some(self.subject)
+        self.both("/")
+        self.client.logout()
+        self.both("/")
+
+    def test_subject_questions(self):
+        self.both(f"/subject/{self.subject.id}/")
+        self.login()
+        self.both(f"/subject/{self.timed.id}/")
+
+    def test_question_detail(self):
+        for subject in (self.subject, self.timed):
+            question = Question.objects.filter(subject=subject).order_by("order", "id").first()
+            self.login()
+            self.both(self.question_url(question, subject))
+
+    def test_question_detail_post(self):
+        for subject in (self.subject, self.timed):
+            question = Question.objects.filter(subject=subject).order_by("order", "id")[2]
+            for correct in (False, True):
+                option = question.options.get(is_correct=correct)
+                self.login()
+                self.cold(self.question_url(question, subject), "post", {"answer": option.id})
+                self.login()
+                self.client.get(self.question_url(question, subject))
+                self.warm(self.question_url(question, subject), "post", {"answer": option.id})
+
+    def test_question_detail_post_adaptive(self):
+        Subject.objects.filter(pk=self.subject.pk).update(selection_mode=Subject.ADAPTIVE, question_limit=3)
+        first = QuizAttempt.objects.get(pk=attempts.active_attempt_id(self.user, self.subject.id)).question_order[0]
+        question = Question.objects.get(pk=first)
+        self.warm(self.question_url(question), "post", {"answer": question.options.get(is_correct=False).id})
+        self.warm(self.question_url(question), "post", {"answer": question.options.get(is_correct=False).id})
+        self.assertEqual(len(QuizAttempt.objects.get(user=self.user, subject=self.subject).question_order), 2)
+
+    def test_question_page_only_writes_on_answer(self):
+        question = Question.objects.filter(subject=self.subject).order_by("order", "id").first()
+        self.warm(self.question_url(question))
+        self.assertFalse(UserProgress.objects.filter(user=self.user).exists())
+        self.warm(self.question_url(question), "post", {"answer": question.options.get(is_correct=False).id})
+        self.assertEqual(UserProgress.objects.get(user=self.user, question=question).attempts, 1)
+
+    def test_setup_queries_are_not_budgeted(self):
+        recorder = instrumentation.Recorder(10)
+        sample = instrumentation.Sample()
+        sample.queries, sample.setup_queries = 5, 3
+        recorder.add("view", sample, budget=2)
+        self.assertEqual(recorder.snapshot()[1], {})
+        sample.setup_queries = 2
+        with self.assertLogs("quiz_app.instrumentation", "WARNING"):
+            recorder.add("view", sample, budget=2)
+        self.assertEqual(recorder.snapshot()[1], {"view": 1})
+        with instrumentation.setup():
+            self.assertTrue(instrumentation.in_setup())
+        self.assertFalse(instrumentation.in_setup())
+        # A cold subject page builds its caches well past its budget of 2
+        self.cold(f"/subject/{self.subject.id}/")
+
+    def test_results(self):
+        # A new user's first visit creates their attempt
+        self.both(f"/api/subject/{self.subject.id}/results/")
+        self.login()
+        self.both(f"/subject/{self.subject.id}/results/")
+        for subject in (self.subject, self.timed):
+            self.login()
+            self.answer_some(subject)
+            self.both(f"/subject/{subject.id}/results/")
+            self.both(f"/api/subject/{subject.id}/results/")
+
+    def test_dashboard(self):
+        self.both("/dashboard/")
+        self.answer_some(self.subject)
+        self.both("/dashboard/")
+        self.both("/api/dashboard/")
+
+    def test_leaderboards(self):
+        self.answer_some(self.subject)
+        self.both("/leaderboard/")
+        self.both(f"/subject/{self.subject.id}/leaderboard/")
+        self.both("/api/leaderboard/")
+        self.both(f"/api/subject/{self.subject.id}/leaderboard/")
+        self.client.logout()
+        self.both("/leaderboard/")
+
+    def test_search(self):
+        self.both("/search/?q=word")
+        self.both("/api/search/?q=word")
+        self.client.logout()
+        self.both("/search/?q=word")
+
+    def test_session(self):
+        for subject in (self.subject, self.timed):
+            self.login()
+            self.both(f"/api/subject/{subject.id}/session/questions/")
+            for count in (1, 100):
+                url = f"/api/subject/{subject.id}/session/answers/"
+                self.login()
+                self.cold(url, "post", self.session_answers(subject, "cold", count), content_type="application/json")
+                self.login()
+                self.client.get(f"/api/subject/{subject.id}/session/questions/")
+                self.warm(url, "post", self.session_answers(subject, "warm", count),
+                          content_type="application/json")
+
+    def test_exam_status(self):
+        question = Question.objects.filter(subject=self.timed).order_by("order", "id").first()
+        token = self.client.get(self.question_url(question, self.timed)).context["exam"]["token"]
+        self.client.logout()
+        self.both(f"/api/exam/{token}/")
+
+
+# ----------------- BENCHMARKS -----------------
+class BenchmarkHelperTests(SimpleTestCase):
+    def test_summarise(self):
+        summary = benchmarking.summarise([i / 1000 for i in range(100, 0, -1)], elapsed=2.0, errors=1)
+        self.assertEqual((summary["requests"], summary["errors"], summary["rps"]), (100, 1, 50.0))
+        self.assertEqual((summary["p50_ms"], summary["p95_ms"], summary["p99_ms"]), (50.0, 95.0, 99.0))
+        self.assertEqual(benchmarking.summarise([], elapsed=0)["rps"], 0.0)
+
+    def test_compare(self):
+        baseline = {"scenarios": {
+            "browse": {"rps": 100, "p95_ms": 10, "queries_per_request": 3},
+            "answer": {"rps": 100, "p95_ms": 10, "queries_per_request": 5},
+        }}
+        report = {"scenarios": {
+            "browse": {"rps": 95, "p95_ms": 10.5, "queries_per_request": 3},
+            "answer": {"rps": 80, "p95_ms": 20, "queries_per_request": 6},
+            "results": {"rps": 1, "p95_ms": 1000, "queries_per_request": 50},
+        }}
+        regressions = benchmarking.compare(baseline, report)
+        self.assertEqual(
+            [(r["scenario"], r["metric"], r["change_pct"]) for r in regressions],
+            [("answer", "rps", -20.0), ("answer", "p95_ms", 100.0), ("answer", "queries_per_request", 20.0)],
+        )
+        self.assertEqual(benchmarking.compare(baseline, report, tolerance=150), regressions[2:])
+
+
+@override_settings(QUIZ_ANSWER_RECORDING={"MODE": "sync"})
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cold_caches()
+        recording.reset_writer()
+        self.counts = benchmarking.generate_data(subjects=2, questions=6, users=4, answered=0.5, coverage=1, seed=1)
+        self.workload = benchmarking.Workload()
+
+    def tearDown(self):
+        recording.reset_writer()
+        leaderboards.reset_backend()
+
+    def test_generate_data(self):
+        self.assertEqual(self.counts["attempts"], 8)
+        self.assertEqual(self.counts["progress"], UserProgress.objects.count())
+        self.assertEqual(Option.objects.filter(question__subject_id__in=self.workload.subject_ids).count(), 48)
+        self.assertEqual(UserSubjectSummary.objects.count(), 8)
+        self.assertEqual(benchmarking.generate_data(subjects=1, questions=1, users=1, seed=1)["subjects"], 1)
+        self.assertEqual(benchmarking.delete_data(), (3, 5))
+        self.assertFalse(Subject.objects.exists() or UserProgress.objects.exists())
+
+    def test_scenarios_are_repeatable(self):
+        for name in benchmarking.SCENARIOS:
+            requests = benchmarking.scenario_requests(name, self.workload, 5, seed=3)
+            self.assertEqual(requests, benchmarking.scenario_requests(name, self.workload, 5, seed=3))
+
+    def test_client_scenarios_stay_within_the_budgets(self):
+        users = benchmarking.benchmark_users(2)
+        for name in benchmarking.SCENARIOS:
+            summary = benchmarking.run_client_scenario(name, self.workload, users, iterations=5, warmup=5)
+            self.assertEqual(summary["errors"], 0, name)
+            self.assertGreater(summary["rps"], 0)
+            self.assertLessEqual(summary["max_queries"], budget_for(views.question_detail), name)
+
+    def test_benchmark_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            report = os.path.join(tmp, "report.json")
+            call_command("benchmark_quiz", scenarios="results", users=2, iterations=3, output=report, stdout=StringIO())
+            with open(report) as fh:
+                data = json.load(fh)
+            self.assertEqual(data["dataset"]["subjects"], 2)
+            self.assertIn("queries_per_request", data["scenarios"]["results"])
+
+            data["scenarios"]["results"]["queries_per_request"] = 0
+            with open(report, "w") as fh:
+                json.dump(data, fh)
+            with self.assertRaisesMessage(CommandError, "regressions"):
+                call_command("benchmark_quiz", scenarios="results", users=2, iterations=3, baseline=report,
+                             stdout=StringIO(), stderr=StringIO())
+
+
+# ----------------- TEMPLATE FRAGMENTS -----------------
+class FragmentTests(QuizTestCase):
+    def render(self, source, **context):
+        return Template("{% load quiz_fragments %}" + source).render(Context(context))
+
+    def test_cached_by_name_revision_version_and_vary_on(self):
+        source = '{% fragment "card" 1 version pk %}{{ text }}{% endfragment %}'
+        self.assertEqual(self.render(source, version=1, pk=1, text="a"), "a")
+        self.assertEqual(self.render(source, version=1, pk=1, text="b"), "a")
+        self.assertEqual(self.render(source, version=1, pk=2, text="b"), "b")
+        self.assertEqual(self.render(source, version=2, pk=1, text="c"), "c")
+        revised = '{% fragment "card" 2 version pk %}<b>{{ text }}</b>{% endfragment %}'
+        self.assertEqual(self.render(revised, version=2, pk=1, text="c"), "<b>c</b>")
+
+    def test_uncached(self):
+        source = '{% fragment "card" 1 version %}{{ text }}{% endfragment %}'
+        self.assertEqual(self.render(source, version=None, text="a"), "a")
+        self.assertEqual(self.render(source, version=None, text="b"), "b")
+        with override_settings(QUIZ_FRAGMENT_TIMEOUT=0):
+            self.render(source, version=1, text="a")
+            self.assertEqual(self.render(source, version=1, text="b"), "b")
+
+    def test_needs_a_revision(self):
+        for source in ('{% fragment "card" version %}{% endfragment %}', '{% fragment card 1 version %}{% endfragment %}'):
+            with self.assertRaises(TemplateSyntaxError):
+                self.render(source, version=1)
+
+    def test_question_page_keeps_per_user_state_out(self):
+        question, right, wrong = self.qs[0]
+        response = self.client.get(self.question_url(question))
+        self.assertContains(response, question.text_content)
+        self.assertContains(response, 'data-questions-url="')
+        question.text_content = "Changed"
+        with self.captureOnCommitCallbacks(execute=True):
+            question.save()
+        response = self.client.post(self.question_url(question), {"answer": wrong.id})
+        # The edit bumped the content version, so the body isn't served stale
+        self.assertContains(response, "Changed")
+        self.assertNotContains(response, "data-quiz-session")
+
+
+# ----------------- BACKGROUND TASKS -----------------
+_calls = []
+
+
+@tasks.task("tests.record", priority=tasks.NORMAL)
+def _record(n=0):
+    _calls.append(n)
+    return {"n": n}
+
+
+@tasks.task("tests.flaky", max_attempts=3)
+def _flaky():
+    raise RuntimeError("boom")
+
+
+@tasks.task("tests.permanent")
+def _permanent():
+    raise tasks.PermanentFailure("bad input")
+
+
+@override_settings(QUIZ_TASKS={"MODE": "queue"})
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        _calls.clear()
+
+    def test_claims_by_priority(self):
+        normal = tasks.enqueue("tests.record", {"n": 1})
+        high = tasks.enqueue("tests.record", {"n": 2}, priority=tasks.HIGH)
+        later = tasks.enqueue("tests.record", {"n": 3}, delay=60)
+        keyed = tasks.enqueue("tests.record", {"n": 4}, key="once")
+        self.assertEqual(tasks.enqueue("tests.record", {"n": 5}, key="once").pk, keyed.pk)
+        with self.assertRaises(LookupError):
+            tasks.enqueue("tests.missing")
+
+        claimed = tasks.claim("worker", 10)
+        self.assertEqual([job.pk for job in claimed], [high.pk, normal.pk, keyed.pk])
+        self.assertEqual(tasks.claim("other", 10), [])
+        for job in claimed:
+            self.assertEqual(tasks.run_job(job), Job.DONE)
+        self.assertEqual(_calls, [2, 1, 4])
+        self.assertEqual(Job.objects.get(pk=high.pk).result, {"n": 2})
+        self.assertEqual(Job.objects.get(pk=later.pk).status, Job.QUEUED)
+
+    def test_retries_with_backoff(self):
+        job = tasks.enqueue("tests.flaky")
+        [job] = tasks.claim("worker", 1)
+        with self.assertLogs("quiz_app.tasks", "ERROR"):
+            self.assertEqual(tasks.run_job(job), Job.QUEUED)
+        job.refresh_from_db()
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=4))
+        self.assertIn("boom", job.last_error)
+        for _ in range(2):
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+            [job] = tasks.claim("worker", 1)
+            with self.assertLogs("quiz_app.tasks", "ERROR"):
+                status = tasks.run_job(job)
+        self.assertEqual((status, job.attempts), (Job.FAILED, 3))
+        tasks.retry(Job.objects.filter(pk=job.pk))
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.QUEUED)
+
+    def test_permanent_failures(self):
+        tasks.enqueue("tests.permanent")
+        [job] = tasks.claim("worker", 1)
+        with self.assertLogs("quiz_app.tasks", "ERROR"):
+            self.assertEqual(tasks.run_job(job), Job.FAILED)
+        self.assertEqual(Job.objects.get(pk=job.pk).attempts, 1)
+        Job.objects.create(name="tests.unregistered")
+        [job] = tasks.claim("worker", 1)
+        with self.assertLogs("quiz_app.tasks", "ERROR"):
+            self.assertEqual(tasks.run_job(job), Job.FAILED)
+
+    def test_sweep(self):
+        job = tasks.enqueue("tests.record")
+        tasks.claim("dead", 1)
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=2))
+        old = Job.objects.create(name="tests.record", status=Job.DONE, finished_at=timezone.now() - timedelta(days=30))
+        self.assertEqual(tasks.sweep(), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.QUEUED)
+        self.assertFalse(Job.objects.filter(pk=old.pk).exists())
+
+    @override_settings(QUIZ_TASKS={"MODE": "inline"})
+    def test_inline(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = tasks.enqueue("tests.record", {"n": 7})
+        self.assertEqual(_calls, [7])
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.DONE)
+
+
+class JobAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", password="x"))
+        self.jobs = [Job.objects.create(name="tests.record", status=Job.FAILED) for _ in range(3)]
+
+    def test_pages_by_cursor_and_retries(self):
+        with mock.patch.object(admin.JobAdmin, "list_per_page", 2):
+            response = self.client.get("/admin/quiz_app/job/")
+        self.assertContains(response, f"?cursor={self.jobs[1].pk}")
+        self.assertNotContains(response, "?p=")
+        response = self.client.post("/admin/quiz_app/job/", {
+            "action": "retry_jobs", "_selected_action": [job.pk for job in self.jobs[:2]],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 2)
+
+    def test_every_cursor_admin_uses_the_cursor_paginator(self):
+        for model, model_admin in django_admin.site._registry.items():
+            if isinstance(model_admin, admin_pagination.CursorPaginationMixin):
+                response = self.client.get(f"/admin/quiz_app/{model._meta.model_name}/")
+                self.assertTemplateUsed(response, "admin/quiz_app/cursor_pagination.html")
+
+
+@override_settings(QUIZ_TASKS={"MODE": "queue"})
+class WorkerTests(TransactionTestCase):
+    def test_burst_runs_every_due_job(self):
+        for n in range(3):
+            tasks.enqueue("tests.record", {"n": n})
+        seen = []
+        # One thread, and a poll interval long enough that the loop only wakes when a job finishes
+        count = tasks.Worker(workers=1, poll_interval=5).run(burst=True, progress=lambda job, status: seen.append(status))
+        self.assertEqual(count, 3)
+        self.assertEqual(seen, [Job.DONE] * 3)
+        self.assertFalse(Job.objects.exclude(status=Job.DONE).exists())
+
+
+# ----------------- ANSWER ARCHIVE -----------------
+def _utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+@skipUnless(history.np is not None, "needs numpy")
+class HistoryTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.biology = Subject.objects.create(name="Biology")
+        self.chemistry = Subject.objects.create(name="Chemistry")
+        self.q1 = Question.objects.create(subject=self.biology, text_content="a", order=1)
+        self.q2 = Question.objects.create(subject=self.chemistry, text_content="b", order=1)
+        self.right = Option.objects.create(question=self.q1, text_content="right", is_correct=True)
+        self.wrong = Option.objects.create(question=self.q1, text_content="wrong")
+        self.u = User.objects.create_user("u")
+        self.v = User.objects.create_user("v")
+        rows = []
+        for day in range(1, 28, 3):
+            rows.append(Submission(user=self.u, question=self.q1, selected_option=self.right, submitted_at=_utc(2024, 1, day, 12)))
+            rows.append(Submission(user=self.v, question=self.q1, selected_option=self.wrong, submitted_at=_utc(2024, 2, day, 8, 30, 15)))
+            rows.append(Submission(user=self.v, question=self.q2, selected_option=None, submitted_at=_utc(2024, 1, day)))
+        rows.append(Submission(user=self.u, question=self.q1, selected_option=self.wrong, submitted_at=timezone.now()))
+        Submission.objects.bulk_create(rows)
+
+    def stats(self):
+        analytics.reconcile()
+        return (
+            list(QuestionStats.objects.order_by("pk").values_list("question_id", "submissions")),
+            list(OptionStats.objects.order_by("pk").values_list("option_id", "selections")),
+        )
+
+    def round_trip(self, compress):
+        with override_settings(QUIZ_HISTORY={"ROOT": self.root, "COMPRESS": compress, "BATCH_SIZE": 4}):
+            before = self.stats()
+            self.assertEqual(history.archive(), 27)
+            self.assertEqual(Submission.objects.count(), 1)
+            self.assertEqual(
+                [(p.subject_id, p.month.month) for p in history.partitions()],
+                [(self.biology.id, 1), (self.biology.id, 2), (self.chemistry.id, 1)],
+            )
+            self.assertEqual(self.stats(), before)
+
+            self.assertEqual(history.count_by("user"), {self.u.id: 9, self.v.id: 18})
+            self.assertEqual(history.count_by("question", users=[self.v.id]), {self.q1.id: 9, self.q2.id: 9})
+            counts = history.count_by(
+                "option", subject_ids=[self.biology.id], since=_utc(2024, 1, 10), until=_utc(2024, 2, 5)
+            )
+            self.assertEqual(sum(counts.values()), 8)
+            [(_, data)] = history.scan(["submitted_at"], subject_ids=[self.biology.id], options=[self.wrong.id])
+            self.assertEqual(str(data["submitted_at"][0]), "2024-02-01T08:30:15")
+
+            # A late row merges into its month; archiving again moves nothing
+            Submission.objects.create(user=self.u, question=self.q1, selected_option=self.right, submitted_at=_utc(2024, 1, 28))
+            self.assertEqual(history.archive(), 1)
+            self.assertEqual(history.count_by("user", subject_ids=[self.biology.id])[self.u.id], 10)
+            self.assertEqual(self.stats()[0][0][1], before[0][0][1] + 1)
+            self.assertEqual(history.archive(), 0)
+
+    def test_round_trip(self):
+        self.round_trip(compress=False)
+
+    def test_round_trip_compressed(self):
+        self.round_trip(compress=True)
+
+    def test_command(self):
+        with override_settings(QUIZ_HISTORY={"ROOT": self.root}):
+            call_command("archive_submissions", "--before", "2024-02", stdout=StringIO())
+            self.assertEqual(Submission.objects.count(), 10)
@@ -1,23 +1,58 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
+
+# 🔹 Quiz views: native async under ASGI when QUIZ_ASYNC_VIEWS is on
+quiz_views = async_views if settings.QUIZ_ASYNC_VIEWS else views
 
 urlpatterns = [
     # 🔹 Login Page
     path("login/", views.custom_login, name="login"),
 
     # 🔹 Subject List (Homepage after login)
-    path("", views.subject_list, name="subject_list"),
+    path("", quiz_views.subject_list, name="subject_list"),
 
     # 🔹 Subject -> Questions
-    path("subject/<int:subject_id>/", views.subject_questions, name="subject_questions"),
+    path("subject/<int:subject_id>/", quiz_views.subject_questions, name="subject_questions"),
 
     # 🔹 Question Detail (per subject)
     path(
         "subject/<int:subject_id>/question/<int:question_id>/",
-        views.question_detail,
+        quiz_views.question_detail,
         name="question_detail",
     ),
 
+    # 🔹 Retake (archives the current attempt)
+    path("subject/<int:subject_id>/retake/", quiz_views.retake, name="retake"),
+
     # 🔹 Results Page
-    path("subject/<int:subject_id>/results/", views.results, name="results"),
-]
\ No newline at end of file
+    path("subject/<int:subject_id>/results/", quiz_views.results, name="results"),
+
+    # 🔹 Results API (same data as the results page, as JSON)
+    path("api/subject/<int:subject_id>/results/", quiz_views.results_api, name="results_api"),
+
+    # 🔹 Dashboard (progress across all subjects) and its JSON API
+    path("dashboard/", quiz_views.dashboard, name="dashboard"),
+    path("api/dashboard/", quiz_views.dashboard_api, name="dashboard_api"),
+
+    # 🔹 Leaderboards (global and per subject) and their JSON API
+    path("leaderboard/", quiz_views.leaderboard, name="leaderboard"),
+    path("subject/<int:subject_id>/leaderboard/", quiz_views.leaderboard, name="subject_leaderboard"),
+    path("api/leaderboard/", quiz_views.leaderboard_api, name="leaderboard_api"),
+    path("api/subject/<int:subject_id>/leaderboard/", quiz_views.leaderboard_api, name="subject_leaderboard_api"),
+
+    # 🔹 Question Search and its JSON API
+    path("search/", quiz_views.search_questions, name="search"),
+    path("api/search/", quiz_views.search_api, name="search_api"),
+
+    # 🔹 Quiz Session API (prefetched questions, batched answers)
+    path("api/subject/<int:subject_id>/session/questions/", quiz_views.session_questions, name="session_questions"),
+    path("api/subject/<int:subject_id>/session/answers/", quiz_views.session_answers, name="session_answers"),
+
+    # 🔹 Exam heartbeat for timed subjects (signed attempt token, no session)
+    path("api/exam/<str:token>/", quiz_views.exam_status, name="exam_status"),
+]
+
+if settings.QUIZ_ASYNC_VIEWS:
+    # 🔹 Exam heartbeat as a server-sent events stream (ASGI only: it holds the connection open)
+    urlpatterns.append(path("api/exam/<str:token>/events/", async_views.exam_events, name="exam_events"))
@@ -1,10 +1,18 @@
 # views.py
 # views.py
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import render, redirect
 from django.urls import reverse
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404
 from django.contrib.auth.decorators import login_required
-from .models import Subject, Question, Explanation, UserProgress
+from django.views.decorators.http import require_POST
+from . import attempts, exams, leaderboards, search, selection, session, summaries
+from .models import UserProgress
+from .catalogue import get_catalogue
+from .db import replica_reads
+from .instrumentation import query_budget
+from .manifest import get_manifest_or_404
+from .scoring import MAX_ATTEMPTS, compute_results
+from .recording import record_answer
 
 def custom_login(request):
     if request.method == "POST":
@@ -16,154 +24,370 @@ def custom_login(request):
             return redirect("subject_list")
     return render(request, "login.html")
 # ----------------- SUBJECT LIST -----------------
+@query_budget(3)
 def subject_list(request):
-    subjects = Subject.objects.all()
+    subjects = get_catalogue(request.user)
     return render(request, "subject_list.html", {"subjects": subjects})
 
 
 # ----------------- START QUIZ -----------------
+def _attempt_id(user, subject_id):
+    # Anonymous users get the subject's own order
+    return attempts.active_attempt_id(user, subject_id) if user.is_authenticated else None
+
+
+@query_budget(2)
 def subject_questions(request, subject_id):
-    subject = get_object_or_404(Subject, id=subject_id)
-    first_question = subject.question_set.first()
-    if first_question:
-        return redirect("question_detail", subject_id=subject_id, question_id=first_question.id)
-    return render(request, "no_questions.html", {"subject": subject})
+    manifest = get_manifest_or_404(subject_id)
+    first_question_id = selection.get_order(subject_id, _attempt_id(request.user, subject_id)).first_id
+    if first_question_id:
+        return redirect("question_detail", subject_id=subject_id, question_id=first_question_id)
+    return render(request, "no_questions.html", {"subject": manifest["subject"]})
 
 
 # ----------------- QUESTION DETAIL -----------------
-@login_required(login_url="login")
-def question_detail(request, subject_id, question_id):
-    subject = get_object_or_404(Subject, id=subject_id)
-    question = get_object_or_404(Question, id=question_id, subject=subject)
-    options = question.options.all()
-    explanation = getattr(question, "explanation", None)
+# The helpers below hold everything about a question page that doesn't touch
+# the database, so the sync view here and the async one in async_views.py
+# only differ in how they read and write the progress row.
 
-    # Next question
-    next_question = Question.objects.filter(
-        subject=subject, id__gt=question.id
-    ).order_by("id").first()
+def _question_or_404(manifest, question_id):
+    question = manifest["questions"].get(question_id)
+    if question is None:
+        raise Http404("No Question matches the given query.")
+    return question
 
-    # Track progress
-    progress, _ = UserProgress.objects.get_or_create(
-        user=request.user, subject=subject, question=question
+
+def _check_selected(index, question_id):
+    if question_id not in index:
+        raise Http404("This question is not part of your current attempt.")
+
+
+def _finishes_question(index, progress, selected_option):
+    # Adaptive attempts pick their next question once this one is done with
+    return index.adaptive and (selected_option["is_correct"] or progress.attempts >= MAX_ATTEMPTS)
+
+
+def _selected_option(request, options):
+    """Return the posted option, or None if nothing was selected."""
+    selected_option_id = request.POST.get("answer")
+    if not selected_option_id:
+        return None
+    selected_option = next(
+        (opt for opt in options if str(opt["id"]) == selected_option_id), None
     )
+    if selected_option is None:
+        raise Http404("No Option matches the given query.")
+    return selected_option
 
-    feedback, show_hint_option = None, False
-    highlight_correct, highlight_wrong = False, False
-    wrong_option_ids, show_next = [], False
 
-    if request.method == "POST":
-        selected_option_id = request.POST.get("answer")
-
-        if not selected_option_id:
-            feedback = {
-                "type": "warning",
-                "icon": "exclamation-triangle",
-                "title": "No Answer Selected",
-                "message": "Please select an option before submitting.",
-            }
-        else:
-            selected_option = get_object_or_404(options, id=selected_option_id)
-
-            # Update progress
-            is_correct = selected_option.is_correct
-            progress.attempts += 1
-            progress.answered_correctly = is_correct
-            progress.selected_option = selected_option
-            progress.save(update_fields=["attempts", "answered_correctly", "selected_option"])
-
-            if is_correct:
-                # ✅ Auto redirect to next question or results
-                if request.headers.get("x-requested-with") == "XMLHttpRequest":
-                    next_url = (
-                        reverse("question_detail", args=[subject.id, next_question.id])
-                        if next_question else reverse("results", args=[subject.id])
-                    )
-                    return JsonResponse({
-                        "auto_redirect": True,
-                        "next_url": next_url,
-                        "next_is_finish": next_question is None,
-                    })
-                return redirect("question_detail", subject.id, next_question.id) if next_question else redirect("results", subject.id)
-
-            else:
-                # ❌ Wrong answer → Show hint + retry (max 2 attempts)
-                if progress.attempts == 1:
-                    feedback = {
-                        "type": "error",
-                        "icon": "times-circle",
-                        "title": "Wrong Answer",
-                        "message": "That's not correct. Try again or use a hint.",
-                    }
-                    show_hint_option = True
-                    wrong_option_ids.append(selected_option.id)
-
-                elif progress.attempts >= 2:
-                    correct_option = next(opt for opt in options if opt.is_correct)
-                    feedback = {
-                        "type": "error",
-                        "icon": "times-circle",
-                        "title": "Attempts Completed",
-                        "message": f"The correct answer is: {correct_option.text_content}",
-                        "explanation": explanation.text_content if explanation else None,
-                    }
-                    highlight_correct, highlight_wrong, show_next = True, True, True
-                    wrong_option_ids = [opt.id for opt in options if not opt.is_correct]
+def _hint_used(request):
+    # Set by the "Show Hint" button in quiz.html
+    return request.POST.get("hint_used") == "1"
+
+
+def _no_answer_state():
+    return {
+        "feedback": {
+            "type": "warning",
+            "icon": "exclamation-triangle",
+            "title": "No Answer Selected",
+            "message": "Please select an option before submitting.",
+        },
+    }
+
+
+def _correct_answer_response(request, subject_id, next_id):
+    # ✅ Auto redirect to next question or results
+    if request.headers.get("x-requested-with") == "XMLHttpRequest":
+        next_url = (
+            reverse("question_detail", args=[subject_id, next_id])
+            if next_id else reverse("results", args=[subject_id])
+        )
+        return JsonResponse({
+            "auto_redirect": True,
+            "next_url": next_url,
+            "next_is_finish": next_id is None,
+        })
+    return redirect("question_detail", subject_id, next_id) if next_id else redirect("results", subject_id)
+
+
+def _wrong_answer_state(attempts, selected_option, options, explanation):
+    # ❌ Wrong answer → Show hint + retry (max 2 attempts)
+    if attempts == 1:
+        return {
+            "feedback": {
+                "type": "error",
+                "icon": "times-circle",
+                "title": "Wrong Answer",
+                "message": "That's not correct. Try again or use a hint.",
+            },
+            "show_hint_option": True,
+            "wrong_option_ids": [selected_option["id"]],
+        }
 
+    correct_option = next(opt for opt in options if opt["is_correct"])
+    return {
+        "feedback": {
+            "type": "error",
+            "icon": "times-circle",
+            "title": "Attempts Completed",
+            "message": f"The correct answer is: {correct_option['text_content']}",
+            "explanation": explanation["text_content"] if explanation else None,
+        },
+        "highlight_correct": True,
+        "highlight_wrong": True,
+        "show_next": True,
+        "wrong_option_ids": [opt["id"] for opt in options if not opt["is_correct"]],
+    }
+
+
+def _finished_state(progress, options, explanation):
+    # 🔒 The question takes no more answers: show how it ended
+    if not progress.answered_correctly:
+        return _wrong_answer_state(progress.attempts, None, options, explanation)
+    return {
+        "feedback": {
+            "type": "info",
+            "icon": "check-circle",
+            "title": "Already Answered",
+            "message": "You answered this question correctly.",
+        },
+        "highlight_correct": True,
+        "show_next": True,
+    }
+
+
+def _new_progress(user, subject_id, question_id, attempt_id):
+    # Unsaved: showing a question writes nothing, the first answer inserts the row
+    return UserProgress(user=user, subject_id=subject_id, question_id=question_id, attempt_id=attempt_id)
+
+
+def _question_context(manifest, index, question, progress, state, attempt_id, exam=None):
+    questions = manifest["questions"]
+    previous_id, next_id = index.previous_id(question["id"]), index.next_id(question["id"])
     context = {
-        "subject": subject,
+        "subject": manifest["subject"],
+        "content_version": manifest.get("version"),
         "question": question,
-        "options": options,
-        "feedback": feedback,
-        "show_hint_option": show_hint_option,
-        "highlight_correct": highlight_correct,
-        "highlight_wrong": highlight_wrong,
-        "wrong_option_ids": wrong_option_ids,
-        "show_next": show_next,
-        "next_question": next_question,
-        "current_question": question.id,
-        "total_questions": subject.question_set.count(),
+        "options": index.options(question),
+        "hint": question["hint"],
+        "feedback": None,
+        "show_hint_option": False,
+        "highlight_correct": False,
+        "highlight_wrong": False,
+        "wrong_option_ids": [],
+        "show_next": False,
+        "previous_question": questions[previous_id] if previous_id else None,
+        "next_question": questions[next_id] if next_id else None,
+        "current_question": index.position(question["id"]),
+        "total_questions": len(index),
         "attempts": progress.attempts,
         "max_attempts": 2,
-        
+        "adaptive": index.adaptive,
+        "attempt_id": attempt_id,
+        "exam": exam,
     }
+    context.update(state)
+    return context
+
+
+# An answer records in 10 queries; an adaptive attempt picks its next question in 4 more
+@query_budget(14)
+@login_required(login_url="login")
+def question_detail(request, subject_id, question_id):
+    # Question content comes from the cached subject manifest; the only
+    # database work left here is the user's progress row.
+    manifest = get_manifest_or_404(subject_id)
+    question = _question_or_404(manifest, question_id)
+    attempt_id = attempts.active_attempt_id(request.user, subject_id)
+    index = selection.get_order(subject_id, attempt_id)
+    _check_selected(index, question_id)
+    exam = exams.status(attempt_id)
+    if exam["expired"]:
+        # ⏰ Time is up: the exam is submitted → results
+        return _correct_answer_response(request, subject_id, None)
+
+    # Track progress
+    progress = UserProgress.objects.filter(
+        user=request.user, subject_id=subject_id, question_id=question_id,
+    ).first() or _new_progress(request.user, subject_id, question_id, attempt_id)
+
+    state = {}
+    if request.method == "POST":
+        selected_option = _selected_option(request, question["options"])
+        if selected_option is None:
+            state = _no_answer_state()
+        # Update progress; a finished question records nothing, like the session API
+        elif record_answer(
+            progress, selected_option["id"], selected_option["is_correct"], _hint_used(request)
+        ) is None:
+            state = _finished_state(progress, question["options"], question["explanation"])
+        else:
+            if _finishes_question(index, progress, selected_option):
+                index = selection.advance(subject_id, attempt_id, question_id, selected_option["is_correct"])
+            if selected_option["is_correct"]:
+                return _correct_answer_response(request, subject_id, index.next_id(question_id))
+            state = _wrong_answer_state(
+                progress.attempts, selected_option, question["options"], question["explanation"]
+            )
+
+    context = _question_context(
+        manifest, index, question, progress, state, attempt_id, exams.page_context(attempt_id, exam)
+    )
     return render(request, "quiz.html", context)
 
 
 # ----------------- RESULTS -----------------
+@query_budget(3)
 @login_required(login_url="login")
 def results(request, subject_id):
-    subject = get_object_or_404(Subject, id=subject_id)
-    user_id = request.user.pk
-
-    progress_list = UserProgress.objects.filter(
-        user_id=user_id, subject=subject
-    ).select_related("question")
-
-    total_questions = subject.question_set.count()
-    correct_answers = progress_list.filter(answered_correctly=True).count()
-    score_percentage = int((correct_answers / total_questions) * 100) if total_questions > 0 else 0
-
-    results = []
-    for progress in progress_list:
-        question_text = progress.question.text_content or "Unnamed Question"
-        if progress.answered_correctly:
-            status = "Correct"
-        elif progress.attempts >= 2:
-            status = "Incorrect"
-        else:
-            status = "Incomplete"
-        results.append({
-            "question_text": question_text,
-            "attempts": progress.attempts,
-            "hints_used": progress.hint_used,
-            "status": status,
-        })
+    subject = get_manifest_or_404(subject_id)["subject"]
+    attempt_id = attempts.active_attempt_id(request.user, subject_id)
+    exam = exams.status(attempt_id)
+    order = selection.get_order(subject_id, attempt_id)
+    summary = compute_results(request.user, subject_id, order.question_ids)
 
     return render(request, "results.html", {
         "subject": subject,
-        "results": results,
-        "total_questions": total_questions,
-        "correct_answers": correct_answers,
-        "score_percentage": score_percentage,
+        "exam": exam if exam["timed"] else None,
+        "results": summary["results"],
+        "summary": summary,
+        "total_questions": summary["total_questions"],
+        "correct_answers": summary["correct"],
+        "score_percentage": summary["score_percentage"],
     })
+
+
+@login_required(login_url="login")
+@require_POST
+def retake(request, subject_id):
+    # 🔁 Archive the current attempt and start the subject over
+    get_manifest_or_404(subject_id)
+    attempts.start_new(request.user, subject_id)
+    return redirect("subject_questions", subject_id)
+
+
+@query_budget(3)
+def results_api(request, subject_id):
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+    subject = get_manifest_or_404(subject_id)["subject"]
+    attempt_id = attempts.active_attempt_id(request.user, subject_id)
+    exam = exams.status(attempt_id)
+    order = selection.get_order(subject_id, attempt_id)
+    summary = compute_results(request.user, subject_id, order.question_ids)
+    return JsonResponse({"subject": {"id": subject["id"], "name": subject["name"]}, "exam": exam, **summary})
+
+
+# ----------------- DASHBOARD -----------------
+# Read from the per-subject summaries (summaries.py) and the cached catalogue,
+# never from the user's UserProgress rows.
+
+@query_budget(3)
+@login_required(login_url="login")
+def dashboard(request):
+    progress = summaries.dashboard(get_catalogue(), summaries.for_user(request.user))
+    return render(request, "dashboard.html", {"dashboard": progress})
+
+
+@query_budget(3)
+def dashboard_api(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+    return JsonResponse(summaries.dashboard(get_catalogue(), summaries.for_user(request.user)))
+
+
+# ----------------- LEADERBOARDS -----------------
+# Served from the sorted boards in leaderboards.py; ?page=N pages through ranks.
+
+def _page_number(request):
+    page = request.GET.get("page", "1")
+    return int(page) if page.isdigit() else 1
+
+
+def _leaderboard_page(request, subject_id=None):
+    """Return ``(board subject or None, page data)``."""
+    subject = get_manifest_or_404(subject_id)["subject"] if subject_id else None
+    board = leaderboards.subject_board(subject_id) if subject_id else leaderboards.GLOBAL
+    return subject, leaderboards.page(board, _page_number(request), request.user)
+
+
+@query_budget(3)
+def leaderboard(request, subject_id=None):
+    subject, board = _leaderboard_page(request, subject_id)
+    return render(request, "leaderboard.html", {"subject": subject, "leaderboard": board})
+
+
+@query_budget(3)
+def leaderboard_api(request, subject_id=None):
+    _, board = _leaderboard_page(request, subject_id)
+    return JsonResponse(board)
+
+
+# ----------------- SEARCH -----------------
+# Ranked full-text search over the question bank (search.py); ?q=words,
+# optional ?subject=id, ?page=N.
+
+def _search_page(request):
+    subject = request.GET.get("subject", "")
+    subject_id = int(subject) if subject.isdigit() else None
+    return search.search_page(request.GET.get("q", "").strip(), subject_id, _page_number(request))
+
+
+@query_budget(3)
+def search_questions(request):
+    return render(request, "search.html", {"search": _search_page(request), "subjects": get_catalogue()})
+
+
+@query_budget(1)
+@replica_reads
+def search_api(request):
+    return JsonResponse(_search_page(request))
+
+
+# ----------------- EXAM HEARTBEAT -----------------
+# Polled by static/js/quiz.js on timed subjects. The signed token names the
+# attempt, so a heartbeat is a cache read: no session, user or progress lookup.
+
+def _exam_attempt_or_404(token):
+    attempt_id = exams.attempt_for_token(token)
+    if attempt_id is None:
+        raise Http404("No exam matches the given token.")
+    return attempt_id
+
+
+@query_budget(0)
+def exam_status(request, token):
+    return JsonResponse(exams.status(_exam_attempt_or_404(token)))
+
+
+# ----------------- QUIZ SESSION API -----------------
+# Used by the prefetching client in static/js/quiz.js: upcoming questions in
+# batches, and queued answers graded in bulk (see session.py).
+
+@query_budget(3)
+def session_questions(request, subject_id):
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+    manifest = get_manifest_or_404(subject_id)
+    index = selection.get_order(subject_id, attempts.active_attempt_id(request.user, subject_id))
+    try:
+        question_ids = session.window(index, request.GET.get("start"), request.GET.get("count"))
+    except session.InvalidRequest as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    progress = session.progress_for(request.user, question_ids)
+    return JsonResponse(session.question_batch(manifest, index, question_ids, progress))
+
+
+@query_budget(13)
+@require_POST
+def session_answers(request, subject_id):
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+    manifest = get_manifest_or_404(subject_id)
+    try:
+        answers = session.parse_answers(request.body)
+    except session.InvalidRequest as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    results = session.grade_answers(request.user, subject_id, manifest, answers)
+    return JsonResponse({"results": results})
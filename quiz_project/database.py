@@ -0,0 +1,115 @@
+"""
+Environment-driven database configuration for quiz_project.
+
+``settings.py`` calls :func:`database_settings` so the backend can be picked
+per deployment without editing code:
+
+    QUIZ_DB_ENGINE          sqlite (default), postgresql or mssql
+    QUIZ_DB_NAME            database name, or file path for SQLite
+    QUIZ_DB_USER / QUIZ_DB_PASSWORD / QUIZ_DB_HOST / QUIZ_DB_PORT
+    QUIZ_DB_CONN_MAX_AGE    seconds to keep server connections open (default 60)
+    QUIZ_DB_POOL            "1" to use a driver-level connection pool
+    QUIZ_DB_POOL_MIN / QUIZ_DB_POOL_MAX
+    QUIZ_DB_BUSY_TIMEOUT    SQLite busy timeout in milliseconds (default 20000)
+    QUIZ_SQLITE_JOURNAL_MODE  e.g. WAL for deployments; unset leaves the file's mode alone
+    QUIZ_SQLITE_SYNCHRONOUS   with a journal mode set (default NORMAL under WAL)
+    QUIZ_DB_REPLICA_NAME    enables the "replica" alias (for SQLite, a second file)
+    QUIZ_DB_REPLICA_HOST    replica host for server databases
+
+SQLite pragmas are applied per connection by ``quiz_app.db``; read-replica
+routing is done by ``quiz_app.db.ReplicaRouter``.
+"""
+import os
+
+REPLICA = 'replica'
+
+ENGINES = {
+    'sqlite': 'django.db.backends.sqlite3',
+    'postgresql': 'django.db.backends.postgresql',
+    'mssql': 'mssql',
+}
+
+
+def _flag(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def _server_database(engine, env):
+    config = {
+        'ENGINE': ENGINES[engine],
+        'NAME': env.get('QUIZ_DB_NAME', 'quiz'),
+        'USER': env.get('QUIZ_DB_USER', ''),
+        'PASSWORD': env.get('QUIZ_DB_PASSWORD', ''),
+        'HOST': env.get('QUIZ_DB_HOST', ''),
+        'PORT': env.get('QUIZ_DB_PORT', ''),
+        # Persistent connections, verified before reuse after a request
+        'CONN_MAX_AGE': int(env.get('QUIZ_DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    pooled = _flag(env.get('QUIZ_DB_POOL', ''))
+
+    if engine == 'postgresql' and pooled:
+        # psycopg 3 pool (Django 5.1+); incompatible with persistent connections
+        config['CONN_MAX_AGE'] = 0
+        config['OPTIONS']['pool'] = {
+            'min_size': int(env.get('QUIZ_DB_POOL_MIN', 2)),
+            'max_size': int(env.get('QUIZ_DB_POOL_MAX', 10)),
+        }
+    elif engine == 'mssql':
+        config['OPTIONS'] = {
+            'driver': env.get('QUIZ_DB_DRIVER', 'ODBC Driver 17 for SQL Server'),
+            'extra_params': 'Encrypt=yes;TrustServerCertificate=no',
+        }
+        if pooled:
+            # pyodbc hands connections back to the ODBC driver manager pool on
+            # close, so let Django close them after every request.
+            config['CONN_MAX_AGE'] = 0
+    return config
+
+
+def database_settings(base_dir, env=os.environ):
+    engine = env.get('QUIZ_DB_ENGINE', 'sqlite')
+    if engine not in ENGINES:
+        raise ValueError(f"Unsupported QUIZ_DB_ENGINE {engine!r}; expected one of {sorted(ENGINES)}")
+
+    if engine == 'sqlite':
+        default = {
+            'ENGINE': ENGINES['sqlite'],
+            'NAME': env.get('QUIZ_DB_NAME', base_dir / 'db.sqlite3'),
+            # Seconds the sqlite3 module waits on a locked database, so writers
+            # queue instead of failing with "database is locked"
+            'OPTIONS': {'timeout': int(env.get('QUIZ_DB_BUSY_TIMEOUT', 20000)) / 1000},
+        }
+    else:
+        default = _server_database(engine, env)
+
+    databases = {'default': default}
+
+    replica_name = env.get('QUIZ_DB_REPLICA_NAME')
+    replica_host = env.get('QUIZ_DB_REPLICA_HOST')
+    if replica_name or replica_host:
+        replica = {**default, 'OPTIONS': dict(default['OPTIONS'])}
+        if replica_name:
+            replica['NAME'] = replica_name
+        if replica_host:
+            replica['HOST'] = replica_host
+        # Tests read through the primary connection instead of a second database
+        replica['TEST'] = {'MIRROR': 'default'}
+        databases[REPLICA] = replica
+
+    return databases
+
+
+def sqlite_pragmas(env=os.environ):
+    # The busy timeout is the connection's 'timeout' option (database_settings)
+    pragmas = {}
+    # The journal mode is stored in the database file, so it is opt-in: the
+    # checked-in development database keeps its rollback journal.
+    journal_mode = env.get('QUIZ_SQLITE_JOURNAL_MODE')
+    if journal_mode:
+        pragmas['journal_mode'] = journal_mode
+        # NORMAL is only safe from corruption on power loss under WAL
+        default_sync = 'NORMAL' if journal_mode.upper() == 'WAL' else 'FULL'
+        pragmas['synchronous'] = env.get('QUIZ_SQLITE_SYNCHRONOUS', default_sync)
+    return pragmas
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
+
+from .database import database_settings, sqlite_pragmas
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -41,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the timings include the rest of the stack; off unless sampling
+    'quiz_app.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +56,8 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'quiz_project.urls'
 
+# No 'loaders' option: Django then compiles each template once per process
+# (the cached loader), in development as well.
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -70,17 +76,101 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'quiz_project.wsgi.application'
 
+# Serve the quiz views from quiz_app/async_views.py (native async, for ASGI
+# servers such as uvicorn) instead of the sync ones in quiz_app/views.py.
+QUIZ_ASYNC_VIEWS = os.environ.get('QUIZ_ASYNC_VIEWS', '').lower() in ('1', 'true', 'yes')
+
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
+# Configured from QUIZ_DB_* environment variables, see quiz_project/database.py.
+# Defaults to the SQLite file below.
+
+DATABASES = database_settings(BASE_DIR)
+
+DATABASE_ROUTERS = ['quiz_app.db.ReplicaRouter']
+
+QUIZ_SQLITE_PRAGMAS = sqlite_pragmas()
+
+
+# Cache
+# Subject manifests and other quiz read models are cached here. Point this at
+# a shared backend (Redis/Memcached) in production so all workers agree on
+# cache versions.
 
-DATABASES = {
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',  # Path to the SQLite database file
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+QUIZ_MANIFEST_TIMEOUT = 60 * 60 * 24
+
+# Rendered template fragments shared by all users (question bodies, option
+# bodies, subject cards), keyed by the content version of the manifest or
+# catalogue they come from; 0 renders them on every request.
+QUIZ_FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+# Answer recording: 'buffered' batches Submission inserts (flushed by size or
+# time, and at shutdown); 'sync' writes each one inline.
+QUIZ_ANSWER_RECORDING = {
+    'MODE': os.environ.get('QUIZ_ANSWER_RECORDING_MODE', 'buffered'),
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 2.0,
+}
+
+# Leaderboards: 'local' keeps sorted boards per process and reloads them from
+# the database every RECONCILE_INTERVAL seconds; 'redis' shares them through
+# sorted sets at QUIZ_LEADERBOARD_URL (reconcile with reconcile_leaderboards).
+QUIZ_LEADERBOARD = {
+    'BACKEND': os.environ.get('QUIZ_LEADERBOARD_BACKEND', 'local'),
+    'URL': os.environ.get('QUIZ_LEADERBOARD_URL'),
+    'RECONCILE_INTERVAL': 300,
+}
+
+# Question search: 'auto' uses SQLite FTS5 or PostgreSQL full-text search,
+# whichever matches the database (see quiz_app/search.py); rebuild the index
+# with rebuild_search_index.
+QUIZ_SEARCH = {
+    'BACKEND': os.environ.get('QUIZ_SEARCH_BACKEND', 'auto'),
+}
+
+# Timed exams (subjects with a time limit): the page counts down locally and
+# checks in every HEARTBEAT_INTERVAL seconds; answers are accepted up to
+# GRACE_SECONDS past the deadline. Run submit_expired_exams from cron to
+# close exams nobody came back to.
+QUIZ_EXAM = {
+    'HEARTBEAT_INTERVAL': 30,
+    'GRACE_SECONDS': 5,
+}
+
+# Background jobs (image derivatives, question bank imports, stats rollups)
+# are queued in the database, see quiz_app/tasks.py. By default they run in
+# the request once it commits, so development needs no worker. Deployments
+# set QUIZ_TASKS_MODE=queue and keep `manage.py run_tasks` running.
+QUIZ_TASKS = {
+    'MODE': os.environ.get('QUIZ_TASKS_MODE', 'inline'),
+    'WORKERS': 4,
+    'FILE_DIR': BASE_DIR / 'task_files',
+}
+
+# Submissions older than RETENTION_DAYS (whole months) move out of the table
+# into NumPy column files per subject and month under ROOT, see
+# quiz_app/history.py. Run archive_submissions from cron; needs numpy.
+QUIZ_HISTORY = {
+    'ROOT': BASE_DIR / 'history',
+    'RETENTION_DAYS': 365,
+    'COMPRESS': False,
+}
+
+# Per-view wall time, queries, template time and cache hit rate for a share
+# of requests (see quiz_app/instrumentation.py), readable by staff at
+# /admin/instrumentation/. A SAMPLE_RATE of 0 removes the middleware.
+QUIZ_INSTRUMENTATION = {
+    'SAMPLE_RATE': float(os.environ.get('QUIZ_INSTRUMENTATION_SAMPLE_RATE', '0')),
+    'BUFFER_SIZE': 1000,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -125,4 +215,19 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Serve static files and media from Django with long-lived caching (see
+# quiz_app/serving.py). Static files get fingerprinted names and .gz/.br
+# copies at collectstatic time, so run collectstatic after turning this on.
+QUIZ_SERVE_ASSETS = os.environ.get('QUIZ_SERVE_ASSETS', '').lower() in ('1', 'true', 'yes')
+
+if QUIZ_SERVE_ASSETS:
+    STORAGES = {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'quiz_app.storage.CompressedManifestStaticFilesStorage'},
+    }
+
+# Uploaded images are re-encoded (AVIF/WebP) at these widths by a background
+# job, see quiz_app/images.py.
+QUIZ_IMAGE_WIDTHS = (320, 640, 1024)
+
 
@@ -15,14 +15,26 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+import re
+
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from quiz_app import instrumentation, serving
+
 urlpatterns = [
+    # Per-view timings from InstrumentationMiddleware (staff only)
+    path('admin/instrumentation/', admin.site.admin_view(instrumentation.stats_view), name='instrumentation'),
     path('admin/', admin.site.urls),
     path('', include('quiz_app.urls')),
 ]
 
-if settings.DEBUG:
+if settings.QUIZ_SERVE_ASSETS:
+    # Production serving without a CDN: cache headers, ETags, ranges, precompressed static
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.+)$' % re.escape(settings.STATIC_URL.lstrip('/')), serving.static_file),
+        re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serving.media_file),
+    ]
+elif settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -21,4 +21,532 @@ document.addEventListener('DOMContentLoaded', function() {
     tooltipTriggerList.map(function (tooltipTriggerEl) {
         return new bootstrap.Tooltip(tooltipTriggerEl);
     });
-});
\ No newline at end of file
+});
+
+// ----------------- Quiz session: prefetched questions, batched answers -----------------
+// quiz.html marks the container with data-quiz-session. From there the
+// questions come from the session API a batch at a time (with their images
+// prefetched) and are rendered here without a page load. Answers go into a
+// queue kept in localStorage and are sent to the bulk grading endpoint in
+// batches; when the network is down they stay queued and are retried with
+// backoff, or when the browser comes back online. The queue belongs to one
+// attempt: retaking the quiz drops what the old attempt left queued. A batch
+// the server rejects is sent again one answer at a time, so only the answer
+// it objects to is dropped (with its error shown). Without JavaScript the
+// plain form posts still work.
+(function () {
+    const PREFETCH_COUNT = 5;        // questions per request
+    const PREFETCH_AHEAD = 2;        // fetch more when fewer than this are left
+    const FLUSH_DELAY = 150;         // ms to collect answers into one batch
+    const FEEDBACK_TIMEOUT = 4000;   // ms before moving on with an answer still queued
+    const RETRY_DELAYS = [1000, 2000, 5000, 10000, 30000];
+    const MAX_BATCH = 100;
+    const STORAGE_PREFIX = "quiz-answers-";
+
+    function escapeHtml(value) {
+        return String(value == null ? "" : value).replace(/[&<>"']/g, function (c) {
+            return {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"}[c];
+        });
+    }
+
+    function clientId() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return Date.now().toString(36) + Math.random().toString(36).slice(2);
+    }
+
+    function pictureHtml(image, alt, cssClass, sizes) {
+        if (!image) {
+            return "";
+        }
+        const sources = image.sources.map(function (source) {
+            return '<source type="' + escapeHtml(source.type) + '" srcset="' + escapeHtml(source.srcset) +
+                '" sizes="' + escapeHtml(sizes) + '">';
+        }).join("");
+        return "<picture>" + sources + '<img src="' + escapeHtml(image.url) + '" alt="' + escapeHtml(alt) +
+            '" decoding="async" class="' + escapeHtml(cssClass) + '"></picture>';
+    }
+
+    function prefetchImage(image, sizes) {
+        if (!image) {
+            return;
+        }
+        // Let the browser choose the same candidate it will use when rendering
+        const img = new Image();
+        const webp = image.sources.find(function (source) { return source.type === "image/webp"; });
+        if (webp) {
+            img.sizes = sizes;
+            img.srcset = webp.srcset;
+        }
+        img.src = image.url;
+    }
+
+    // ----------------- Answer queue -----------------
+    function AnswerQueue(url, csrfToken, storageKey) {
+        this.url = url;
+        this.csrfToken = csrfToken;
+        this.storageKey = storageKey;
+        this.waiting = {};       // client_id -> callback for answers sent from this page
+        this.inFlight = false;
+        this.failures = 0;
+        this.timer = null;
+        this.batchSize = MAX_BATCH;
+        try {
+            this.items = JSON.parse(localStorage.getItem(storageKey)) || [];
+        } catch (e) {
+            this.items = [];
+        }
+        window.addEventListener("online", this.flush.bind(this));
+        if (this.items.length) {
+            this.schedule(0);
+        }
+    }
+
+    AnswerQueue.prototype.save = function () {
+        try {
+            localStorage.setItem(this.storageKey, JSON.stringify(this.items));
+        } catch (e) {
+            // Private mode or quota: the queue still works for this page
+        }
+    };
+
+    AnswerQueue.prototype.push = function (answer, callback) {
+        this.items.push(answer);
+        this.waiting[answer.client_id] = callback;
+        this.save();
+        this.schedule(FLUSH_DELAY);
+    };
+
+    AnswerQueue.prototype.schedule = function (delay) {
+        if (this.timer === null) {
+            this.timer = setTimeout(this.flush.bind(this), delay);
+        }
+    };
+
+    AnswerQueue.prototype.retry = function () {
+        const delay = RETRY_DELAYS[Math.min(this.failures, RETRY_DELAYS.length - 1)];
+        this.failures += 1;
+        this.schedule(delay);
+    };
+
+    AnswerQueue.prototype.flush = function () {
+        clearTimeout(this.timer);
+        this.timer = null;
+        if (this.inFlight || !this.items.length) {
+            return Promise.resolve();
+        }
+        const queue = this;
+        const batch = this.items.slice(0, this.batchSize);
+        this.inFlight = true;
+        return fetch(this.url, {
+            method: "POST",
+            credentials: "same-origin",
+            headers: {"Content-Type": "application/json", "X-CSRFToken": this.csrfToken},
+            body: JSON.stringify({answers: batch}),
+        }).then(function (response) {
+            if (response.status >= 500) {
+                throw new Error("server error " + response.status);
+            }
+            return response.json().then(function (data) { return {status: response.status, data: data}; });
+        }).then(function (reply) {
+            queue.inFlight = false;
+            if (reply.status === 401 || reply.status === 403) {
+                return;  // Logged out: keep the answers until the user is back
+            }
+            queue.failures = 0;
+            if (reply.status === 400 && batch.length > 1) {
+                // One bad answer rejects the whole batch: find it, keeping the others
+                queue.batchSize = 1;
+                queue.schedule(0);
+                return;
+            }
+            const sent = {};
+            batch.forEach(function (answer) { sent[answer.client_id] = true; });
+            queue.items = queue.items.filter(function (answer) { return !sent[answer.client_id]; });
+            queue.save();
+            let results = reply.data.results || [];
+            if (reply.status === 400) {
+                queue.batchSize = MAX_BATCH;
+                results = [{client_id: batch[0].client_id, status: "rejected", error: reply.data.error}];
+                if (!queue.waiting[batch[0].client_id] && window.console) {
+                    console.warn("Dropped a queued answer the server rejected: " + reply.data.error);
+                }
+            }
+            results.forEach(function (result) {
+                const callback = queue.waiting[result.client_id];
+                delete queue.waiting[result.client_id];
+                if (callback) {
+                    callback(result);
+                }
+            });
+            if (queue.items.length) {
+                queue.schedule(0);
+            }
+        }).catch(function () {
+            queue.inFlight = false;
+            queue.retry();
+        });
+    };
+
+    // ----------------- Session -----------------
+    function QuizSession(root) {
+        const data = root.dataset;
+        this.root = root;
+        this.questionsUrl = data.questionsUrl;
+        this.resultsUrl = data.resultsUrl;
+        this.questionUrl = data.questionUrl;    // ends in "/0/" for the question id
+        this.questions = {};
+        this.nextStart = null;
+        this.loading = null;
+        this.hintUsed = {};
+        // Per user (whoever logs in next on this browser must not send them) and attempt
+        const subjectPrefix = STORAGE_PREFIX + data.userId + "-" + data.subjectId + "-";
+        clearQueues(subjectPrefix, subjectPrefix + data.attemptId);
+        this.queue = new AnswerQueue(
+            data.answersUrl, root.querySelector("[name=csrfmiddlewaretoken]").value, subjectPrefix + data.attemptId
+        );
+        this.card = root.querySelector(".quiz-card-body");
+        this.load(data.questionId).then(this.show.bind(this, Number(data.questionId), false));
+        window.addEventListener("popstate", function (event) {
+            if (event.state && this.questions[event.state.questionId]) {
+                this.show(event.state.questionId, false);
+            } else {
+                window.location.reload();
+            }
+        }.bind(this));
+    }
+
+    QuizSession.prototype.load = function (start) {
+        const session = this;
+        const url = this.questionsUrl + "?count=" + PREFETCH_COUNT + "&start=" + encodeURIComponent(start);
+        this.loading = fetch(url, {credentials: "same-origin"}).then(function (response) {
+            if (!response.ok) {
+                throw new Error("could not load questions");
+            }
+            return response.json();
+        }).then(function (batch) {
+            session.total = batch.total_questions;
+            session.maxAttempts = batch.max_attempts;
+            session.nextStart = batch.next_start;
+            batch.questions.forEach(function (question) {
+                session.questions[question.id] = question;
+                prefetchImage(question.image, "(min-width: 768px) 640px, 100vw");
+                question.options.forEach(function (option) { prefetchImage(option.image, "320px"); });
+            });
+            session.loading = null;
+        });
+        return this.loading;
+    };
+
+    QuizSession.prototype.prefetch = function (question) {
+        let ahead = 0;
+        let id = question.next_id;
+        while (id && this.questions[id] && ahead < PREFETCH_AHEAD) {
+            id = this.questions[id].next_id;
+            ahead += 1;
+        }
+        if (ahead < PREFETCH_AHEAD && this.nextStart && !this.loading) {
+            this.load(this.nextStart).catch(function () {});
+        }
+    };
+
+    QuizSession.prototype.go = function (questionId) {
+        if (!questionId) {
+            // Make sure every answer is recorded before the results are computed
+            const resultsUrl = this.resultsUrl;
+            this.queue.flush().then(function () { window.location.href = resultsUrl; });
+            return;
+        }
+        if (this.questions[questionId]) {
+            this.show(questionId, true);
+        } else if (this.loading) {
+            this.loading.then(this.go.bind(this, questionId));
+        } else {
+            window.location.href = this.questionUrl.replace(/0\/$/, questionId + "/");
+        }
+    };
+
+    QuizSession.prototype.show = function (questionId, push) {
+        const question = this.questions[questionId];
+        if (!question) {
+            return;
+        }
+        this.current = question;
+        if (push) {
+            history.pushState({questionId: questionId}, "", this.questionUrl.replace(/0\/$/, questionId + "/"));
+        } else {
+            history.replaceState({questionId: questionId}, "");
+        }
+
+        const bar = this.root.querySelector(".progress-bar");
+        bar.style.width = Math.round(question.position * 100 / this.total) + "%";
+        bar.setAttribute("aria-valuenow", question.position);
+        this.root.querySelector(".question-counter").textContent =
+            "Question " + question.position + " of " + this.total;
+
+        const options = question.options.map(function (option) {
+            return '<label class="list-group-item d-flex align-items-center option" data-option-id="' + option.id + '">' +
+                '<input type="radio" name="answer" value="' + option.id + '" class="form-check-input me-2">' +
+                escapeHtml(option.text_content) +
+                pictureHtml(option.image, option.text_content, "img-fluid option-image", "320px") +
+                "</label>";
+        }).join("");
+
+        this.card.innerHTML =
+            '<h5 class="mb-3">' + escapeHtml(question.text_content) + "</h5>" +
+            (question.image ? '<div class="question-image mb-3">' +
+                pictureHtml(question.image, question.text_content, "img-fluid", "(min-width: 768px) 640px, 100vw") +
+                "</div>" : "") +
+            '<form class="session-form" novalidate>' +
+            '<div class="list-group options-container">' + options + "</div>" +
+            '<div class="session-feedback"></div>' +
+            '<div class="session-hint mt-3 text-center" style="display:none;">' +
+            '<button type="button" class="btn btn-outline-info btn-sm session-hint-btn">' +
+            '<i class="fas fa-lightbulb"></i> Show Hint</button>' +
+            '<div class="hint-box mt-2" style="display:none;"><strong>Hint:</strong> ' +
+            escapeHtml(question.hint) + "</div></div>" +
+            '<div class="mt-4 d-flex justify-content-between">' +
+            (question.previous_id ? '<button type="button" class="btn btn-secondary session-previous">' +
+                '<i class="fas fa-arrow-left"></i> Previous</button>' : "<span></span>") +
+            '<button type="submit" class="btn btn-primary session-submit">' +
+            '<i class="fas fa-paper-plane"></i> Submit</button>' +
+            "</div></form>";
+
+        const session = this;
+        const form = this.card.querySelector(".session-form");
+        form.addEventListener("submit", function (event) {
+            event.preventDefault();
+            session.submit(question);
+        });
+        const previous = form.querySelector(".session-previous");
+        if (previous) {
+            previous.addEventListener("click", function () { session.go(question.previous_id); });
+        }
+        form.querySelector(".session-hint-btn").addEventListener("click", function () {
+            const box = form.querySelector(".hint-box");
+            box.style.display = box.style.display === "none" ? "block" : "none";
+            session.hintUsed[question.id] = true;
+        });
+
+        if (question.progress.finished) {
+            this.finish(question, {
+                type: "info", icon: "check-circle", title: "Already Completed",
+                message: "You have finished this question.",
+            });
+        }
+        this.prefetch(question);
+    };
+
+    QuizSession.prototype.feedback = function (feedback) {
+        this.card.querySelector(".session-feedback").innerHTML =
+            '<div class="alert alert-' + feedback.type + ' mt-3" role="alert">' +
+            '<i class="fas fa-' + feedback.icon + '"></i> <strong>' + escapeHtml(feedback.title) + "</strong> - " +
+            escapeHtml(feedback.message) +
+            (feedback.explanation ? '<hr><p class="mb-0">' + escapeHtml(feedback.explanation) + "</p>" : "") +
+            "</div>";
+    };
+
+    QuizSession.prototype.finish = function (question, feedback) {
+        // Lock the options and swap Submit for Next / Finish
+        const form = this.card.querySelector(".session-form");
+        form.querySelectorAll("input[name=answer]").forEach(function (input) { input.disabled = true; });
+        const submit = form.querySelector(".session-submit");
+        submit.type = "button";
+        submit.className = "btn btn-success session-next";
+        submit.innerHTML = question.next_id ? 'Next <i class="fas fa-arrow-right"></i>'
+            : '<i class="fas fa-flag-checkered"></i> Finish';
+        submit.onclick = this.go.bind(this, question.next_id);
+        if (feedback) {
+            this.feedback(feedback);
+        }
+    };
+
+    QuizSession.prototype.submit = function (question) {
+        const selected = this.card.querySelector("input[name='answer']:checked");
+        if (!selected) {
+            this.feedback({
+                type: "warning", icon: "exclamation-triangle", title: "No Answer Selected",
+                message: "Please select an option before submitting.",
+            });
+            return;
+        }
+        const submit = this.card.querySelector(".session-submit");
+        submit.disabled = true;
+
+        const session = this;
+        let answered = false;
+        const timeout = setTimeout(function () {
+            // Offline or slow: keep the answer queued and let the user carry on
+            answered = true;
+            submit.disabled = false;
+            session.finish(question, {
+                type: "info", icon: "cloud-upload-alt", title: "Answer Saved",
+                message: "It will be graded as soon as the connection is back.",
+            });
+        }, FEEDBACK_TIMEOUT);
+
+        this.queue.push({
+            client_id: clientId(),
+            question_id: question.id,
+            option_id: Number(selected.value),
+            hint_used: Boolean(this.hintUsed[question.id]),
+        }, function (result) {
+            clearTimeout(timeout);
+            question.progress.attempts = result.attempts;
+            question.progress.finished = result.finished;
+            if (answered || session.current !== question) {
+                return;
+            }
+            submit.disabled = false;
+            session.graded(question, selected, result);
+        });
+    };
+
+    QuizSession.prototype.graded = function (question, selected, result) {
+        const form = this.card.querySelector(".session-form");
+        if (result.status === "rejected") {
+            this.feedback({
+                type: "error", icon: "exclamation-triangle", title: "Answer Not Recorded",
+                message: result.error || "The server could not accept this answer. Please try again.",
+            });
+        } else if (result.status === "invalid") {
+            window.location.reload();
+        } else if (result.status === "expired") {
+            // The exam is over and has been submitted
+            window.location.href = this.resultsUrl;
+        } else if (result.status === "correct") {
+            selected.closest(".option").classList.add("correct-option");
+            this.go(question.next_id);
+        } else if (result.status === "closed" && !result.correct_option_id) {
+            this.finish(question, {
+                type: "info", icon: "check-circle", title: "Already Completed",
+                message: "You have already answered this question correctly.",
+            });
+        } else if (result.finished) {
+            form.querySelectorAll(".option").forEach(function (label) {
+                const isCorrect = Number(label.dataset.optionId) === result.correct_option_id;
+                label.classList.add(isCorrect ? "correct-option" : "wrong-option");
+            });
+            const correct = question.options.find(function (option) { return option.id === result.correct_option_id; });
+            this.finish(question, {
+                type: "error", icon: "times-circle",
+                title: result.status === "closed" ? "Already Completed" : "Attempts Completed",
+                message: "The correct answer is: " + (correct ? correct.text_content : ""),
+                explanation: result.explanation,
+            });
+        } else {
+            selected.closest(".option").classList.add("wrong-option");
+            selected.checked = false;
+            form.querySelector(".session-hint").style.display = "block";
+            this.feedback({
+                type: "error", icon: "times-circle", title: "Wrong Answer",
+                message: "That's not correct. Try again or use a hint.",
+            });
+        }
+    };
+
+    // Drop the queues whose key starts with prefix, except the one named keep
+    function clearQueues(prefix, keep) {
+        try {
+            Object.keys(localStorage).forEach(function (key) {
+                if (key.indexOf(prefix) === 0 && key !== keep) {
+                    localStorage.removeItem(key);
+                }
+            });
+        } catch (e) {
+            // No storage, nothing to clear
+        }
+    }
+
+    document.addEventListener("DOMContentLoaded", function () {
+        const root = document.querySelector("[data-quiz-session]");
+        // Answers still queued at logout are dropped rather than left for the next user,
+        // and a retake drops what the old attempt left queued
+        document.querySelectorAll("[data-logout]").forEach(function (link) {
+            link.addEventListener("click", function () { clearQueues(STORAGE_PREFIX); });
+        });
+        document.querySelectorAll("[data-retake]").forEach(function (form) {
+            form.addEventListener("submit", function () {
+                clearQueues(STORAGE_PREFIX + form.dataset.userId + "-" + form.dataset.subjectId + "-");
+            });
+        });
+        if (root && window.fetch && window.history && window.history.pushState) {
+            new QuizSession(root);
+        }
+    });
+})();
+
+// ----------------- Exam countdown -----------------
+// quiz.html marks the timer with data-exam-timer on timed subjects. The
+// countdown runs here against the server's deadline, shifted by the clock
+// difference measured from the server's "now". The heartbeat only corrects
+// it: a server-sent events stream when the page offers one, otherwise a
+// poll of the JSON status every interval and whenever the tab comes back.
+(function () {
+    "use strict";
+
+    function ExamTimer(el) {
+        this.el = el;
+        this.display = el.querySelector(".exam-remaining");
+        this.statusUrl = el.dataset.statusUrl;
+        this.eventsUrl = el.dataset.eventsUrl;
+        this.resultsUrl = el.dataset.resultsUrl;
+        this.interval = Number(el.dataset.interval) * 1000;
+        this.grace = Number(el.dataset.grace) * 1000;
+        this.sync({deadline: el.dataset.deadline, now: el.dataset.now, expired: false});
+
+        const timer = this;
+        this.ticker = window.setInterval(function () { timer.tick(); }, 1000);
+        this.tick();
+        if (this.eventsUrl && window.EventSource) {
+            const source = new EventSource(this.eventsUrl);
+            source.onmessage = function (event) { timer.sync(JSON.parse(event.data)); };
+        } else {
+            window.setInterval(function () { timer.poll(); }, this.interval);
+            document.addEventListener("visibilitychange", function () {
+                if (document.visibilityState === "visible") {
+                    timer.poll();
+                }
+            });
+        }
+    }
+
+    ExamTimer.prototype.sync = function (state) {
+        if (state.expired) {
+            window.location.href = this.resultsUrl;
+            return;
+        }
+        this.deadline = Date.parse(state.deadline);
+        this.skew = Date.now() - Date.parse(state.now);
+    };
+
+    ExamTimer.prototype.poll = function () {
+        const timer = this;
+        fetch(this.statusUrl, {headers: {"Accept": "application/json"}})
+            .then(function (response) { return response.ok ? response.json() : null; })
+            .then(function (state) { if (state) { timer.sync(state); } })
+            .catch(function () { /* Offline: keep counting locally */ });
+    };
+
+    ExamTimer.prototype.tick = function () {
+        const remaining = Math.max(this.deadline - (Date.now() - this.skew), 0);
+        const seconds = Math.ceil(remaining / 1000);
+        const minutes = Math.floor(seconds / 60);
+        this.display.textContent = minutes + ":" + String(seconds % 60).padStart(2, "0");
+        this.el.classList.toggle("exam-ending", seconds <= 60);
+        if (remaining === 0) {
+            window.clearInterval(this.ticker);
+            // Answers sent in the last moment are still accepted during the grace period
+            const resultsUrl = this.resultsUrl;
+            window.setTimeout(function () { window.location.href = resultsUrl; }, this.grace + 1000);
+        }
+    };
+
+    document.addEventListener("DOMContentLoaded", function () {
+        const el = document.querySelector("[data-exam-timer]");
+        if (el) {
+            new ExamTimer(el);
+        }
+    });
+})();